@@ -1,21 +1,46 @@
 import os
+import re
+import math
 import logging
 from functools import wraps
+import time
+import uuid
+import random
+import tempfile
+import threading
 from flask import (
     Flask, request, jsonify,
-    send_from_directory, url_for
+    send_file, redirect, url_for
 )
 from werkzeug.utils import secure_filename
-import tempfile
 from datetime import datetime, timezone 
 
 try:
     from app.config import (
-        OUTPUT_DIR, SUPPORTED_LANGUAGES,
+        SUPPORTED_LANGUAGES,
         DEFAULT_TTS_PARAMS, DEFAULT_AUDIO_POSTPROCESSING_PARAMS,
-        VALID_API_KEYS, API_KEY_HEADER, MIN_CHAR_PER_SENTENCE_INPUT 
+        VALID_API_KEYS, API_KEY_HEADER, MIN_CHAR_PER_SENTENCE_INPUT,
+        STORAGE_DOWNLOAD_MODE, DEFAULT_MODEL_ID, SUPPORTED_OUTPUT_SAMPLE_RATES,
+        API_MAX_REQUEST_BYTES, PROFILING_API_KEYS, PROFILING_SAMPLE_RATE,
+        SYNC_TTS_ENABLED, SYNC_TTS_MAX_CHARS, SYNC_TTS_MAX_SENTENCES, SYNC_TTS_MAX_CONCURRENCY,
+        SYNC_TTS_SLOT_WAIT_SECONDS, SYNC_TTS_WARMUP_ENABLED, DEFAULT_SPEAKER_WAV_PATH
     )
     from app.application_services.tts_service import ApplicationTTSService
+    from app.application_services.task_state_cache import TaskStateCache, TaskStateSnapshot
+    from app.application_services.admission_control import AdmissionController
+    from app.application_services.capacity_service import FleetCapacityService
+    from app.application_services.fair_scheduler import FairTaskScheduler
+    from app.infrastructure.worker_registry import get_worker_registry
+    from app.infrastructure.rate_limiter import ApiKeyRateLimiter, api_key_id
+    from app.infrastructure.task_cancellation import get_task_cancellation
+    from app.domain.services.synthesis_cost_estimator import SynthesisCostEstimator
+    from app.domain.model_registry import discover_model_specs, model_queue_name
+    from app.domain.services.speaker_reference_processor import SpeakerReferenceProcessor, SpeakerReferenceError, copy_bounded
+    from app.infrastructure.storage import get_storage, speaker_upload_key, profile_key, ObjectNotFoundError
+    from app.infrastructure.synthesis_checkpoints import list_segments, build_partial_wav
+    from app.metrics import metrics
+    from app.tracing import tracer
+    from app.logging_setup import configure_logging
     from app.celery_app import celery_app
     from app.tasks import generate_tts_task
 except ImportError as e:
@@ -23,13 +48,12 @@ except ImportError as e:
           "Đảm bảo 'src' đã được thêm vào sys.path và các module con tồn tại.")
     raise
 
-if not logging.getLogger().hasHandlers(): 
-    log_level = os.environ.get("LOG_LEVEL", "INFO").upper()
-    logging.basicConfig(level=log_level,
-                        format='%(asctime)s - %(name)s - %(levelname)s - [%(module)s.%(funcName)s:%(lineno)d] - %(message)s')
+configure_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# Werkzeug từ chối (413) ngay khi đọc request vượt giới hạn này, trước khi toàn bộ body được ghi ra đĩa
+app.config["MAX_CONTENT_LENGTH"] = API_MAX_REQUEST_BYTES
 tts_app_service: ApplicationTTSService | None = None 
 
 def initialize_global_services():
@@ -40,17 +64,51 @@ def initialize_global_services():
         try:
             tts_app_service = ApplicationTTSService()
             logger.info("ApplicationTTSService đã được khởi tạo thành công.")
+            if SYNC_TTS_ENABLED and SYNC_TTS_WARMUP_ENABLED:
+                tts_app_service.warm_up()
         except Exception as e_init:
             logger.critical(f"LỖI NGHIÊM TRỌNG khi khởi tạo ApplicationTTSService: {e_init}", exc_info=True)
     else:
         logger.info("ApplicationTTSService đã được khởi tạo trước đó, bỏ qua.")
+    fair_scheduler.ensure_dispatcher_thread()
+
+cost_estimator = SynthesisCostEstimator()
+capacity_service = FleetCapacityService(celery_app, get_worker_registry(), cost_estimator)
+rate_limiter = ApiKeyRateLimiter()
+fair_scheduler = FairTaskScheduler(celery_app, generate_tts_task, worker_slots_provider=capacity_service.get_ready_slots)
+admission_controller = AdmissionController(
+    celery_app, cost_estimator, worker_slots_provider=capacity_service.get_ready_slots,
+    pending_tasks_provider=fair_scheduler.pending_total if fair_scheduler.enabled else None
+)
 
-if not os.path.exists(OUTPUT_DIR):
-    try:
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
-        logger.info(f"API: Thư mục output '{OUTPUT_DIR}' đã được tạo hoặc đã tồn tại.")
-    except OSError as e:
-        logger.error(f"API: Không thể tạo thư mục output '{OUTPUT_DIR}': {e}")
+def _fetch_task_state(task_id: str) -> TaskStateSnapshot:
+    """Đọc trạng thái task từ result backend bằng một lần round-trip duy nhất."""
+    meta = celery_app.backend.get_task_meta(task_id)
+    snapshot = TaskStateSnapshot(
+        task_id=task_id,
+        status=str(meta.get("status", "PENDING")).upper(),
+        result=meta.get("result"),
+        traceback=meta.get("traceback")
+    )
+    if snapshot.status == "SUCCESS":
+        admission_controller.observe_task_result(snapshot.result)
+    return snapshot
+
+task_state_cache = TaskStateCache(_fetch_task_state)
+speaker_reference_processor = SpeakerReferenceProcessor()
+# Số tổng hợp /tts/sync chạy đồng thời trên model của process API này
+sync_synthesis_slots = threading.BoundedSemaphore(max(1, SYNC_TTS_MAX_CONCURRENCY))
+
+MODEL_ID_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$")
+
+def _get_available_model_ids() -> list[str]:
+    """Các model_id mà worker báo có thể tải (qua heartbeat); nếu chưa có worker nào thì đọc thư mục model cục bộ."""
+    available_model_ids = capacity_service.get_snapshot()["available_models"]
+    return available_model_ids or list(discover_model_specs())
+
+@app.errorhandler(413)
+def request_too_large_handler(error):
+    return jsonify({"error": f"Request quá lớn. Tối đa {API_MAX_REQUEST_BYTES // (1024 * 1024)} MB."}), 413
 
 def require_api_key(f):
     """Decorator để yêu cầu API key cho một endpoint."""
@@ -109,10 +167,172 @@ def health_check_endpoint():
         }
     }), status_code
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Endpoint trả về số liệu (counter, gauge, summary) của process API và counter cộng dồn của các worker."""
+    response_data = metrics.snapshot()
+    try:
+        response_data["fleet_counters"] = get_worker_registry().get_fleet_counters()
+    except Exception as e_fleet:
+        logger.debug(f"/metrics: Không đọc được counter của fleet: {e_fleet}")
+        response_data["fleet_counters"] = {}
+    return jsonify(response_data)
+
+@app.route('/capacity', methods=['GET'])
+def capacity_endpoint():
+    """Năng lực xử lý của fleet: độ dài queue, worker còn sống, RTF gần đây và backlog ước lượng (giây)."""
+    snapshot = capacity_service.get_snapshot()
+    status_code = 200 if snapshot["ready_workers"] > 0 else 503
+    return jsonify(snapshot), status_code
+
+@app.route('/speakers', methods=['GET'])
+def list_speakers_endpoint():
+    """Danh sách giọng có sẵn (latents tính sẵn trong speakers_xtts.pth), dùng qua tham số speaker_name của /tts."""
+    if tts_app_service is None:
+        logger.error("/speakers: ApplicationTTSService chưa được khởi tạo.")
+        return jsonify({"error": "Dịch vụ hiện không khả dụng. Vui lòng thử lại sau."}), 503
+    speaker_names = tts_app_service.get_speaker_names()
+    return jsonify({"speakers": speaker_names, "count": len(speaker_names)})
+
+@app.route('/models', methods=['GET'])
+def list_models_endpoint():
+    """Danh sách checkpoint có thể dùng qua tham số model_id và các worker đang giữ sẵn từng model."""
+    snapshot = capacity_service.get_snapshot()
+    return jsonify({
+        "default_model_id": DEFAULT_MODEL_ID,
+        "models": [
+            {"model_id": model_id, "resident_on": snapshot["model_placement"].get(model_id, [])}
+            for model_id in _get_available_model_ids()
+        ]
+    })
+
+@app.route('/usage', methods=['GET'])
+@require_api_key
+def usage_endpoint():
+    """Hạn mức, mức còn lại của token bucket, counter sử dụng và số task đang chờ lập lịch của API key gửi request."""
+    key_id = api_key_id(request.headers.get(API_KEY_HEADER))
+    try:
+        usage = rate_limiter.get_usage(key_id)
+        pending_tasks = fair_scheduler.pending_count(key_id) if fair_scheduler.enabled else 0
+    except Exception as e_usage:
+        logger.warning(f"/usage: Không đọc được số liệu sử dụng của key {key_id}: {e_usage}")
+        return jsonify({"error": "Không đọc được số liệu sử dụng. Vui lòng thử lại sau."}), 503
+    return jsonify({
+        "key_id": key_id,
+        **usage,
+        "fair_scheduling": {
+            "enabled": fair_scheduler.enabled,
+            "weight": fair_scheduler.weight_for(key_id),
+            "pending_tasks": pending_tasks
+        },
+        "timestamp": datetime.now(timezone.utc).isoformat()
+    })
+
 @app.route('/tts', methods=['POST'])
 @require_api_key
 def api_tts_endpoint_route():
     """Endpoint chính để yêu cầu tổng hợp giọng nói (TTS) bất đồng bộ qua Celery."""
+    with tracer.span("api.tts_request", http_route="/tts", client_ip=request.remote_addr) as request_span:
+        response = _handle_tts_request()
+        request_span.set_attribute("http.status_code", response[1] if isinstance(response, tuple) else response.status_code)
+        return response
+
+@app.route('/tts/sync', methods=['POST'])
+@require_api_key
+def api_tts_sync_endpoint_route():
+    """
+    Tổng hợp đồng bộ cho văn bản ngắn: trả file WAV ngay trong response (200). Nếu mọi slot tổng hợp đồng bộ
+    của process đang bận, request được xử lý như /tts (202 kèm task_id) và header X-TTS-Mode là "queued".
+    """
+    with tracer.span("api.tts_sync_request", http_route="/tts/sync", client_ip=request.remote_addr) as request_span:
+        if not SYNC_TTS_ENABLED:
+            response = jsonify({"error": "Endpoint /tts/sync đang bị tắt. Vui lòng dùng /tts."}), 404
+        else:
+            input_text = request.form.get('text', '')
+            sentence_count = cost_estimator.count_sentences(input_text)
+            if len(input_text) > SYNC_TTS_MAX_CHARS or sentence_count > SYNC_TTS_MAX_SENTENCES:
+                logger.warning(f"/tts/sync: Văn bản quá dài cho chế độ đồng bộ ({len(input_text)} ký tự, {sentence_count} câu). IP: {request.remote_addr}")
+                metrics.increment("tts_sync_requests_total", outcome="too_long")
+                response = jsonify({
+                    "error": f"/tts/sync chỉ nhận tối đa {SYNC_TTS_MAX_CHARS} ký tự và {SYNC_TTS_MAX_SENTENCES} câu. Vui lòng dùng /tts cho văn bản dài.",
+                    "text_chars": len(input_text),
+                    "sentence_count": sentence_count
+                }), 413
+            else:
+                response = _handle_tts_request(synchronous=True)
+        request_span.set_attribute("http.status_code", response[1] if isinstance(response, tuple) else response.status_code)
+        return response
+
+def _synthesize_sync(input_text: str, input_lang_code: str, speaker_file_storage, apply_text_normalization: bool,
+                     model_params: dict, postproc_params: dict, speaker_name: str | None = None):
+    """
+    Tổng hợp trong process API nếu lấy được slot trong SYNC_TTS_SLOT_WAIT_SECONDS.
+    Trả về None (kèm lý do) khi phải chuyển sang queue; khi đó chưa đọc file giọng mẫu tải lên.
+    """
+    with tracer.span("api.sync_slot_wait") as slot_span:
+        acquired = sync_synthesis_slots.acquire(timeout=SYNC_TTS_SLOT_WAIT_SECONDS)
+        slot_span.set_attribute("acquired", acquired)
+    if not acquired:
+        return None, "saturated"
+    try:
+        with tempfile.TemporaryDirectory(prefix="sync_speaker_") as speaker_dir:
+            speaker_audio_path = DEFAULT_SPEAKER_WAV_PATH
+            if speaker_file_storage and speaker_file_storage.filename:
+                file_suffix = os.path.splitext(secure_filename(speaker_file_storage.filename))[1].lower() or ".wav"
+                if file_suffix not in ['.wav', '.mp3', '.ogg', '.flac']:
+                    return (jsonify({"error": "Loại file giọng mẫu không hợp lệ. Chỉ hỗ trợ .wav, .mp3, .ogg, .flac."}), 400), None
+                upload_path = os.path.join(speaker_dir, f"upload{file_suffix}")
+                with tracer.span("api.speaker_upload", file_suffix=file_suffix):
+                    with open(upload_path, "wb") as f_upload:
+                        copy_bounded(speaker_file_storage.stream, f_upload)
+                    prepared_reference = speaker_reference_processor.prepare(upload_path)
+                    speaker_audio_path = os.path.join(speaker_dir, "reference.wav")
+                    with open(speaker_audio_path, "wb") as f_reference:
+                        f_reference.write(prepared_reference.audio_data.getbuffer())
+
+            started_at = time.perf_counter()
+            with tracer.span("api.sync_synthesis", language=input_lang_code, text_chars=len(input_text)):
+                audio_output, error_msg = tts_app_service.synthesize_short_text(
+                    input_text, input_lang_code, speaker_audio_path, apply_text_normalization, model_params, postproc_params,
+                    speaker_name=speaker_name
+                )
+            synthesis_seconds = time.perf_counter() - started_at
+    except SpeakerReferenceError as e_reference:
+        logger.warning(f"/tts/sync: Giọng mẫu bị từ chối: {e_reference}. IP: {request.remote_addr}")
+        return (jsonify({"error": str(e_reference)}), e_reference.status_code), None
+    except Exception as e_sync:
+        # file giọng mẫu tải lên đã được đọc nên không chuyển sang queue được: trả lỗi JSON như các endpoint khác
+        logger.error(f"/tts/sync: Lỗi khi tổng hợp đồng bộ: {e_sync}", exc_info=True)
+        metrics.increment("tts_sync_requests_total", outcome="error")
+        return (jsonify({"error": "Lỗi hệ thống khi tổng hợp giọng nói."}), 500), None
+    finally:
+        sync_synthesis_slots.release()
+
+    if error_msg or audio_output is None:
+        logger.error(f"/tts/sync: Lỗi khi tổng hợp đồng bộ: {error_msg}")
+        metrics.increment("tts_sync_requests_total", outcome="error")
+        return (jsonify({"error": f"Lỗi khi tổng hợp giọng nói: {error_msg}"}), 500), None
+
+    metrics.increment("tts_sync_requests_total", outcome="synthesized")
+    metrics.observe("tts_sync_synthesis_seconds", synthesis_seconds)
+    logger.info(f"/tts/sync: Tổng hợp {len(input_text)} ký tự -> {audio_output.duration_seconds:.2f}s âm thanh trong {synthesis_seconds:.2f}s.")
+    response = send_file(audio_output.audio_data, mimetype=audio_output.mimetype, as_attachment=True, download_name=audio_output.filename)
+    response.headers["X-TTS-Mode"] = "sync"
+    response.headers["X-Audio-Duration-Seconds"] = f"{audio_output.duration_seconds:.3f}"
+    response.headers["X-Synthesis-Seconds"] = f"{synthesis_seconds:.3f}"
+    response.headers["Cache-Control"] = "no-store"
+    return response, None
+
+def _refund_rate_limit(key_id: str, chars: int, rate_limit, rejected_counter: str = "rejected_requests") -> None:
+    """Request đã bị trừ hạn mức nhưng không được xử lý: trả lại để client không bị 429 khi thử lại."""
+    if rate_limit is None or not rate_limit.allowed:
+        return
+    try:
+        rate_limiter.refund(key_id, chars, rejected_counter)
+    except Exception as e_refund:
+        logger.warning(f"/tts: Không hoàn lại được hạn mức cho API key {key_id}: {e_refund}")
+
+def _handle_tts_request(synchronous: bool = False):
     if tts_app_service is None:
         logger.error("/tts: ApplicationTTSService chưa được khởi tạo.")
         return jsonify({"error": "Hệ thống tạm thời không xử lý được yêu cầu do service chưa sẵn sàng."}), 503
@@ -132,8 +352,24 @@ def api_tts_endpoint_route():
         logger.warning(f"/tts: Ngôn ngữ không được hỗ trợ '{input_lang_code}'. IP: {request.remote_addr}")
         return jsonify({"error": f"Ngôn ngữ '{input_lang_code}' không được hỗ trợ. Các ngôn ngữ được hỗ trợ: {', '.join(SUPPORTED_LANGUAGES.keys())}"}), 400
 
+    requested_model_id = request.form.get('model_id', '').strip() or DEFAULT_MODEL_ID
+    if requested_model_id != DEFAULT_MODEL_ID:
+        if not MODEL_ID_PATTERN.match(requested_model_id) or requested_model_id not in _get_available_model_ids():
+            logger.warning(f"/tts: model_id không hợp lệ '{requested_model_id}'. IP: {request.remote_addr}")
+            return jsonify({"error": f"Model '{requested_model_id}' không tồn tại. Xem danh sách tại /models."}), 400
+
+    requested_speaker_name = request.form.get('speaker_name', '').strip() or None
+    if requested_speaker_name:
+        uploaded_speaker_file = request.files.get('speaker_audio_file')
+        if uploaded_speaker_file and uploaded_speaker_file.filename:
+            return jsonify({"error": "Chỉ dùng một trong hai tham số 'speaker_name' hoặc 'speaker_audio_file'."}), 400
+        # Giọng có sẵn của checkpoint khác (speakers_xtts.pth riêng) chỉ được kiểm tra ở worker đang giữ model đó
+        if requested_model_id == DEFAULT_MODEL_ID and requested_speaker_name not in tts_app_service.get_speaker_names():
+            logger.warning(f"/tts: speaker_name không tồn tại '{requested_speaker_name}'. IP: {request.remote_addr}")
+            return jsonify({"error": f"Giọng '{requested_speaker_name}' không tồn tại. Xem danh sách tại /speakers."}), 400
+
     form_params = request.form.to_dict()
-    logger.info(f"Nhận yêu cầu TTS: lang='{input_lang_code}', text_len={len(input_text)}. IP: {request.remote_addr}")
+    logger.info(f"Nhận yêu cầu TTS: lang='{input_lang_code}', model='{requested_model_id}', text_len={len(input_text)}. IP: {request.remote_addr}")
     logger.debug(f"Form params nhận được cho TTS: {form_params}")
 
     parsed_model_params = {}
@@ -154,11 +390,78 @@ def api_tts_endpoint_route():
         else:
              parsed_postproc_params[key] = form_params.get(key, default_val)
     
+    output_sample_rate = parsed_postproc_params.get("output_sample_rate", 0)
+    if output_sample_rate and output_sample_rate not in SUPPORTED_OUTPUT_SAMPLE_RATES:
+        logger.warning(f"/tts: output_sample_rate không được hỗ trợ '{output_sample_rate}'. IP: {request.remote_addr}")
+        return jsonify({"error": f"output_sample_rate '{output_sample_rate}' không được hỗ trợ. Các giá trị hợp lệ: {', '.join(map(str, SUPPORTED_OUTPUT_SAMPLE_RATES))}"}), 400
+
     default_normalize_text = DEFAULT_AUDIO_POSTPROCESSING_PARAMS.get('normalize_text', True)
     should_apply_text_normalization = tts_app_service._parse_bool_param(form_params, 'normalize_text', default_normalize_text)
 
-    speaker_audio_path_for_task = "USE_DEFAULT_SPEAKER"
-    temp_speaker_file_to_delete_on_dispatch_error = None
+    profile_requested = tts_app_service._parse_bool_param(form_params, 'profile', False)
+    if profile_requested and request.headers.get(API_KEY_HEADER) not in PROFILING_API_KEYS:
+        logger.warning(f"/tts: API key không được phép bật profiling. IP: {request.remote_addr}")
+        return jsonify({"error": "API Key này không được phép sử dụng 'profile=true'."}), 403
+    should_profile = profile_requested or (PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE)
+
+    key_id = api_key_id(request.headers.get(API_KEY_HEADER))
+    with tracer.span("api.rate_limit"):
+        try:
+            rate_limit = rate_limiter.check_and_consume(key_id, len(input_text))
+        except Exception as e_rate_limit:
+            # Redis lỗi thì không chặn request (giống admission control khi không đọc được broker)
+            logger.warning(f"/tts: Không kiểm tra được rate limit, cho phép request: {e_rate_limit}")
+            metrics.increment("tts_rate_limit_errors_total")
+            rate_limit = None
+    if rate_limit is not None and not rate_limit.allowed:
+        logger.warning(f"/tts: API key {key_id} bị giới hạn ({rate_limit.limited_by}). IP: {request.remote_addr}")
+        error_response = jsonify({
+            "error": rate_limit.reason,
+            "limited_by": rate_limit.limited_by,
+            "limits": {
+                "requests_per_minute": rate_limit.limits.requests_per_minute,
+                "chars_per_minute": rate_limit.limits.chars_per_minute
+            }
+        })
+        if rate_limit.status_code == 429:
+            error_response.headers["Retry-After"] = str(max(1, math.ceil(rate_limit.retry_after_seconds)))
+        return error_response, rate_limit.status_code
+
+    sync_fallback_reason = None
+    if synchronous:
+        # Model của process API là model mặc định; model khác phải qua worker đang giữ nó
+        if requested_model_id != DEFAULT_MODEL_ID:
+            sync_fallback_reason = "model"
+        elif not tts_app_service.check_model_health()[0]:
+            sync_fallback_reason = "model_unavailable"
+        else:
+            sync_response, sync_fallback_reason = _synthesize_sync(
+                input_text, input_lang_code, request.files.get('speaker_audio_file'), should_apply_text_normalization,
+                parsed_model_params, parsed_postproc_params, requested_speaker_name
+            )
+            if sync_response is not None:
+                sync_status = sync_response[1] if isinstance(sync_response, tuple) else sync_response.status_code
+                if sync_status >= 400:
+                    _refund_rate_limit(key_id, len(input_text), rate_limit)
+                return sync_response
+        logger.info(f"/tts/sync: Chuyển sang queue ({sync_fallback_reason}). IP: {request.remote_addr}")
+        metrics.increment("tts_sync_requests_total", outcome=f"queued_{sync_fallback_reason}")
+
+    with tracer.span("api.admission"):
+        admission = admission_controller.evaluate(input_text, input_lang_code, speed=parsed_model_params.get("speed", 1.0))
+    if not admission.accepted:
+        _refund_rate_limit(key_id, len(input_text), rate_limit, "admission_rejected_requests")
+        error_response = jsonify({
+            "error": admission.reason,
+            "queue_depth": admission.queue_depth,
+            "estimated_backlog_seconds": round(admission.backlog_seconds, 1)
+        })
+        if admission.retry_after_seconds is not None:
+            error_response.headers["Retry-After"] = str(admission.retry_after_seconds)
+        return error_response, admission.status_code
+
+    speaker_audio_key_for_task = "USE_DEFAULT_SPEAKER"
+    uploaded_speaker_key_to_delete_on_dispatch_error = None
 
     speaker_file_storage = request.files.get('speaker_audio_file')
     if speaker_file_storage and speaker_file_storage.filename:
@@ -167,96 +470,305 @@ def api_tts_endpoint_route():
             file_suffix = os.path.splitext(s_filename)[1].lower() or ".wav"
             if file_suffix not in ['.wav', '.mp3', '.ogg', '.flac']: 
                 logger.warning(f"/tts: Loại file giọng mẫu không hợp lệ '{file_suffix}'. IP: {request.remote_addr}")
+                _refund_rate_limit(key_id, len(input_text), rate_limit)
                 return jsonify({"error": f"Loại file giọng mẫu không hợp lệ: '{s_filename}'. Chỉ hỗ trợ .wav, .mp3, .ogg, .flac."}), 400
 
-            with tempfile.NamedTemporaryFile(suffix=file_suffix, dir=OUTPUT_DIR, prefix="api_speaker_upload_", delete=False) as tmp_file:
-                speaker_file_storage.save(tmp_file)
-                speaker_audio_path_for_task = tmp_file.name
-            temp_speaker_file_to_delete_on_dispatch_error = speaker_audio_path_for_task
-            logger.info(f"API: File giọng mẫu tải lên đã được lưu tạm tại: {speaker_audio_path_for_task}")
+            with tracer.span("api.speaker_upload", file_suffix=file_suffix), \
+                    tempfile.NamedTemporaryFile(suffix=file_suffix, prefix="speaker_upload_") as tmp_upload:
+                copy_bounded(speaker_file_storage.stream, tmp_upload)
+                tmp_upload.flush()
+                prepared_reference = speaker_reference_processor.prepare(tmp_upload.name)
+
+                upload_key = speaker_upload_key(f"api_speaker_upload_{uuid.uuid4().hex}.wav")
+                get_storage().save_stream(upload_key, prepared_reference.audio_data, content_type="audio/wav")
+            speaker_audio_key_for_task = upload_key
+            uploaded_speaker_key_to_delete_on_dispatch_error = upload_key
+            logger.info(f"API: Giọng mẫu ({prepared_reference.reference_seconds:.1f}s mono PCM16) đã được lưu vào storage với key: {upload_key}")
+        except SpeakerReferenceError as e_reference:
+            logger.warning(f"/tts: Giọng mẫu bị từ chối: {e_reference}. IP: {request.remote_addr}")
+            _refund_rate_limit(key_id, len(input_text), rate_limit)
+            return jsonify({"error": str(e_reference)}), e_reference.status_code
         except Exception as e_save:
             logger.error(f"API: Lỗi khi lưu file giọng mẫu tải lên: {e_save}", exc_info=True)
-            if temp_speaker_file_to_delete_on_dispatch_error and os.path.exists(temp_speaker_file_to_delete_on_dispatch_error):
-                try: os.remove(temp_speaker_file_to_delete_on_dispatch_error)
-                except OSError: pass
+            _refund_rate_limit(key_id, len(input_text), rate_limit)
             return jsonify({"error": f"Lỗi khi xử lý file giọng mẫu tải lên: {str(e_save)}"}), 500
 
+    # Ưu tiên worker đã giữ sẵn model; nếu chưa worker nào có, task vào queue chung và worker nhận task sẽ tự tải model.
+    dispatch_options = {}
+    if requested_model_id != DEFAULT_MODEL_ID and capacity_service.get_workers_holding_model(requested_model_id):
+        dispatch_options["queue"] = model_queue_name(requested_model_id)
+    metrics.increment("tts_model_dispatch_total", route="model_queue" if dispatch_options else "default_queue")
+
     try:
-        task_result_obj = generate_tts_task.delay(
-            text_input=input_text,
-            language_code=input_lang_code,
-            speaker_audio_temp_path_or_flag=speaker_audio_path_for_task,
-            apply_text_normalization=should_apply_text_normalization,
-            synthesis_model_params=parsed_model_params,
-            audio_postproc_params=parsed_postproc_params
-        )
-        logger.info(f"API: Đã gửi task TTS vào Celery với ID: {task_result_obj.id}. IP: {request.remote_addr}")
-        status_check_url = url_for('get_tts_task_status_endpoint', task_id=task_result_obj.id, _external=True)
-        return jsonify({
+        with tracer.span("api.dispatch_task", queue=dispatch_options.get("queue", "default")) as dispatch_span:
+            task_kwargs = dict(
+                text_input=input_text,
+                language_code=input_lang_code,
+                speaker_audio_key_or_flag=speaker_audio_key_for_task,
+                apply_text_normalization=should_apply_text_normalization,
+                synthesis_model_params=parsed_model_params,
+                audio_postproc_params=parsed_postproc_params,
+                model_id=None if requested_model_id == DEFAULT_MODEL_ID else requested_model_id,
+                profile=should_profile,
+                speaker_name=requested_speaker_name
+            )
+            trace_headers = tracer.inject_headers() or None
+            task_id = None
+            if fair_scheduler.enabled:
+                try:
+                    task_id = fair_scheduler.submit(key_id, task_kwargs, admission.estimate.worker_seconds,
+                                                    headers=trace_headers, options=dispatch_options)
+                except Exception as e_fair:
+                    logger.warning(f"API: Không đưa được task vào hàng đợi theo API key, gửi thẳng vào broker: {e_fair}")
+                    metrics.increment("tts_fair_scheduler_bypassed_total")
+            if task_id is None:
+                task_id = generate_tts_task.apply_async(kwargs=task_kwargs, headers=trace_headers, **dispatch_options).id
+            dispatch_span.set_attribute("task_id", task_id)
+        try:
+            get_task_cancellation().register_task(task_id, key_id)
+        except Exception as e_register:
+            logger.warning(f"API: Không ghi được chủ sở hữu của task {task_id} (task này sẽ không hủy được): {e_register}")
+        logger.info(f"API: Đã nhận task TTS với ID: {task_id} (queue: {dispatch_options.get('queue', 'mặc định')}). IP: {request.remote_addr}")
+        status_check_url = url_for('get_tts_task_status_endpoint', task_id=task_id, _external=True)
+        queued_response = jsonify({
             "message": "Yêu cầu tổng hợp giọng nói đã được tiếp nhận và đang được xử lý.",
-            "task_id": task_result_obj.id,
-            "status_url": status_check_url
-        }), 202
+            "task_id": task_id,
+            "status_url": status_check_url,
+            "estimated_completion": admission.estimated_completion.isoformat(),
+            "estimate": {
+                "audio_seconds": admission.estimate.audio_seconds,
+                "worker_seconds": admission.estimate.worker_seconds,
+                "queue_depth": admission.queue_depth,
+                "backlog_seconds": round(admission.backlog_seconds, 1)
+            }
+        })
+        if synchronous:
+            queued_response.headers["X-TTS-Mode"] = "queued"
+            queued_response.headers["X-TTS-Sync-Fallback"] = sync_fallback_reason
+        return queued_response, 202
     except Exception as e_dispatch:
         logger.error(f"API: Lỗi khi gửi task tới Celery: {e_dispatch}", exc_info=True)
-        if temp_speaker_file_to_delete_on_dispatch_error and os.path.exists(temp_speaker_file_to_delete_on_dispatch_error):
+        _refund_rate_limit(key_id, len(input_text), rate_limit)
+        if uploaded_speaker_key_to_delete_on_dispatch_error:
             try:
-                os.remove(temp_speaker_file_to_delete_on_dispatch_error)
-                logger.info(f"API: Đã dọn dẹp file giọng mẫu tạm (do lỗi dispatch Celery): {temp_speaker_file_to_delete_on_dispatch_error}")
-            except OSError as e_remove_tmp:
+                get_storage().delete(uploaded_speaker_key_to_delete_on_dispatch_error)
+                logger.info(f"API: Đã dọn dẹp file giọng mẫu tạm (do lỗi dispatch Celery): {uploaded_speaker_key_to_delete_on_dispatch_error}")
+            except Exception as e_remove_tmp:
                 logger.error(f"API: Lỗi khi dọn dẹp file giọng mẫu tạm (do lỗi dispatch Celery): {e_remove_tmp}")
         return jsonify({"error": "Lỗi hệ thống khi gửi yêu cầu xử lý giọng nói."}), 500
 
+@app.route('/tts/<string:task_id>', methods=['DELETE'])
+@require_api_key
+def cancel_tts_task_endpoint(task_id):
+    """Endpoint hủy một tác vụ TTS đang chờ hoặc đang chạy.
+
+    Task còn trong hàng đợi theo API key được lấy ra và đánh dấu REVOKED ngay; các trường hợp khác (đang nằm trong
+    broker hoặc đang chạy) trả về CANCELLING, worker bỏ qua hoặc dừng ở ranh giới câu kế tiếp rồi tự ghi REVOKED.
+    """
+    logger.info(f"API Cancel: Nhận yêu cầu hủy task {task_id}. IP: {request.remote_addr}")
+    key_id = api_key_id(request.headers.get(API_KEY_HEADER))
+    cancellation = get_task_cancellation()
+    try:
+        task = task_state_cache.get(task_id)
+        owner_key_id = cancellation.task_owner(task_id)
+    except Exception as e_get_task:
+        logger.error(f"API Cancel: Lỗi khi lấy trạng thái cho task {task_id}: {e_get_task}", exc_info=True)
+        return jsonify({"task_id": task_id, "status": "UNKNOWN", "error_message": "Không thể kết nối đến backend để lấy trạng thái task."}), 503
+
+    # Chỉ key đã gửi task mới hủy được; không có bản ghi chủ sở hữu (task_id sai, ghi lỗi hoặc đã hết hạn) thì không
+    # xác minh được quyền nên coi như không tìm thấy, bất kể trạng thái của task
+    if owner_key_id is None or owner_key_id != key_id:
+        metrics.increment("tts_cancel_requests_total", state="not_found")
+        return jsonify({"task_id": task_id, "error": "Không tìm thấy task."}), 404
+
+    if task.is_terminal:
+        metrics.increment("tts_cancel_requests_total", state="terminal")
+        return jsonify({
+            "task_id": task_id,
+            "status": task.status,
+            "error": "Task đã kết thúc, không thể hủy."
+        }), 409
+
+    try:
+        cancellation.request_cancel(task_id)
+    except Exception as e_flag:
+        logger.error(f"API Cancel: Không ghi được cờ hủy cho task {task_id}: {e_flag}", exc_info=True)
+        return jsonify({"task_id": task_id, "error": "Không thể ghi yêu cầu hủy, vui lòng thử lại."}), 503
+
+    status = "CANCELLING"
+    if task.status == "PENDING" and fair_scheduler.enabled:
+        # chỉ task lấy được khỏi hàng đợi theo key mới chắc chắn chưa tới worker -> REVOKED ngay
+        try:
+            if fair_scheduler.remove_pending(owner_key_id, task_id):
+                task_state_cache.invalidate(task_id)
+                status = "REVOKED"
+        except Exception as e_remove:
+            logger.warning(f"API Cancel: Không lấy được task {task_id} khỏi hàng đợi theo API key: {e_remove}")
+
+    if status != "REVOKED":
+        try:
+            # worker bỏ qua message nếu nó còn nằm trong broker (kể cả đã prefetch) và tự ghi REVOKED
+            celery_app.control.revoke(task_id)
+        except Exception as e_revoke:
+            logger.warning(f"API Cancel: Không broadcast được revoke cho task {task_id}: {e_revoke}")
+
+    metrics.increment("tts_cancel_requests_total", state=task.status.lower())
+    logger.info(f"API Cancel: Task {task_id} ({task.status}) -> {status}.")
+    return jsonify({
+        "task_id": task_id,
+        "status": status,
+        "message": "Đã hủy task." if status == "REVOKED" else "Đã gửi yêu cầu hủy, task sẽ dừng trước câu kế tiếp.",
+        "status_url": url_for('get_tts_task_status_endpoint', task_id=task_id, _external=True)
+    }), 202
+
 @app.route('/tts/status/<string:task_id>', methods=['GET'])
 @require_api_key
 def get_tts_task_status_endpoint(task_id):
     """Endpoint để kiểm tra trạng thái của một tác vụ TTS."""
     logger.debug(f"API Status: Nhận yêu cầu kiểm tra status cho task_id: {task_id}. IP: {request.remote_addr}")
     try:
-        task = generate_tts_task.AsyncResult(task_id, app=celery_app)
+        task = task_state_cache.get(task_id)
     except Exception as e_get_task:
-        logger.error(f"API Status: Lỗi khi lấy AsyncResult cho task {task_id}: {e_get_task}", exc_info=True)
+        logger.error(f"API Status: Lỗi khi lấy trạng thái cho task {task_id}: {e_get_task}", exc_info=True)
         return jsonify({"task_id": task_id, "status": "UNKNOWN", "error_message": "Không thể kết nối đến backend để lấy trạng thái task."}), 503
 
     response_data = {
         "task_id": task_id,
-        "status": task.status.upper(),
+        "status": task.status,
         "timestamp": datetime.now(timezone.utc).isoformat()
     }
 
-    if task.successful():
-        task_info = task.result 
+    if task.status == "SUCCESS":
+        task_info = task.result or {}
         response_data["result"] = {
             "message": "Tổng hợp giọng nói thành công.",
             "filename": task_info.get("filename"),
             "download_url": url_for('download_tts_result_endpoint', task_id=task_id, _external=True)
         }
-    elif task.failed():
+        if task_info.get("profiled") and request.headers.get(API_KEY_HEADER) in PROFILING_API_KEYS:
+            response_data["result"]["profile_url"] = url_for('download_tts_profile_endpoint', task_id=task_id, _external=True)
+    elif task.status == "FAILURE":
         error_info_details = "Lỗi không xác định trong quá trình xử lý ở worker."
         try:
             if isinstance(task.result, Exception):
                 error_info_details = f"{type(task.result).__name__}: {str(task.result)}"
-            elif task.info and isinstance(task.info, Exception) : 
-                 error_info_details = f"{type(task.info).__name__}: {str(task.info)}"
-            elif task.info : 
-                 error_info_details = str(task.info)
+            elif task.result:
+                 error_info_details = str(task.result)
 
         except Exception as e_extract_error:
             logger.error(f"API Status: Lỗi khi trích xuất thông tin lỗi từ task {task_id} thất bại: {e_extract_error}")
         
         logger.warning(f"API Status: Task {task_id} FAILED. Info: {error_info_details}\nTraceback (nếu có từ Celery): {task.traceback}")
         response_data["error_details"] = error_info_details
+    elif task.status == "PROGRESS":
+        progress = task.result if isinstance(task.result, dict) else {}
+        response_data["message"] = "Đang tổng hợp giọng nói..."
+        response_data["progress"] = {
+            "sentences_done": progress.get("sentences_done"),
+            "sentences_total": progress.get("sentences_total"),
+            "audio_seconds": progress.get("audio_seconds"),
+            "elapsed_seconds": progress.get("elapsed_seconds"),
+            "estimated_remaining_seconds": progress.get("estimated_remaining_seconds"),
+        }
+        if progress.get("partial_available"):
+            response_data["partial_url"] = url_for('download_tts_result_endpoint', task_id=task_id, partial="true", _external=True)
+            response_data["playlist_url"] = url_for('download_tts_result_endpoint', task_id=task_id, partial="playlist", _external=True)
+    elif task.status == "REVOKED":
+        response_data["message"] = "Task đã bị hủy theo yêu cầu."
     else: 
         response_data["message"] = "Yêu cầu đang được xử lý hoặc đang chờ trong hàng đợi..."
-        if task.status == 'RETRY' and task.info and isinstance(task.info, dict):
+        if task.status == 'RETRY' and task.result and isinstance(task.result, dict):
             response_data['retry_info'] = {
-                'reason': str(task.info.get('exc')),
-                'eta': task.info.get('eta'),
-                'retries_left': task.info.get('retries')
+                'reason': str(task.result.get('exc')),
+                'eta': task.result.get('eta'),
+                'retries_left': task.result.get('retries')
             }
             
     return jsonify(response_data)
 
+def _send_stored_file(storage_key: str, download_name: str, task_id: str, mimetype: str = "audio/wav"):
+    """Gửi file từ storage: đọc trực tiếp từ đĩa, chuyển hướng tới URL tải, hoặc stream qua API."""
+    storage = get_storage()
+    try:
+        if not storage.exists(storage_key):
+            logger.error(f"[TTS Result] Object '{storage_key}' không tồn tại cho task {task_id}.")
+            return jsonify({"error": "File kết quả không tồn tại. Có thể đã bị xóa."}), 404
+
+        local_file_path = storage.local_path(storage_key)
+        if local_file_path is not None:
+            logger.info(f"[TTS Result] Gửi file '{download_name}' cho task {task_id}.")
+            return send_file(local_file_path, mimetype=mimetype, as_attachment=True, download_name=download_name)
+
+        if STORAGE_DOWNLOAD_MODE == "redirect":
+            download_url = storage.get_download_url(storage_key, download_name=download_name)
+            if download_url:
+                logger.info(f"[TTS Result] Chuyển hướng tải '{download_name}' cho task {task_id}.")
+                return redirect(download_url, code=302)
+
+        logger.info(f"[TTS Result] Stream file '{download_name}' từ storage cho task {task_id}.")
+        return send_file(storage.open_stream(storage_key), mimetype=mimetype, as_attachment=True, download_name=download_name)
+    except ObjectNotFoundError:
+        logger.error(f"[TTS Result] Object '{storage_key}' không tồn tại cho task {task_id}.")
+        return jsonify({"error": "File kết quả không tồn tại. Có thể đã bị xóa."}), 404
+    except Exception:
+        logger.exception(f"[TTS Result] Lỗi khi gửi file '{storage_key}'")
+        return jsonify({"error": "Lỗi khi gửi file kết quả."}), 500
+
+def _send_partial_result(task_id: str, task_status: str, playlist: bool):
+    """
+    Phần âm thanh đã tổng hợp xong của một task đang chạy (từ checkpoint từng câu, chưa qua hậu kỳ):
+    một file WAV ghép các câu đã xong (tải lại để nhận thêm), hoặc danh sách các segment theo thứ tự.
+    """
+    storage = get_storage()
+    try:
+        if playlist:
+            segments = list_segments(storage, task_id)
+            return jsonify({
+                "task_id": task_id,
+                "status": task_status,
+                "complete": False,
+                "segments": [
+                    {"sentence_index": index,
+                     "url": url_for('download_tts_segment_endpoint', task_id=task_id, sentence_index=index, _external=True)}
+                    for index, _ in segments
+                ]
+            })
+
+        partial_audio = build_partial_wav(storage, task_id)
+    except Exception:
+        logger.exception(f"[TTS Result] Lỗi khi đọc kết quả từng phần của task {task_id}")
+        return jsonify({"error": "Lỗi khi đọc kết quả từng phần."}), 500
+
+    if partial_audio is None:
+        return jsonify({"message": "Chưa có câu nào được tổng hợp xong.", "status": task_status}), 202
+    audio_buffer, audio_seconds = partial_audio
+    response = send_file(audio_buffer, mimetype="audio/wav", as_attachment=True, download_name=f"{task_id}_partial.wav")
+    response.headers["X-Partial-Audio-Seconds"] = f"{audio_seconds:.3f}"
+    response.headers["X-Task-Status"] = task_status
+    response.headers["Cache-Control"] = "no-store"
+    return response
+
+@app.route('/tts/result/<string:task_id>/segments/<int:sentence_index>', methods=['GET'])
+@require_api_key
+def download_tts_segment_endpoint(task_id, sentence_index):
+    """Tải âm thanh của một câu đã tổng hợp xong trong khi task còn đang chạy."""
+    try:
+        segment_key = next((key for index, key in list_segments(get_storage(), task_id) if index == sentence_index), None)
+    except Exception:
+        logger.exception(f"[TTS Result] Lỗi khi liệt kê segment của task {task_id}")
+        return jsonify({"error": "Lỗi khi đọc kết quả từng phần."}), 500
+    if segment_key is None:
+        return jsonify({"error": "Segment không tồn tại (chưa tổng hợp xong, hoặc task đã kết thúc và checkpoint đã bị xóa)."}), 404
+    return _send_stored_file(segment_key, f"{task_id}_segment_{sentence_index:05d}.wav", task_id)
+
+@app.route('/tts/profile/<string:task_id>', methods=['GET'])
+@require_api_key
+def download_tts_profile_endpoint(task_id):
+    """Tải file zip kết quả profiling (cProfile + torch profiler) của một task đã chạy với profile=true."""
+    if request.headers.get(API_KEY_HEADER) not in PROFILING_API_KEYS:
+        return jsonify({"error": "API Key này không được phép tải kết quả profiling."}), 403
+    return _send_stored_file(profile_key(task_id), f"{task_id}_profile.zip", task_id, mimetype="application/zip")
+
 @app.route('/tts/result/<string:task_id>', methods=['GET'])
 @require_api_key
 def download_tts_result_endpoint(task_id):
@@ -265,37 +777,28 @@ def download_tts_result_endpoint(task_id):
     logger.debug(f"[TTS Result] Yêu cầu từ IP {client_ip} cho task_id: {task_id}")
 
     try:
-        task = generate_tts_task.AsyncResult(task_id, app=celery_app)
+        task = task_state_cache.get(task_id)
     except Exception as e:
-        logger.exception(f"[TTS Result] Không thể lấy AsyncResult cho task_id: {task_id}")
+        logger.exception(f"[TTS Result] Không thể lấy trạng thái cho task_id: {task_id}")
         return jsonify({"error": "Không thể kết nối đến backend để lấy trạng thái task."}), 503
 
-    if task.successful():
+    partial_mode = request.args.get("partial", "").strip().lower()
+    if task.status not in ("SUCCESS", "FAILURE") and partial_mode in ("true", "1", "playlist"):
+        return _send_partial_result(task_id, task.status, playlist=(partial_mode == "playlist"))
+
+    if task.status == "SUCCESS":
         result = task.result or {}
         filename = result.get("filename")
+        # Kết quả cũ (trước khi có storage) chỉ có filename nằm trực tiếp trong OUTPUT_DIR.
+        storage_key = result.get("storage_key") or filename
 
-        if not filename or not OUTPUT_DIR:
-            logger.error(f"[TTS Result] Task {task_id} thành công nhưng thiếu 'filename' hoặc OUTPUT_DIR.")
+        if not filename:
+            logger.error(f"[TTS Result] Task {task_id} thành công nhưng thiếu 'filename'.")
             return jsonify({"error": "Thông tin file không đầy đủ hoặc cấu hình server lỗi."}), 500
 
-        file_path = os.path.join(OUTPUT_DIR, filename)
-        if not os.path.exists(file_path):
-            logger.error(f"[TTS Result] File '{file_path}' không tồn tại cho task {task_id}.")
-            return jsonify({"error": "File kết quả không tồn tại. Có thể đã bị xóa."}), 404
-
-        try:
-            logger.info(f"[TTS Result] Gửi file '{filename}' cho task {task_id}.")
-            return send_from_directory(
-                directory=os.path.abspath(OUTPUT_DIR),
-                path=filename,
-                as_attachment=True,
-                download_name=filename
-            )
-        except Exception as e:
-            logger.exception(f"[TTS Result] Lỗi khi gửi file '{file_path}'")
-            return jsonify({"error": "Lỗi khi gửi file kết quả."}), 500
+        return _send_stored_file(storage_key, filename, task_id)
 
-    elif task.failed():
+    elif task.status == "FAILURE":
         logger.warning(f"[TTS Result] Task {task_id} đã thất bại.")
         return jsonify({"error": "Tác vụ thất bại. Không có file kết quả."}), 400
 
@@ -303,5 +806,5 @@ def download_tts_result_endpoint(task_id):
         logger.info(f"[TTS Result] Task {task_id} chưa hoàn tất (trạng thái: {task.status}).")
         return jsonify({
             "message": "Tác vụ chưa hoàn tất hoặc task_id không hợp lệ.",
-            "status": task.status.upper()
+            "status": task.status
         }), 202
@@ -0,0 +1,144 @@
+import math
+import time
+import logging
+import threading
+from dataclasses import dataclass
+from typing import Callable
+from datetime import datetime, timedelta, timezone
+
+from app.config import (
+    ADMISSION_CONTROL_ENABLED, ADMISSION_MAX_BACKLOG_SECONDS, ADMISSION_MAX_TEXT_CHARS,
+    ADMISSION_QUEUE_NAMES, ADMISSION_QUEUE_DEPTH_CACHE_SECONDS, ADMISSION_WORKER_SLOTS,
+)
+from app.domain.services.synthesis_cost_estimator import SynthesisCostEstimator, SynthesisCostEstimate
+from app.infrastructure.broker_queues import get_queue_lengths
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class AdmissionDecision:
+    accepted: bool
+    estimate: SynthesisCostEstimate
+    queue_depth: int
+    backlog_seconds: float
+    estimated_completion: datetime | None = None
+    retry_after_seconds: int | None = None
+    status_code: int = 202
+    reason: str | None = None
+
+
+class AdmissionController:
+    """
+    Quyết định nhận hay từ chối (backpressure) một yêu cầu TTS dựa trên mô hình chi phí
+    và độ sâu hàng đợi hiện tại, đồng thời ước lượng thời điểm hoàn thành.
+    """
+
+    def __init__(self,
+                 celery_app,
+                 estimator: SynthesisCostEstimator,
+                 queue_names: list[str] = ADMISSION_QUEUE_NAMES,
+                 max_backlog_seconds: float = ADMISSION_MAX_BACKLOG_SECONDS,
+                 max_text_chars: int = ADMISSION_MAX_TEXT_CHARS,
+                 queue_depth_cache_seconds: float = ADMISSION_QUEUE_DEPTH_CACHE_SECONDS,
+                 enabled: bool = ADMISSION_CONTROL_ENABLED,
+                 worker_slots_provider: Callable[[], int | None] | None = None,
+                 pending_tasks_provider: Callable[[], int] | None = None):
+        self.celery_app = celery_app
+        self.estimator = estimator
+        self.queue_names = queue_names
+        self.max_backlog_seconds = max_backlog_seconds
+        self.max_text_chars = max_text_chars
+        self.queue_depth_cache_seconds = queue_depth_cache_seconds
+        self.enabled = enabled
+        self.worker_slots_provider = worker_slots_provider
+        # task chưa vào broker (đang chờ trong hàng đợi theo API key của FairTaskScheduler)
+        self.pending_tasks_provider = pending_tasks_provider
+        self._cached_queue_depth: tuple[float, int] | None = None
+        self._lock = threading.Lock()
+
+    def get_queue_depth(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            if self._cached_queue_depth and now - self._cached_queue_depth[0] < self.queue_depth_cache_seconds:
+                return self._cached_queue_depth[1]
+        try:
+            depth = sum(get_queue_lengths(self.celery_app, self.queue_names).values())
+        except Exception as e:
+            logger.warning(f"Admission control: Không đọc được độ sâu hàng đợi từ broker: {e}")
+            depth = 0
+        if self.pending_tasks_provider is not None:
+            try:
+                depth += self.pending_tasks_provider()
+            except Exception as e:
+                logger.warning(f"Admission control: Không đọc được số task đang chờ lập lịch: {e}")
+        with self._lock:
+            self._cached_queue_depth = (now, depth)
+        metrics.set_gauge("tts_queue_depth", depth)
+        return depth
+
+    def get_worker_slots(self) -> int:
+        """Số slot xử lý hiện có: lấy từ heartbeat của fleet nếu có, ngược lại dùng ADMISSION_WORKER_SLOTS."""
+        if self.worker_slots_provider is not None:
+            try:
+                live_slots = self.worker_slots_provider()
+                if live_slots is not None:
+                    return max(1, live_slots)
+            except Exception as e:
+                logger.debug(f"Admission control: Không lấy được số slot worker từ fleet: {e}")
+        return max(1, ADMISSION_WORKER_SLOTS)
+
+    def estimate_backlog_seconds(self, queue_depth: int) -> float:
+        mean_task_seconds = self.estimator.mean_task_worker_seconds
+        if mean_task_seconds is None:
+            mean_task_seconds = self.estimator.estimate("x" * 500, "vi").worker_seconds
+        return queue_depth * mean_task_seconds / self.get_worker_slots()
+
+    def evaluate(self, text: str, language: str, speed: float = 1.0) -> AdmissionDecision:
+        estimate = self.estimator.estimate(text, language, speed)
+
+        if self.max_text_chars > 0 and estimate.text_chars > self.max_text_chars:
+            metrics.increment("tts_admission_rejected_total", reason="text_too_long")
+            return AdmissionDecision(
+                accepted=False, estimate=estimate, queue_depth=0, backlog_seconds=0.0,
+                status_code=413,
+                reason=f"Văn bản quá dài ({estimate.text_chars} ký tự). Tối đa {self.max_text_chars} ký tự mỗi yêu cầu."
+            )
+
+        queue_depth = self.get_queue_depth()
+        backlog_seconds = self.estimate_backlog_seconds(queue_depth)
+        metrics.set_gauge("tts_backlog_seconds", round(backlog_seconds, 3))
+
+        if self.enabled and backlog_seconds > self.max_backlog_seconds:
+            retry_after = max(1, math.ceil(backlog_seconds - self.max_backlog_seconds))
+            metrics.increment("tts_admission_rejected_total", reason="backlog")
+            logger.warning(f"Admission control: Từ chối yêu cầu, backlog {backlog_seconds:.1f}s > {self.max_backlog_seconds}s (queue_depth={queue_depth}).")
+            return AdmissionDecision(
+                accepted=False, estimate=estimate, queue_depth=queue_depth, backlog_seconds=backlog_seconds,
+                retry_after_seconds=retry_after, status_code=429,
+                reason="Hệ thống đang quá tải. Vui lòng thử lại sau."
+            )
+
+        estimated_completion = datetime.now(timezone.utc) + timedelta(seconds=backlog_seconds + estimate.worker_seconds)
+        metrics.increment("tts_admission_accepted_total")
+        return AdmissionDecision(
+            accepted=True, estimate=estimate, queue_depth=queue_depth, backlog_seconds=backlog_seconds,
+            estimated_completion=estimated_completion
+        )
+
+    def observe_task_result(self, task_result: dict) -> None:
+        """Hiệu chỉnh mô hình chi phí từ số liệu 'metrics' mà worker trả về trong kết quả task."""
+        task_metrics = task_result.get("metrics") if isinstance(task_result, dict) else None
+        if not task_metrics:
+            return
+        try:
+            self.estimator.observe(
+                language=task_metrics.get("language", "vi"),
+                text_chars=int(task_metrics.get("text_chars", 0)),
+                sentence_count=int(task_metrics.get("sentence_count", 1)),
+                audio_seconds=float(task_metrics.get("audio_seconds", 0.0)),
+                worker_seconds=float(task_metrics.get("worker_seconds", 0.0))
+            )
+        except (TypeError, ValueError) as e:
+            logger.debug(f"Admission control: Bỏ qua số liệu task không hợp lệ: {e}")
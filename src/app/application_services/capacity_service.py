@@ -0,0 +1,111 @@
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+
+from app.config import CAPACITY_CACHE_TTL_SECONDS, CAPACITY_MONITORED_QUEUES, DEFAULT_MODEL_ID
+from app.domain.model_registry import model_queue_name
+from app.domain.services.synthesis_cost_estimator import SynthesisCostEstimator
+from app.infrastructure.broker_queues import get_queue_lengths
+from app.infrastructure.worker_registry import WorkerRegistry
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class FleetCapacityService:
+    """
+    Tổng hợp năng lực xử lý của toàn bộ worker: độ dài các queue trên broker, heartbeat và RTF gần đây
+    của từng worker, và backlog ước lượng (giây). Kết quả được cache ngắn hạn để có thể scrape thường xuyên.
+    """
+
+    def __init__(self,
+                 celery_app,
+                 worker_registry: WorkerRegistry,
+                 estimator: SynthesisCostEstimator,
+                 queue_names: list[str] = CAPACITY_MONITORED_QUEUES,
+                 cache_ttl_seconds: float = CAPACITY_CACHE_TTL_SECONDS):
+        self.celery_app = celery_app
+        self.worker_registry = worker_registry
+        self.estimator = estimator
+        self.queue_names = queue_names
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self._cached: tuple[float, dict] | None = None
+        self._lock = threading.Lock()
+
+    def _collect(self) -> dict:
+        errors = []
+        try:
+            workers = self.worker_registry.list_workers()
+        except Exception as e:
+            logger.warning(f"Capacity: Không đọc được heartbeat worker: {e}")
+            workers, errors = [], errors + [f"worker_registry: {e}"]
+
+        model_placement: dict[str, list[str]] = {}
+        for worker in workers:
+            if not worker.get("ready"):
+                continue
+            for model_id in worker.get("resident_models", []):
+                model_placement.setdefault(model_id, []).append(worker["hostname"])
+        model_queues = [model_queue_name(model_id) for model_id in sorted(model_placement) if model_id != DEFAULT_MODEL_ID]
+
+        try:
+            queue_lengths = get_queue_lengths(self.celery_app, self.queue_names + model_queues)
+        except Exception as e:
+            logger.warning(f"Capacity: Không đọc được độ dài queue: {e}")
+            queue_lengths, errors = {}, errors + [f"broker: {e}"]
+
+        ready_workers = [w for w in workers if w.get("ready")]
+        ready_slots = sum(int(w.get("concurrency") or 1) for w in ready_workers)
+        worker_rtfs = [w["recent_rtf"] for w in ready_workers if w.get("recent_rtf")]
+        task_seconds = [w["recent_mean_task_seconds"] for w in ready_workers if w.get("recent_mean_task_seconds")]
+
+        if task_seconds:
+            mean_task_seconds = sum(task_seconds) / len(task_seconds)
+        elif self.estimator.mean_task_worker_seconds is not None:
+            mean_task_seconds = self.estimator.mean_task_worker_seconds
+        else:
+            mean_task_seconds = self.estimator.estimate("x" * 500, "vi").worker_seconds
+
+        total_queued = sum(queue_lengths.values())
+        backlog_seconds = total_queued * mean_task_seconds / ready_slots if ready_slots else None
+
+        metrics.set_gauge("tts_fleet_live_workers", len(workers))
+        metrics.set_gauge("tts_fleet_ready_slots", ready_slots)
+        metrics.set_gauge("tts_queue_depth", total_queued)
+        if backlog_seconds is not None:
+            metrics.set_gauge("tts_backlog_seconds", round(backlog_seconds, 3))
+
+        return {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "queues": queue_lengths,
+            "total_queued": total_queued,
+            "workers": workers,
+            "model_placement": model_placement,
+            "available_models": sorted({model_id for w in workers for model_id in w.get("available_models", [])}),
+            "live_workers": len(workers),
+            "ready_workers": len(ready_workers),
+            "ready_slots": ready_slots,
+            "fleet_recent_rtf": round(sum(worker_rtfs) / len(worker_rtfs), 4) if worker_rtfs else None,
+            "mean_task_seconds": round(mean_task_seconds, 3),
+            "estimated_backlog_seconds": round(backlog_seconds, 1) if backlog_seconds is not None else None,
+            "errors": errors,
+        }
+
+    def get_snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            if self._cached and now - self._cached[0] < self.cache_ttl_seconds:
+                return self._cached[1]
+            snapshot = self._collect()
+            self._cached = (now, snapshot)
+            return snapshot
+
+    def get_ready_slots(self) -> int | None:
+        """Số slot xử lý của các worker sẵn sàng, None nếu chưa có heartbeat nào."""
+        snapshot = self.get_snapshot()
+        return snapshot["ready_slots"] if snapshot["workers"] else None
+
+    def get_workers_holding_model(self, model_id: str) -> list[str]:
+        """Hostname các worker sẵn sàng đang giữ model `model_id` trong bộ nhớ."""
+        return self.get_snapshot()["model_placement"].get(model_id, [])
@@ -0,0 +1,330 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from typing import Callable
+
+from app.config import (
+    FAIR_SCHEDULING_ENABLED, FAIR_SCHEDULING_WEIGHTS, FAIR_SCHEDULER_QUANTUM_SECONDS,
+    FAIR_SCHEDULER_MAX_BROKER_DEPTH, FAIR_SCHEDULER_INTERVAL_SECONDS,
+    ADMISSION_QUEUE_NAMES, ADMISSION_WORKER_SLOTS,
+)
+from app.infrastructure.broker_queues import get_queue_lengths
+from app.infrastructure.rate_limiter import api_key_id, usage_key
+from app.infrastructure.redis_client import get_redis_client
+from app.infrastructure.storage import get_storage
+from app.infrastructure.task_cancellation import TaskCancellationRegistry, get_task_cancellation
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_QUEUE_KEY_PREFIX = "tts:fair:queue:"
+_TENANTS_KEY = "tts:fair:tenants"
+_DEFICITS_KEY = "tts:fair:deficits"
+_CURSOR_KEY = "tts:fair:cursor"
+_RESUME_KEY = "tts:fair:resume"
+_LOCK_KEY = "tts:fair:dispatcher_lock"
+
+# Bỏ key khỏi tập đang chờ chỉ khi hàng đợi của nó thật sự rỗng (API có thể vừa RPUSH + SADD song song)
+_REMOVE_IF_EMPTY_SCRIPT = """
+if redis.call('LLEN', KEYS[1]) == 0 then
+    redis.call('SREM', KEYS[2], ARGV[1])
+    redis.call('HDEL', KEYS[3], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class FairTaskScheduler:
+    """
+    Lập lịch công bằng giữa các API key. Thay vì gửi thẳng vào queue FIFO chung của broker, task được đưa vào
+    hàng đợi riêng của key trong Redis; dispatcher (một thread nền trong mỗi process API, chỉ một process chạy
+    tại một thời điểm nhờ lock Redis) chuyển task vào broker theo deficit round robin với chi phí là số giây worker
+    ước lượng, nhân trọng số của key, và chỉ giữ khoảng `max_broker_depth` task trong broker. Nhờ vậy một key gửi
+    hàng nghìn task không chặn các key khác: mỗi key có task chờ nhận phần năng lực worker theo trọng số.
+    """
+
+    def __init__(self,
+                 celery_app,
+                 task,
+                 redis_client=None,
+                 enabled: bool = FAIR_SCHEDULING_ENABLED,
+                 weights: dict[str, float] = FAIR_SCHEDULING_WEIGHTS,
+                 quantum_seconds: float = FAIR_SCHEDULER_QUANTUM_SECONDS,
+                 max_broker_depth: int = FAIR_SCHEDULER_MAX_BROKER_DEPTH,
+                 interval_seconds: float = FAIR_SCHEDULER_INTERVAL_SECONDS,
+                 queue_names: list[str] = ADMISSION_QUEUE_NAMES,
+                 worker_slots_provider: Callable[[], int | None] | None = None,
+                 broker_depth_provider: Callable[[], int] | None = None,
+                 cancellation: TaskCancellationRegistry | None = None):
+        self.celery_app = celery_app
+        self.task = task
+        self._redis = redis_client
+        self.enabled = enabled
+        self.weights = {api_key_id(api_key): weight for api_key, weight in weights.items()}
+        self.quantum_seconds = max(0.1, quantum_seconds)
+        self.max_broker_depth = max_broker_depth
+        self.interval_seconds = interval_seconds
+        self.queue_names = queue_names
+        self.worker_slots_provider = worker_slots_provider
+        self.broker_depth_provider = broker_depth_provider
+        self._cancellation = cancellation
+        self.lock_ttl_ms = int(max(5.0, interval_seconds * 10) * 1000)
+        self._scripts = None
+        self._thread: threading.Thread | None = None
+        self._pid = None
+        self._stop_event = threading.Event()
+        self._thread_lock = threading.Lock()
+
+    @property
+    def redis(self):
+        return self._redis or get_redis_client()
+
+    def _get_scripts(self):
+        if self._scripts is None:
+            self._scripts = (self.redis.register_script(_REMOVE_IF_EMPTY_SCRIPT),
+                             self.redis.register_script(_RELEASE_LOCK_SCRIPT))
+        return self._scripts
+
+    @property
+    def cancellation(self) -> TaskCancellationRegistry:
+        return self._cancellation or get_task_cancellation()
+
+    def weight_for(self, key_id: str) -> float:
+        return max(0.01, self.weights.get(key_id, 1.0))
+
+    def submit(self, key_id: str, task_kwargs: dict, cost_seconds: float,
+               headers: dict | None = None, options: dict | None = None) -> str:
+        """Đưa task vào hàng đợi của key và trả về task_id (đã định trước, dùng cho /tts/status ngay lập tức)."""
+        task_id = str(uuid.uuid4())
+        entry = {
+            "task_id": task_id,
+            "kwargs": task_kwargs,
+            "headers": headers or {},
+            "options": options or {},
+            "cost": max(0.0, float(cost_seconds)),
+            "submitted_at": time.time(),
+        }
+        pipe = self.redis.pipeline()
+        pipe.rpush(f"{_QUEUE_KEY_PREFIX}{key_id}", json.dumps(entry, ensure_ascii=False))
+        pipe.sadd(_TENANTS_KEY, key_id)
+        pipe.execute()
+        metrics.increment("tts_fair_scheduler_submitted_total")
+        self.ensure_dispatcher_thread()
+        try:
+            self.dispatch_pending()
+        except Exception as e_dispatch:
+            logger.warning(f"FairScheduler: Lỗi khi dispatch ngay sau khi nhận task {task_id} (sẽ thử lại ở vòng sau): {e_dispatch}")
+        return task_id
+
+    def pending_counts(self) -> dict[str, int]:
+        key_ids = sorted(self.redis.smembers(_TENANTS_KEY))
+        if not key_ids:
+            return {}
+        pipe = self.redis.pipeline()
+        for key_id in key_ids:
+            pipe.llen(f"{_QUEUE_KEY_PREFIX}{key_id}")
+        return {key_id: int(length) for key_id, length in zip(key_ids, pipe.execute()) if length}
+
+    def pending_count(self, key_id: str) -> int:
+        return int(self.redis.llen(f"{_QUEUE_KEY_PREFIX}{key_id}"))
+
+    def pending_total(self) -> int:
+        return sum(self.pending_counts().values())
+
+    def _broker_depth(self) -> int:
+        if self.broker_depth_provider is not None:
+            return self.broker_depth_provider()
+        return sum(get_queue_lengths(self.celery_app, self.queue_names).values())
+
+    def _target_broker_depth(self) -> int:
+        if self.max_broker_depth > 0:
+            return self.max_broker_depth
+        if self.worker_slots_provider is not None:
+            try:
+                live_slots = self.worker_slots_provider()
+                if live_slots:
+                    return live_slots
+            except Exception as e:
+                logger.debug(f"FairScheduler: Không lấy được số slot worker từ fleet: {e}")
+        return max(1, ADMISSION_WORKER_SLOTS)
+
+    def dispatch_pending(self) -> int:
+        """Chuyển task từ các hàng đợi theo key vào broker cho tới khi broker đủ sâu. Trả về số task đã gửi."""
+        if not self.redis.scard(_TENANTS_KEY):
+            return 0
+        lock_token = uuid.uuid4().hex
+        if not self.redis.set(_LOCK_KEY, lock_token, nx=True, px=self.lock_ttl_ms):
+            return 0
+        try:
+            return self._dispatch_round()
+        finally:
+            _, release_lock = self._get_scripts()
+            release_lock(keys=[_LOCK_KEY], args=[lock_token], client=self.redis)
+
+    def remove_pending(self, key_id: str, task_id: str, wait_seconds: float = 1.0) -> bool:
+        """
+        Lấy một task còn chờ khỏi hàng đợi của key và đánh dấu REVOKED. Giữ lock dispatcher nên task không thể vừa được
+        gửi vào broker; True chỉ khi task chắc chắn chưa tới worker. False nếu không tìm thấy hoặc không lấy được lock.
+        """
+        queue_key = f"{_QUEUE_KEY_PREFIX}{key_id}"
+        lock_token = uuid.uuid4().hex
+        deadline = time.monotonic() + wait_seconds
+        while not self.redis.set(_LOCK_KEY, lock_token, nx=True, px=self.lock_ttl_ms):
+            if time.monotonic() >= deadline:
+                logger.warning(f"FairScheduler: Không lấy được lock dispatcher để hủy task {task_id}.")
+                return False
+            time.sleep(0.02)
+        remove_if_empty, release_lock = self._get_scripts()
+        try:
+            for raw_entry in self.redis.lrange(queue_key, 0, -1):
+                entry = json.loads(raw_entry)
+                if entry["task_id"] != task_id:
+                    continue
+                if not self.redis.lrem(queue_key, 1, raw_entry):
+                    return False
+                remove_if_empty(keys=[queue_key, _TENANTS_KEY, _DEFICITS_KEY], args=[key_id], client=self.redis)
+                self._discard_cancelled(key_id, entry)
+                return True
+            return False
+        finally:
+            release_lock(keys=[_LOCK_KEY], args=[lock_token], client=self.redis)
+
+    def _ordered_key_ids(self, resume_key_id: str | None) -> list[str]:
+        """
+        Các key đang có task chờ theo vòng tròn: bắt đầu từ key có lượt phục vụ đang dở (nếu có),
+        ngược lại từ key ngay sau key được phục vụ xong gần nhất.
+        """
+        key_ids = sorted(self.redis.smembers(_TENANTS_KEY))
+        if resume_key_id in key_ids:
+            next_index = key_ids.index(resume_key_id)
+        else:
+            cursor = self.redis.get(_CURSOR_KEY)
+            next_index = next((i for i, key_id in enumerate(key_ids) if cursor is None or key_id > cursor), 0)
+        return key_ids[next_index:] + key_ids[:next_index]
+
+    def _dispatch_round(self) -> int:
+        budget = self._target_broker_depth() - self._broker_depth()
+        if budget <= 0:
+            return 0
+        remove_if_empty, _ = self._get_scripts()
+        deficits = {key_id: float(value) for key_id, value in self.redis.hgetall(_DEFICITS_KEY).items()}
+        # Broker thường chỉ nhận 1-2 task mỗi lần; key đang dở lượt (còn deficit) được phục vụ tiếp ở lần sau
+        # mà không cộng thêm quantum, để trọng số vẫn đúng khi budget nhỏ.
+        resume_key_id = self.redis.get(_RESUME_KEY)
+        dispatched = 0
+
+        key_ids = self._ordered_key_ids(resume_key_id)
+        while budget > 0 and key_ids:
+            still_pending = []
+            for key_id in key_ids:
+                if budget <= 0:
+                    still_pending.append(key_id)
+                    continue
+                queue_key = f"{_QUEUE_KEY_PREFIX}{key_id}"
+                deficit = deficits.get(key_id, 0.0)
+                if key_id != resume_key_id:
+                    deficit += self.quantum_seconds * self.weight_for(key_id)
+                resume_key_id = None
+                head_cost = None
+                while True:
+                    raw_entry = self.redis.lindex(queue_key, 0)
+                    if raw_entry is None:
+                        head_cost = None
+                        break
+                    entry = json.loads(raw_entry)
+                    if self.cancellation.is_cancelled(entry["task_id"]):
+                        # đã bị hủy khi còn chờ: bỏ khỏi hàng đợi, không tính vào deficit và budget
+                        self.redis.lpop(queue_key)
+                        self._discard_cancelled(key_id, entry)
+                        continue
+                    head_cost = entry["cost"]
+                    if head_cost > deficit or budget <= 0:
+                        break
+                    self._send(entry)
+                    # gửi trước rồi mới lấy khỏi hàng đợi: nếu process chết giữa chừng, task được gửi lại cùng task_id
+                    self.redis.lpop(queue_key)
+                    self._record_dispatch(key_id, entry)
+                    deficit -= head_cost
+                    budget -= 1
+                    dispatched += 1
+
+                if remove_if_empty(keys=[queue_key, _TENANTS_KEY, _DEFICITS_KEY], args=[key_id], client=self.redis):
+                    deficits.pop(key_id, None)
+                    self.redis.set(_CURSOR_KEY, key_id)
+                    self.redis.delete(_RESUME_KEY)
+                    continue
+                deficits[key_id] = deficit
+                self.redis.hset(_DEFICITS_KEY, key_id, deficit)
+                if head_cost is not None and head_cost <= deficit:
+                    # hết budget giữa lượt của key này
+                    self.redis.set(_RESUME_KEY, key_id)
+                    return dispatched
+                self.redis.set(_CURSOR_KEY, key_id)
+                self.redis.delete(_RESUME_KEY)
+                still_pending.append(key_id)
+            key_ids = still_pending
+        return dispatched
+
+    def _discard_cancelled(self, key_id: str, entry: dict) -> None:
+        """Task bị hủy trước khi vào broker: ghi REVOKED (không worker nào chạy nó) và xóa giọng mẫu tải lên."""
+        task_id = entry["task_id"]
+        metrics.increment("tts_fair_scheduler_cancelled_total")
+        try:
+            self.celery_app.backend.mark_as_revoked(task_id, reason="cancelled")
+        except Exception as e_mark:
+            logger.warning(f"FairScheduler: Không ghi được trạng thái REVOKED cho task {task_id}: {e_mark}")
+        speaker_key = entry["kwargs"].get("speaker_audio_key_or_flag")
+        if speaker_key and speaker_key != "USE_DEFAULT_SPEAKER":
+            try:
+                get_storage().delete(speaker_key)
+            except Exception as e_delete:
+                logger.warning(f"FairScheduler: Không xóa được giọng mẫu tải lên {speaker_key} của task {task_id}: {e_delete}")
+        logger.debug(f"FairScheduler: Bỏ task đã bị hủy {task_id} của key {key_id}.")
+
+    def _send(self, entry: dict) -> None:
+        self.task.apply_async(task_id=entry["task_id"], kwargs=entry["kwargs"],
+                              headers=entry["headers"] or None, **entry["options"])
+
+    def _record_dispatch(self, key_id: str, entry: dict) -> None:
+        wait_seconds = max(0.0, time.time() - entry["submitted_at"])
+        pipe = self.redis.pipeline()
+        pipe.hincrbyfloat(usage_key(key_id), "tasks_dispatched", 1)
+        pipe.hincrbyfloat(usage_key(key_id), "worker_seconds_dispatched", round(entry["cost"], 3))
+        pipe.execute()
+        metrics.increment("tts_fair_scheduler_dispatched_total")
+        metrics.observe("tts_fair_scheduler_wait_seconds", wait_seconds)
+        logger.debug(f"FairScheduler: Gửi task {entry['task_id']} của key {key_id} sau {wait_seconds:.2f}s chờ.")
+
+    def ensure_dispatcher_thread(self) -> None:
+        """Khởi động thread dispatcher nền của process hiện tại (một lần cho mỗi pid, an toàn sau fork)."""
+        if not self.enabled or self._pid == os.getpid():
+            return
+        with self._thread_lock:
+            if self._pid == os.getpid():
+                return
+            self._stop_event = threading.Event()
+            self._thread = threading.Thread(target=self._dispatch_loop, name="tts-fair-scheduler", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+            logger.info("FairScheduler: Bắt đầu thread dispatcher.")
+
+    def _dispatch_loop(self) -> None:
+        while not self._stop_event.wait(self.interval_seconds):
+            try:
+                self.dispatch_pending()
+            except Exception as e_dispatch:
+                logger.warning(f"FairScheduler: Lỗi trong vòng dispatch: {e_dispatch}")
+
+    def stop(self) -> None:
+        self._stop_event.set()
@@ -0,0 +1,109 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from app.config import TASK_STATE_CACHE_MAX_ENTRIES, TASK_STATE_CACHE_TTL_SECONDS
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_TASK_STATES = frozenset({"SUCCESS", "FAILURE", "REVOKED"})
+
+
+@dataclass(frozen=True)
+class TaskStateSnapshot:
+    task_id: str
+    status: str
+    result: Any = None
+    traceback: str | None = None
+
+    @property
+    def is_terminal(self) -> bool:
+        return self.status in TERMINAL_TASK_STATES
+
+
+class _InFlightFetch:
+    def __init__(self):
+        self.done = threading.Event()
+        self.snapshot: TaskStateSnapshot | None = None
+        self.error: BaseException | None = None
+
+
+class TaskStateCache:
+    """
+    Cache trong process cho trạng thái task đã kết thúc (SUCCESS/FAILURE/REVOKED), có giới hạn
+    kích thước (LRU) và TTL. Các request đồng thời cho cùng một task_id chỉ gây ra một lần đọc backend.
+    """
+
+    def __init__(self,
+                 fetch_func: Callable[[str], TaskStateSnapshot],
+                 max_entries: int = TASK_STATE_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = TASK_STATE_CACHE_TTL_SECONDS):
+        self._fetch_func = fetch_func
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, TaskStateSnapshot]] = OrderedDict()
+        self._in_flight: dict[str, _InFlightFetch] = {}
+        self._lock = threading.Lock()
+
+    def _get_cached(self, task_id: str) -> TaskStateSnapshot | None:
+        entry = self._entries.get(task_id)
+        if entry is None:
+            return None
+        expires_at, snapshot = entry
+        if expires_at < time.monotonic():
+            del self._entries[task_id]
+            return None
+        self._entries.move_to_end(task_id)
+        return snapshot
+
+    def _store(self, snapshot: TaskStateSnapshot) -> None:
+        self._entries[snapshot.task_id] = (time.monotonic() + self.ttl_seconds, snapshot)
+        self._entries.move_to_end(snapshot.task_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        metrics.set_gauge("tts_task_state_cache_entries", len(self._entries))
+
+    def get(self, task_id: str) -> TaskStateSnapshot:
+        with self._lock:
+            cached = self._get_cached(task_id)
+            if cached is not None:
+                metrics.increment("tts_task_state_cache_hits_total")
+                metrics.increment("tts_task_state_backend_roundtrips_avoided_total")
+                return cached
+
+            in_flight = self._in_flight.get(task_id)
+            is_leader = in_flight is None
+            if is_leader:
+                in_flight = self._in_flight[task_id] = _InFlightFetch()
+
+        if not is_leader:
+            in_flight.done.wait()
+            metrics.increment("tts_task_state_cache_coalesced_total")
+            metrics.increment("tts_task_state_backend_roundtrips_avoided_total")
+            if in_flight.error is not None:
+                raise in_flight.error
+            return in_flight.snapshot
+
+        metrics.increment("tts_task_state_cache_misses_total")
+        try:
+            snapshot = self._fetch_func(task_id)
+            metrics.increment("tts_task_state_backend_fetches_total")
+            in_flight.snapshot = snapshot
+            return snapshot
+        except BaseException as e:
+            in_flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if in_flight.snapshot is not None and in_flight.snapshot.is_terminal:
+                    self._store(in_flight.snapshot)
+                self._in_flight.pop(task_id, None)
+            in_flight.done.set()
+
+    def invalidate(self, task_id: str) -> None:
+        with self._lock:
+            self._entries.pop(task_id, None)
@@ -1,4 +1,5 @@
 import os
+import time
 import tempfile 
 import logging
 from app.domain.services.speech_synthesis_service import SpeechSynthesisService
@@ -8,7 +9,8 @@ from app.domain.services.audio_postprocessor import AudioPostprocessorService
 from app.config import (
     DEFAULT_SPEAKER_WAV_PATH, OUTPUT_DIR,
     DEFAULT_TTS_PARAMS, SUPPORTED_LANGUAGES,
-    DEFAULT_AUDIO_POSTPROCESSING_PARAMS, XTTS_SAMPLE_RATE
+    DEFAULT_AUDIO_POSTPROCESSING_PARAMS, XTTS_SAMPLE_RATE,
+    WORKER_WARMUP_LANGUAGES, WORKER_WARMUP_TEXTS
 )
 from app.domain.value_objects import AudioOutput
 
@@ -33,6 +35,10 @@ class ApplicationTTSService:
         """Trả về danh sách các ngôn ngữ được hỗ trợ."""
         return SUPPORTED_LANGUAGES
 
+    def get_speaker_names(self) -> list[str]:
+        """Tên các giọng có sẵn (speakers_xtts.pth) của model mặc định, dùng qua tham số speaker_name."""
+        return self.tts_model_instance.speaker_names()
+
     def check_model_health(self, log_on_success=False) -> tuple[bool, str]:
         """
         Kiểm tra xem model TTS đã được tải và sẵn sàng hay chưa.
@@ -58,6 +64,56 @@ class ApplicationTTSService:
             return False, detailed_error_msg
 
 
+    def warm_up(self) -> bool:
+        """
+        Tính trước latents của giọng mặc định và tổng hợp thử một câu cho mỗi ngôn ngữ warm-up,
+        để request /tts/sync đầu tiên của process API không phải trả chi phí khởi động.
+        """
+        if not self.tts_model_instance.is_loaded():
+            logger.warning("ApplicationTTSService: Bỏ qua warm-up vì model chưa được tải.")
+            return False
+        warmup_started_at = time.perf_counter()
+        try:
+            if os.path.exists(DEFAULT_SPEAKER_WAV_PATH):
+                self.tts_model_instance.precompute_speaker_latents(DEFAULT_SPEAKER_WAV_PATH)
+            for language_code in WORKER_WARMUP_LANGUAGES:
+                _, error_msg = self.synthesize_short_text(
+                    WORKER_WARMUP_TEXTS.get(language_code, WORKER_WARMUP_TEXTS["en"]), language_code,
+                    DEFAULT_SPEAKER_WAV_PATH, language_code == "vi", DEFAULT_TTS_PARAMS, DEFAULT_AUDIO_POSTPROCESSING_PARAMS
+                )
+                if error_msg:
+                    logger.warning(f"ApplicationTTSService: Warm-up '{language_code}' lỗi: {error_msg}")
+                    return False
+            return True
+        except Exception as e_warmup:
+            logger.error(f"ApplicationTTSService: Lỗi trong quá trình warm-up: {e_warmup}", exc_info=True)
+            return False
+        finally:
+            logger.info(f"ApplicationTTSService: Warm-up kết thúc sau {time.perf_counter() - warmup_started_at:.2f}s.")
+
+    def synthesize_short_text(self,
+                              text: str,
+                              language: str,
+                              speaker_audio_path: str,
+                              apply_text_normalization: bool,
+                              synthesis_model_params: dict,
+                              audio_postproc_params: dict,
+                              speaker_name: str | None = None
+                              ) -> tuple[AudioOutput | None, str | None]:
+        """Tổng hợp đồng bộ bằng model mặc định của process này, với tham số đã được API kiểm tra (dùng cho /tts/sync)."""
+        model_ready, model_error_msg = self.check_model_health()
+        if not model_ready:
+            return None, f"Model không sẵn sàng: {model_error_msg}"
+        return self.synthesis_service_instance.synthesize(
+            full_text_input=text,
+            language_code=language,
+            speaker_audio_path=speaker_audio_path,
+            apply_text_normalization=apply_text_normalization,
+            synthesis_model_params=synthesis_model_params,
+            audio_postproc_params=audio_postproc_params,
+            speaker_name=speaker_name
+        )
+
     def _parse_bool_param(self, form_params: dict, key: str, default_value: bool) -> bool:
         """Helper để parse tham số boolean từ form data (chuỗi)."""
         if key in form_params:
@@ -0,0 +1,188 @@
+"""
+Tổng hợp hàng loạt không qua HTTP API và Celery (sách nói, catalogue...).
+
+Cách dùng (từ thư mục src, hoặc đã thêm src vào PYTHONPATH):
+    python -m app.bulk_synthesis manifest.jsonl --output-dir ./bulk_output --workers 2
+
+Mỗi dòng của manifest là một JSON:
+    {"id": "chuong-01", "text": "...", "language": "vi", "speaker": "/duong/dan/giong.wav",
+     "model_id": "default", "normalize_text": true, "params": {"speed": 0.95, "reduce_noise": true}}
+Chỉ "id" và "text" là bắt buộc. "params" ghi đè DEFAULT_TTS_PARAMS và DEFAULT_AUDIO_POSTPROCESSING_PARAMS.
+
+Kết quả từng mục được ghi nối tiếp vào `<output-dir>/completed.jsonl`; chạy lại cùng lệnh sẽ bỏ qua các mục
+đã thành công, nên có thể dừng và tiếp tục bất cứ lúc nào.
+"""
+import os
+import re
+import json
+import time
+import logging
+import argparse
+import multiprocessing
+
+from app.config import (
+    DEFAULT_SPEAKER_WAV_PATH, DEFAULT_TTS_PARAMS, DEFAULT_AUDIO_POSTPROCESSING_PARAMS,
+    SUPPORTED_LANGUAGES, XTTS_SAMPLE_RATE, DEFAULT_MODEL_ID,
+)
+
+logger = logging.getLogger(__name__)
+
+COMPLETED_MANIFEST_NAME = "completed.jsonl"
+
+_worker_synthesis_service = None
+
+
+def _safe_item_filename(item_id: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", item_id).strip("._") or "item"
+
+
+def read_manifest(manifest_path: str) -> list[dict]:
+    items, seen_ids = [], set()
+    with open(manifest_path, encoding="utf-8") as f_in:
+        for line_number, line in enumerate(f_in, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if not item.get("id") or not str(item.get("text", "")).strip():
+                raise ValueError(f"Dòng {line_number} của manifest thiếu 'id' hoặc 'text'.")
+            item["id"] = str(item["id"])
+            if item["id"] in seen_ids:
+                raise ValueError(f"Dòng {line_number} của manifest trùng id '{item['id']}'.")
+            if item.get("language", "vi") not in SUPPORTED_LANGUAGES:
+                raise ValueError(f"Dòng {line_number}: ngôn ngữ '{item.get('language')}' không được hỗ trợ.")
+            seen_ids.add(item["id"])
+            items.append(item)
+    return items
+
+
+def read_completed_ids(completed_path: str) -> set[str]:
+    """Các id đã tổng hợp thành công ở những lần chạy trước (mục lỗi sẽ được chạy lại)."""
+    if not os.path.exists(completed_path):
+        return set()
+    completed_ids = set()
+    with open(completed_path, encoding="utf-8") as f_in:
+        for line in f_in:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # dòng cuối có thể bị cắt dở nếu lần chạy trước bị dừng đột ngột
+            if record.get("status") == "ok":
+                completed_ids.add(record["id"])
+    return completed_ids
+
+
+def _init_worker(log_level: str) -> None:
+    """Chạy một lần trong mỗi process của pool: tải model và các service."""
+    global _worker_synthesis_service
+    logging.basicConfig(level=log_level, format=f"%(asctime)s - [bulk:{os.getpid()}] %(name)s - %(levelname)s - %(message)s")
+
+    from app.domain.tts_model import TTSModel
+    from app.domain.model_registry import ModelRegistry
+    from app.domain.services.text_processor import TextProcessor
+    from app.domain.services.audio_postprocessor import AudioPostprocessorService
+    from app.domain.services.speech_synthesis_service import SpeechSynthesisService
+
+    tts_model = TTSModel()
+    if not tts_model.is_loaded():
+        raise RuntimeError("Bulk worker: không tải được model mặc định.")
+    model_registry = ModelRegistry()
+    model_registry.adopt(DEFAULT_MODEL_ID, tts_model)
+    _worker_synthesis_service = SpeechSynthesisService(
+        tts_model, TextProcessor(), AudioPostprocessorService(sample_rate=XTTS_SAMPLE_RATE), model_registry=model_registry
+    )
+
+
+def _synthesize_item(job: tuple[dict, str]) -> dict:
+    item, output_dir = job
+    started_at = time.perf_counter()
+    record = {"id": item["id"], "chars": len(item["text"])}
+    try:
+        overrides = item.get("params") or {}
+        model_params = {key: overrides.get(key, default) for key, default in DEFAULT_TTS_PARAMS.items()}
+        postproc_params = {key: overrides.get(key, default) for key, default in DEFAULT_AUDIO_POSTPROCESSING_PARAMS.items()}
+        model_id = item.get("model_id")
+
+        audio_output, error_msg = _worker_synthesis_service.synthesize(
+            full_text_input=item["text"],
+            language_code=item.get("language", "vi"),
+            speaker_audio_path=item.get("speaker") or DEFAULT_SPEAKER_WAV_PATH,
+            apply_text_normalization=bool(item.get("normalize_text", True)),
+            synthesis_model_params=model_params,
+            audio_postproc_params=postproc_params,
+            model_id=None if model_id in (None, DEFAULT_MODEL_ID) else model_id
+        )
+        if error_msg or audio_output is None:
+            raise RuntimeError(error_msg or "Không tạo được âm thanh.")
+
+        output_path = os.path.join(output_dir, item.get("output") or f"{_safe_item_filename(item['id'])}.wav")
+        tmp_path = f"{output_path}.part"
+        with open(tmp_path, "wb") as f_out:
+            f_out.write(audio_output.audio_data.getbuffer())
+        os.replace(tmp_path, output_path)
+
+        record.update(status="ok", output=output_path, audio_seconds=round(audio_output.duration_seconds, 3))
+    except Exception as e_item:
+        logger.error(f"Bulk: Lỗi khi tổng hợp mục '{item['id']}': {e_item}")
+        record.update(status="error", error=str(e_item))
+    record["worker_seconds"] = round(time.perf_counter() - started_at, 3)
+    return record
+
+
+def run_bulk_synthesis(manifest_path: str, output_dir: str, workers: int = 1, log_level: str = "INFO") -> dict:
+    os.makedirs(output_dir, exist_ok=True)
+    completed_path = os.path.join(output_dir, COMPLETED_MANIFEST_NAME)
+
+    items = read_manifest(manifest_path)
+    completed_ids = read_completed_ids(completed_path)
+    pending_items = [item for item in items if item["id"] not in completed_ids]
+    logger.info(f"Bulk: {len(items)} mục trong manifest, {len(completed_ids & {i['id'] for i in items})} mục đã xong, "
+                f"{len(pending_items)} mục cần tổng hợp với {workers} process.")
+
+    summary = {"items_total": len(items), "items_skipped": len(items) - len(pending_items),
+               "items_ok": 0, "items_failed": 0, "audio_seconds": 0.0, "chars": 0, "worker_seconds": 0.0}
+    started_at = time.perf_counter()
+    if pending_items:
+        # "spawn" để mỗi process tự khởi tạo CUDA/model, không kế thừa trạng thái torch của process cha.
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(processes=max(1, workers), initializer=_init_worker, initargs=(log_level,)) as pool, \
+                open(completed_path, "a", encoding="utf-8") as completed_file:
+            for record in pool.imap_unordered(_synthesize_item, [(item, output_dir) for item in pending_items], chunksize=1):
+                completed_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                completed_file.flush()
+                summary["worker_seconds"] += record["worker_seconds"]
+                if record["status"] == "ok":
+                    summary["items_ok"] += 1
+                    summary["audio_seconds"] += record["audio_seconds"]
+                    summary["chars"] += record["chars"]
+                else:
+                    summary["items_failed"] += 1
+                done_count = summary["items_ok"] + summary["items_failed"]
+                logger.info(f"Bulk: [{done_count}/{len(pending_items)}] '{record['id']}' -> {record['status']} ({record['worker_seconds']}s)")
+
+    wall_seconds = time.perf_counter() - started_at
+    summary["wall_seconds"] = round(wall_seconds, 3)
+    summary["audio_seconds"] = round(summary["audio_seconds"], 3)
+    summary["worker_seconds"] = round(summary["worker_seconds"], 3)
+    summary["audio_seconds_per_wall_second"] = round(summary["audio_seconds"] / wall_seconds, 3) if wall_seconds > 0 else None
+    summary["chars_per_second"] = round(summary["chars"] / wall_seconds, 1) if wall_seconds > 0 else None
+    summary["items_per_minute"] = round(summary["items_ok"] * 60.0 / wall_seconds, 2) if wall_seconds > 0 else None
+    return summary
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Tổng hợp giọng nói hàng loạt từ manifest JSONL (không qua API/Celery).")
+    parser.add_argument("manifest", help="File JSONL, mỗi dòng một mục cần tổng hợp.")
+    parser.add_argument("--output-dir", default="bulk_output", help="Thư mục ghi file WAV và completed.jsonl.")
+    parser.add_argument("--workers", type=int, default=1, help="Số process, mỗi process tải model một lần.")
+    parser.add_argument("--log-level", default=os.environ.get("LOG_LEVEL", "INFO").upper())
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    summary = run_bulk_synthesis(args.manifest, args.output_dir, workers=args.workers, log_level=args.log_level)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 0 if summary["items_failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -43,7 +43,7 @@ except ImportError as e_import_config:
     default_redis_port = int(os.environ.get('REDIS_PORT', 6379))
     celery_app.conf.broker_url = os.environ.get('CELERY_BROKER_URL', f"redis://{default_redis_host}:{default_redis_port}/{int(os.environ.get('REDIS_CELERY_DB',0))}")
     celery_app.conf.result_backend = os.environ.get('CELERY_RESULT_BACKEND_URL', f"redis://{default_redis_host}:{default_redis_port}/{int(os.environ.get('REDIS_CELERY_RESULTS_DB',1))}")
-    celery_app.conf.imports = ('app.tasks',) 
+    celery_app.conf.imports = ('app.tasks', 'app.worker_health') 
     logger.info(f"Đã áp dụng cấu hình Redis dự phòng. Broker: {celery_app.conf.broker_url}")
 
 except Exception as e_config:
@@ -53,7 +53,7 @@ except Exception as e_config:
     default_redis_port = int(os.environ.get('REDIS_PORT', 6379))
     celery_app.conf.broker_url = os.environ.get('CELERY_BROKER_URL', f"redis://{default_redis_host}:{default_redis_port}/{int(os.environ.get('REDIS_CELERY_DB',0))}")
     celery_app.conf.result_backend = os.environ.get('CELERY_RESULT_BACKEND_URL', f"redis://{default_redis_host}:{default_redis_port}/{int(os.environ.get('REDIS_CELERY_RESULTS_DB',1))}")
-    celery_app.conf.imports = ('app.tasks',)
+    celery_app.conf.imports = ('app.tasks', 'app.worker_health')
     logger.info(f"Đã áp dụng cấu hình Redis dự phòng. Broker: {celery_app.conf.broker_url}")
 
 
@@ -9,7 +9,11 @@ worker_max_memory_per_child = 2000000
 task_time_limit = 600 
 task_soft_time_limit = 540 
 worker_prefetch_multiplier = 1
+# process con của prefork warm-up model trong worker_process_init trước khi báo sẵn sàng; mặc định 4s của Celery là quá ngắn
+worker_proc_alive_timeout = float(os.environ.get('WORKER_PROC_ALIVE_TIMEOUT', 300))
 task_acks_late = True
+# ghi STARTED khi worker nhận task: PENDING chỉ còn nghĩa là chưa worker nào chạy (DELETE /tts/<task_id> dựa vào đó)
+task_track_started = True
 
 _REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
 _REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
@@ -34,5 +38,5 @@ ACCEPT_CONTENT = ['json']
 TIMEZONE = 'Asia/Ho_Chi_Minh'
 ENABLE_UTC = True
 RESULT_EXPIRES = int(os.environ.get('CELERY_RESULT_EXPIRES', 3600 * 24)) 
-IMPORTS = ('app.tasks',)
+IMPORTS = ('app.tasks', 'app.worker_health')
 
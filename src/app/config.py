@@ -26,6 +26,121 @@ VOCAB_PATH = os.path.join(MODEL_DIR, VOCAB_FILENAME)
 SPEAKERS_XTTS_PATH = os.path.join(MODEL_DIR, SPEAKERS_XTTS_FILENAME)
 
 
+# Lưu trữ kết quả và file giọng mẫu: "local" (thư mục OUTPUT_DIR) hoặc "s3" (object store tương thích S3)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local").strip().lower()
+STORAGE_CHUNK_SIZE = int(os.environ.get("STORAGE_CHUNK_SIZE", 1024 * 1024))
+# Cách API trả file kết quả: "stream" (API đọc và gửi) hoặc "redirect" (chuyển hướng tới URL tải trực tiếp nếu backend hỗ trợ)
+STORAGE_DOWNLOAD_MODE = os.environ.get("STORAGE_DOWNLOAD_MODE", "stream").strip().lower()
+S3_BUCKET = os.environ.get("S3_BUCKET", "")
+S3_PREFIX = os.environ.get("S3_PREFIX", "tts")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL") or None
+S3_REGION = os.environ.get("S3_REGION") or None
+S3_ACCESS_KEY_ID = os.environ.get("S3_ACCESS_KEY_ID") or None
+S3_SECRET_ACCESS_KEY = os.environ.get("S3_SECRET_ACCESS_KEY") or None
+S3_MULTIPART_THRESHOLD_BYTES = int(os.environ.get("S3_MULTIPART_THRESHOLD_BYTES", 8 * 1024 * 1024))
+S3_PRESIGNED_URL_EXPIRES = int(os.environ.get("S3_PRESIGNED_URL_EXPIRES", 3600))
+
+
+# Cache trạng thái task đã kết thúc (SUCCESS/FAILURE/REVOKED) trong process API
+TASK_STATE_CACHE_MAX_ENTRIES = int(os.environ.get("TASK_STATE_CACHE_MAX_ENTRIES", 10000))
+TASK_STATE_CACHE_TTL_SECONDS = float(os.environ.get("TASK_STATE_CACHE_TTL_SECONDS", 300))
+
+# Hủy task (DELETE /tts/<task_id>): cờ hủy trong Redis, worker kiểm tra trước khi bắt đầu và trước mỗi câu.
+# Cùng TTL cho bản ghi task_id -> API key tạo task (task_id không có bản ghi và chưa chạy -> 404)
+TASK_CANCEL_FLAG_TTL_SECONDS = int(os.environ.get("TASK_CANCEL_FLAG_TTL_SECONDS", 3600 * 24))
+
+
+# Mô hình chi phí tổng hợp (được hiệu chỉnh dần từ thời gian thực tế của các task)
+CHARS_PER_AUDIO_SECOND = {
+    "vi": 14.0, "en": 15.0, "es": 15.0, "fr": 15.0, "de": 14.0, "it": 15.0, "pt": 15.0,
+    "pl": 13.0, "tr": 13.0, "ru": 13.0, "nl": 14.0, "cs": 13.0, "ar": 12.0, "hu": 13.0,
+    "hi": 12.0, "zh-cn": 4.5, "ja": 6.0, "ko": 6.0
+}
+DEFAULT_CHARS_PER_AUDIO_SECOND = 14.0
+COST_MODEL_DEFAULT_RTF = float(os.environ.get("COST_MODEL_DEFAULT_RTF", 1.0))
+COST_MODEL_FIXED_OVERHEAD_SECONDS = float(os.environ.get("COST_MODEL_FIXED_OVERHEAD_SECONDS", 1.0))
+COST_MODEL_PER_SENTENCE_OVERHEAD_SECONDS = float(os.environ.get("COST_MODEL_PER_SENTENCE_OVERHEAD_SECONDS", 0.3))
+COST_MODEL_EMA_ALPHA = float(os.environ.get("COST_MODEL_EMA_ALPHA", 0.1))
+
+# Admission control (backpressure) cho /tts
+ADMISSION_CONTROL_ENABLED = os.environ.get("ADMISSION_CONTROL_ENABLED", "true").lower() in ["true", "1", "yes"]
+ADMISSION_MAX_BACKLOG_SECONDS = float(os.environ.get("ADMISSION_MAX_BACKLOG_SECONDS", 1800))
+ADMISSION_MAX_TEXT_CHARS = int(os.environ.get("ADMISSION_MAX_TEXT_CHARS", 0))  # 0 = không giới hạn
+ADMISSION_QUEUE_NAMES = [q.strip() for q in os.environ.get("ADMISSION_QUEUE_NAMES", "celery").split(",") if q.strip()]
+ADMISSION_QUEUE_DEPTH_CACHE_SECONDS = float(os.environ.get("ADMISSION_QUEUE_DEPTH_CACHE_SECONDS", 2.0))
+ADMISSION_WORKER_SLOTS = int(os.environ.get("ADMISSION_WORKER_SLOTS", 1))
+
+# /tts/sync: văn bản ngắn được tổng hợp ngay trong process API (model đã tải sẵn) và trả file WAV trong response.
+# Khi mọi slot đang bận quá SYNC_TTS_SLOT_WAIT_SECONDS (hoặc model_id khác mặc định), request chuyển sang queue như /tts (202)
+SYNC_TTS_ENABLED = os.environ.get("SYNC_TTS_ENABLED", "true").lower() in ["true", "1", "yes"]
+SYNC_TTS_MAX_CHARS = int(os.environ.get("SYNC_TTS_MAX_CHARS", 200))
+SYNC_TTS_MAX_SENTENCES = int(os.environ.get("SYNC_TTS_MAX_SENTENCES", 2))
+SYNC_TTS_MAX_CONCURRENCY = int(os.environ.get("SYNC_TTS_MAX_CONCURRENCY", 1))  # số tổng hợp đồng thời mỗi process API
+SYNC_TTS_SLOT_WAIT_SECONDS = float(os.environ.get("SYNC_TTS_SLOT_WAIT_SECONDS", 0.25))
+SYNC_TTS_WARMUP_ENABLED = os.environ.get("SYNC_TTS_WARMUP_ENABLED", "true").lower() in ["true", "1", "yes"]
+
+
+# Warm-up của Celery worker trước khi nhận task
+WORKER_WARMUP_ENABLED = os.environ.get("WORKER_WARMUP_ENABLED", "true").lower() in ["true", "1", "yes"]
+WORKER_WARMUP_LANGUAGES = [lang.strip() for lang in os.environ.get("WORKER_WARMUP_LANGUAGES", "vi").split(",") if lang.strip()]
+WORKER_WARMUP_RUNS = int(os.environ.get("WORKER_WARMUP_RUNS", 1))
+WORKER_WARMUP_TEXTS = {
+    "vi": "Xin chào, đây là câu khởi động hệ thống. Chúc bạn một ngày tốt lành.",
+    "en": "Hello, this is a warm-up sentence. Have a nice day.",
+}
+
+
+# Heartbeat worker và endpoint /capacity
+WORKER_HEARTBEAT_INTERVAL_SECONDS = float(os.environ.get("WORKER_HEARTBEAT_INTERVAL_SECONDS", 10))
+WORKER_RTF_WINDOW = int(os.environ.get("WORKER_RTF_WINDOW", 20))
+CAPACITY_CACHE_TTL_SECONDS = float(os.environ.get("CAPACITY_CACHE_TTL_SECONDS", 5))
+CAPACITY_MONITORED_QUEUES = [q.strip() for q in os.environ.get("CAPACITY_MONITORED_QUEUES", "celery,tts_tasks").split(",") if q.strip()]
+
+
+# Độ chính xác khi inference: fp32 | bf16 (autocast, CPU/GPU hỗ trợ bf16) | fp16 (autocast, chỉ GPU)
+TTS_INFERENCE_PRECISION = os.environ.get("TTS_INFERENCE_PRECISION", "fp32").strip().lower()
+# Ngưỡng của `python -m app.domain.tts_model`: độ tương đồng phổ (cosine log-STFT) tối thiểu của bf16/fp16 so với fp32
+PRECISION_CHECK_MIN_SIMILARITY = float(os.environ.get("PRECISION_CHECK_MIN_SIMILARITY", 0.95))
+
+# Dùng lại key/value cache của phần conditioning (gpt_cond_latent) trong GPT cho mọi câu cùng giọng mẫu
+GPT_PREFIX_CACHE_ENABLED = os.environ.get("GPT_PREFIX_CACHE_ENABLED", "true").lower() in ["true", "1", "yes"]
+GPT_PREFIX_CACHE_SIZE = int(os.environ.get("GPT_PREFIX_CACHE_SIZE", 8))  # số giọng mẫu giữ KV cache (~8 MB/giọng ở fp32)
+
+# Giới hạn số audio token GPT sinh cho mỗi câu và dừng sớm khi sinh lặp / im lặng kéo dài
+GENERATION_GUARD_ENABLED = os.environ.get("GENERATION_GUARD_ENABLED", "true").lower() in ["true", "1", "yes"]
+# Tối đa = thời lượng ước lượng của câu * hệ số + số giây dư
+GENERATION_MAX_DURATION_FACTOR = float(os.environ.get("GENERATION_MAX_DURATION_FACTOR", 2.5))
+GENERATION_MIN_EXTRA_SECONDS = float(os.environ.get("GENERATION_MIN_EXTRA_SECONDS", 2.0))
+# Dừng khi các token cuối (trong cửa sổ này) lặp tuần hoàn với chu kỳ <= GENERATION_REPEAT_MAX_PERIOD token
+GENERATION_REPEAT_WINDOW_SECONDS = float(os.environ.get("GENERATION_REPEAT_WINDOW_SECONDS", 1.5))
+GENERATION_REPEAT_MAX_PERIOD = int(os.environ.get("GENERATION_REPEAT_MAX_PERIOD", 8))
+
+# Chạy HiFi-GAN decoder bằng ONNX Runtime trên worker chỉ có CPU (cần `pip install onnxruntime`).
+# File ONNX được export một lần và lưu cạnh checkpoint; không dùng được thì decoder chạy bằng PyTorch như cũ.
+ONNX_DECODER_ENABLED = os.environ.get("ONNX_DECODER_ENABLED", "false").lower() in ["true", "1", "yes"]
+ONNX_DECODER_FILENAME = os.environ.get("ONNX_DECODER_FILENAME", "hifigan_decoder.onnx")
+# Thư mục ghi được để lưu file ONNX khi thư mục model chỉ đọc (mount :ro); trống = cạnh checkpoint
+ONNX_DECODER_CACHE_DIR = os.environ.get("ONNX_DECODER_CACHE_DIR", "").strip()
+ONNX_DECODER_INTRA_OP_THREADS = int(os.environ.get("ONNX_DECODER_INTRA_OP_THREADS", 0))  # 0 = ONNX Runtime tự chọn
+ONNX_DECODER_OPSET = int(os.environ.get("ONNX_DECODER_OPSET", 17))
+# Sai khác tương đối tối đa so với PyTorch khi kiểm tra lúc tải; vượt thì không dùng ONNX
+ONNX_DECODER_MAX_REL_DIFF = float(os.environ.get("ONNX_DECODER_MAX_REL_DIFF", 1e-3))
+
+
+# Pool nhiều checkpoint (model_id): mỗi thư mục con của MODEL_CHECKPOINTS_DIR chứa model.pth, config.json, vocab.json
+DEFAULT_MODEL_ID = "default"
+MODEL_CHECKPOINTS_DIR = os.environ.get("MODEL_CHECKPOINTS_DIR", os.path.join(MODEL_DIR, "checkpoints"))
+MODEL_POOL_MEMORY_BUDGET_MB = int(os.environ.get("MODEL_POOL_MEMORY_BUDGET_MB", 6144))  # 0 = không giới hạn
+MODEL_POOL_PINNED_IDS = [m.strip() for m in os.environ.get("MODEL_POOL_PINNED_IDS", DEFAULT_MODEL_ID).split(",") if m.strip()]
+# Worker đang giữ model <id> sẽ nhận thêm task từ queue MODEL_QUEUE_PREFIX + <id>
+MODEL_QUEUE_PREFIX = os.environ.get("MODEL_QUEUE_PREFIX", "tts_model.")
+
+
+# Checkpoint từng câu trong storage để task bị giao lại / retry sau soft time limit tiếp tục thay vì chạy lại từ đầu
+TTS_CHECKPOINTS_ENABLED = os.environ.get("TTS_CHECKPOINTS_ENABLED", "true").lower() in ["true", "1", "yes"]
+TTS_SOFT_TIME_LIMIT_MAX_RETRIES = int(os.environ.get("TTS_SOFT_TIME_LIMIT_MAX_RETRIES", 2))
+
+
 DEFAULT_TTS_PARAMS = {
     "temperature": 0.3,
     "length_penalty": 1.0,
@@ -39,11 +154,27 @@ DEFAULT_TTS_PARAMS = {
 MIN_CHAR_PER_SENTENCE_INPUT = 3
 MAX_FILENAME_PREFIX_CHAR = 50
 
+# Bộ tách câu tiếng Việt: "underthesea" (mặc định) hoặc "rule_based" (nhanh, không cần import underthesea)
+VI_SENTENCE_SPLITTER = os.environ.get("VI_SENTENCE_SPLITTER", "underthesea").strip().lower()
+
+# Giọng mẫu tải lên: giới hạn khi nhận (stream) và chuẩn hóa trước khi đưa vào hàng đợi
+SPEAKER_UPLOAD_MAX_BYTES = int(os.environ.get("SPEAKER_UPLOAD_MAX_BYTES", 20 * 1024 * 1024))
+SPEAKER_UPLOAD_MAX_SECONDS = float(os.environ.get("SPEAKER_UPLOAD_MAX_SECONDS", 600))
+# XTTS đọc giọng mẫu ở 22050 Hz và chỉ dùng tối đa max_ref_len (30) giây
+SPEAKER_REFERENCE_SAMPLE_RATE = int(os.environ.get("SPEAKER_REFERENCE_SAMPLE_RATE", 22050))
+SPEAKER_REFERENCE_MAX_SECONDS = float(os.environ.get("SPEAKER_REFERENCE_MAX_SECONDS", 30))
+API_MAX_REQUEST_BYTES = int(os.environ.get("API_MAX_REQUEST_BYTES", SPEAKER_UPLOAD_MAX_BYTES + 5 * 1024 * 1024))
+
+# Khử nhiễu (tham số hậu kỳ denoise_method): noisereduce | spectral_gate | spectral_gate_streaming
+DENOISE_DEFAULT_METHOD = os.environ.get("DENOISE_DEFAULT_METHOD", "noisereduce").strip().lower()
+DENOISE_NOISE_PROFILE_CACHE_SIZE = int(os.environ.get("DENOISE_NOISE_PROFILE_CACHE_SIZE", 64))
+DENOISE_STREAM_BLOCK_SECONDS = float(os.environ.get("DENOISE_STREAM_BLOCK_SECONDS", 10.0))
+
 DEFAULT_AUDIO_POSTPROCESSING_PARAMS = {
     "trim_silence": False,
     "trim_top_db": 20,
     "reduce_noise": False,
-    "denoise_method": "noisereduce",
+    "denoise_method": DENOISE_DEFAULT_METHOD,
     "apply_compressor": False,
     "comp_threshold_db": -16.0,
     "comp_ratio": 4.0,
@@ -54,7 +185,8 @@ DEFAULT_AUDIO_POSTPROCESSING_PARAMS = {
     "eq_peak_voice_q": 1.0,
     "eq_peak_voice_gain_db": 1.5,
     "normalize_volume": False,
-    "norm_target_limiter_db": -1.0
+    "norm_target_limiter_db": -1.0,
+    "output_sample_rate": 0  # 0 = giữ nguyên tần số lấy mẫu của model (XTTS_SAMPLE_RATE)
 }
 
 SUPPORTED_LANGUAGES = {
@@ -66,6 +198,8 @@ SUPPORTED_LANGUAGES = {
 }
 
 XTTS_SAMPLE_RATE = 24000
+# Các giá trị hợp lệ của tham số output_sample_rate (điện thoại/IVR: 8000, 16000)
+SUPPORTED_OUTPUT_SAMPLE_RATES = [int(r) for r in os.environ.get("SUPPORTED_OUTPUT_SAMPLE_RATES", "8000,16000,22050,24000,44100,48000").split(",") if r.strip()]
 
 DEFAULT_DEV_API_KEY = "secret_development" 
 API_KEYS_STR = os.environ.get("VALID_API_KEYS", DEFAULT_DEV_API_KEY)
@@ -74,6 +208,52 @@ VALID_API_KEYS = [key.strip() for key in API_KEYS_STR.split(',') if key.strip()]
 
 API_KEY_HEADER = os.environ.get("API_KEY_HEADER_NAME", "X-API-Key")
 
+# Profiling theo yêu cầu (profile=true trên /tts): chỉ các API key này được bật và tải kết quả profiling
+PROFILING_API_KEYS = [key.strip() for key in os.environ.get("PROFILING_API_KEYS", "").split(',') if key.strip()]
+# Tỉ lệ request được profiling tự động (0.0 - 1.0), ví dụ 0.001 để lấy mẫu liên tục trên production
+PROFILING_SAMPLE_RATE = float(os.environ.get("PROFILING_SAMPLE_RATE", 0.0))
+PROFILING_TORCH_ENABLED = os.environ.get("PROFILING_TORCH_ENABLED", "true").lower() in ["true", "1", "yes"]
+PROFILING_TORCH_RECORD_SHAPES = os.environ.get("PROFILING_TORCH_RECORD_SHAPES", "false").lower() in ["true", "1", "yes"]
+
+# Giới hạn theo API key cho /tts (token bucket trong Redis): số request và số ký tự mỗi phút
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() in ["true", "1", "yes"]
+RATE_LIMIT_REQUESTS_PER_MINUTE = float(os.environ.get("RATE_LIMIT_REQUESTS_PER_MINUTE", 60))
+RATE_LIMIT_CHARS_PER_MINUTE = float(os.environ.get("RATE_LIMIT_CHARS_PER_MINUTE", 100000))
+# Ghi đè cho từng key: "key1=requests_per_minute:chars_per_minute,key2=..." (0 = không giới hạn)
+API_KEY_RATE_LIMITS = {
+    item.split("=", 1)[0].strip(): item.split("=", 1)[1].strip()
+    for item in os.environ.get("API_KEY_RATE_LIMITS", "").split(",") if "=" in item
+}
+
+# Lập lịch công bằng giữa các API key: task chờ trong hàng đợi riêng của từng key (Redis) và được đưa vào broker
+# theo deficit round robin, trọng số theo key, để broker chỉ giữ khoảng FAIR_SCHEDULER_MAX_BROKER_DEPTH task
+FAIR_SCHEDULING_ENABLED = os.environ.get("FAIR_SCHEDULING_ENABLED", "true").lower() in ["true", "1", "yes"]
+# "key1=3,key2=1" (mặc định 1): key có trọng số 3 nhận gấp 3 lần thời gian worker khi các key cùng có task chờ
+FAIR_SCHEDULING_WEIGHTS = {
+    item.split("=", 1)[0].strip(): float(item.split("=", 1)[1])
+    for item in os.environ.get("FAIR_SCHEDULING_WEIGHTS", "").split(",") if "=" in item
+}
+FAIR_SCHEDULER_QUANTUM_SECONDS = float(os.environ.get("FAIR_SCHEDULER_QUANTUM_SECONDS", 30))  # giây worker mỗi vòng, nhân trọng số
+FAIR_SCHEDULER_MAX_BROKER_DEPTH = int(os.environ.get("FAIR_SCHEDULER_MAX_BROKER_DEPTH", 0))  # 0 = số slot worker sẵn sàng
+FAIR_SCHEDULER_INTERVAL_SECONDS = float(os.environ.get("FAIR_SCHEDULER_INTERVAL_SECONDS", 0.5))
+
+# Tracing theo span từ request HTTP qua Celery tới từng bước tổng hợp; exporter: "file" (JSONL) | "otlp" (OTLP/HTTP JSON)
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "false").lower() in ["true", "1", "yes"]
+TRACING_EXPORTER = os.environ.get("TRACING_EXPORTER", "file").strip().lower()
+TRACING_SERVICE_NAME = os.environ.get("TRACING_SERVICE_NAME", "xtts-tts")
+TRACING_FILE_PATH = os.environ.get("TRACING_FILE_PATH", os.path.join(OUTPUT_DIR, "traces", "spans.jsonl"))
+TRACING_OTLP_ENDPOINT = os.environ.get("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACING_EXPORT_BATCH_SIZE = int(os.environ.get("TRACING_EXPORT_BATCH_SIZE", 256))
+TRACING_EXPORT_INTERVAL_SECONDS = float(os.environ.get("TRACING_EXPORT_INTERVAL_SECONDS", 2.0))
+
+# Logging: handler chạy trên thread nền (QueueHandler/QueueListener), định dạng "text" hoặc "json"
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").strip().lower()
+LOG_ASYNC = os.environ.get("LOG_ASYNC", "true").lower() in ["true", "1", "yes"]
+# Log INFO/DEBUG theo từng câu / từng bước hậu kỳ: tỉ lệ giữ lại (1.0 = tất cả) và số dòng tối đa mỗi giây (0 = không giới hạn)
+LOG_HOT_PATH_SAMPLE_RATE = float(os.environ.get("LOG_HOT_PATH_SAMPLE_RATE", 1.0))
+LOG_HOT_PATH_MAX_PER_SECOND = int(os.environ.get("LOG_HOT_PATH_MAX_PER_SECOND", 0))
+
 
 config_logger = logging.getLogger(__name__) 
 
@@ -0,0 +1,209 @@
+import math
+import logging
+
+import torch
+from transformers import StoppingCriteria
+
+from app.config import (
+    GENERATION_MAX_DURATION_FACTOR, GENERATION_MIN_EXTRA_SECONDS,
+    GENERATION_REPEAT_WINDOW_SECONDS, GENERATION_REPEAT_MAX_PERIOD,
+)
+from app.domain.services.synthesis_cost_estimator import SynthesisCostEstimator
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# GPT của XTTS sinh một audio token cho mỗi 1024 mẫu ở 22050 Hz
+XTTS_AUDIO_TOKENS_PER_SECOND = 22050 / 1024
+TRUNCATION_REASONS = ("token_cap", "repetition", "silence")
+
+
+def find_repeating_tail(tokens: list[int], window: int, max_period: int) -> int | None:
+    """Chu kỳ nhỏ nhất p <= max_period sao cho `window` token cuối lặp lại với chu kỳ p, hoặc None."""
+    if len(tokens) < window:
+        return None
+    tail = tokens[-window:]
+    for period in range(1, max_period + 1):
+        if period * 2 > window:
+            break
+        if all(tail[i] == tail[i - period] for i in range(period, window)):
+            return period
+    return None
+
+
+class RunawayGenerationCriteria(StoppingCriteria):
+    """
+    StoppingCriteria cho `generate` của GPT: dừng khi số token sinh ra vượt giới hạn, hoặc khi các token
+    cuối lặp tuần hoàn (chu kỳ 1 thường là im lặng/tiếng ù kéo dài, chu kỳ lớn hơn là lặp âm tiết).
+    Xtts.inference gọi generate một lần cho mỗi đoạn khi enable_text_splitting: lần thứ i dùng `chunk_max_new_tokens[i]`
+    (tính từ văn bản của đoạn đó, nếu có), trạng thái của lần generate được đặt lại, còn `stop_reasons` và tổng số
+    token được cộng dồn qua mọi lần.
+    """
+
+    def __init__(self, max_new_tokens: int, repeat_window: int, max_period: int,
+                 chunk_max_new_tokens: list[int] | None = None):
+        self.text_max_new_tokens = max_new_tokens
+        self.chunk_max_new_tokens = chunk_max_new_tokens or []
+        self.max_new_tokens = max_new_tokens
+        self.repeat_window = repeat_window
+        self.max_period = max_period
+        self.generation_count = 0
+        self.stop_reason: str | None = None
+        self.stop_reasons: list[str] = []
+        self.generated_tokens = 0
+        self.degenerate_tokens = 0
+        self._finished_tokens = 0
+        self._prompt_length = None
+        self._last_length = 0
+        self._last_token = None
+
+    @property
+    def total_generated_tokens(self) -> int:
+        return self._finished_tokens + self.generated_tokens
+
+    def _start_generation(self, sequence_length: int) -> None:
+        # lần generate mới: prompt là mọi thứ trước token đầu tiên vừa sinh
+        self._finished_tokens += self.generated_tokens
+        self._prompt_length = sequence_length - 1
+        self.generation_count += 1
+        self.stop_reason = None
+        self.generated_tokens = 0
+        chunk_index = self.generation_count - 1
+        # số lần generate khác số đoạn đã tách (phiên bản TTS khác?): dùng giới hạn của cả văn bản
+        self.max_new_tokens = (self.chunk_max_new_tokens[chunk_index] if chunk_index < len(self.chunk_max_new_tokens)
+                               else self.text_max_new_tokens)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs):
+        sequence_length = input_ids.shape[1]
+        # trong một lần generate, mỗi bước thêm đúng một token vào sau chuỗi của bước trước; prompt của đoạn kế tiếp
+        # có thể dài hơn chuỗi đã sinh của đoạn trước nên không chỉ so độ dài
+        if (self._prompt_length is None or sequence_length != self._last_length + 1
+                or int(input_ids[0, self._last_length - 1]) != self._last_token):
+            self._start_generation(sequence_length)
+        self._last_length = sequence_length
+        self._last_token = int(input_ids[0, -1])
+        self.generated_tokens = sequence_length - self._prompt_length
+
+        should_stop = False
+        if self.generated_tokens >= self.max_new_tokens:
+            self.stop_reason, should_stop = "token_cap", True
+        elif self.generated_tokens >= self.repeat_window:
+            # chỉ kiểm tra sequence đầu tiên: XTTS sinh một sequence cho mỗi câu (gpt_batch_size = 1)
+            period = find_repeating_tail(input_ids[0, -self.repeat_window:].tolist(), self.repeat_window, self.max_period)
+            if period is not None:
+                self.stop_reason = "silence" if period == 1 else "repetition"
+                self.degenerate_tokens = self.repeat_window
+                should_stop = True
+        if should_stop:
+            self.stop_reasons.append(self.stop_reason)
+        return torch.full((input_ids.shape[0],), should_stop, dtype=torch.bool, device=input_ids.device)
+
+    def keep_fraction(self) -> float | None:
+        """Phần âm thanh nên giữ khi dừng vì lặp/im lặng (bỏ đoạn thoái hóa ở cuối). None nếu không cần cắt."""
+        if self.stop_reason not in ("silence", "repetition") or self.generation_count != 1 or self.generated_tokens <= 0:
+            return None
+        return max(0.0, (self.generated_tokens - self.degenerate_tokens) / self.generated_tokens)
+
+
+class GenerationGuard:
+    """Tạo RunawayGenerationCriteria cho từng câu: giới hạn token từ thời lượng ước lượng theo ngôn ngữ (mô hình chi phí)."""
+
+    def __init__(self,
+                 cost_estimator: SynthesisCostEstimator | None = None,
+                 max_duration_factor: float = GENERATION_MAX_DURATION_FACTOR,
+                 min_extra_seconds: float = GENERATION_MIN_EXTRA_SECONDS,
+                 repeat_window_seconds: float = GENERATION_REPEAT_WINDOW_SECONDS,
+                 max_period: int = GENERATION_REPEAT_MAX_PERIOD):
+        self.cost_estimator = cost_estimator or SynthesisCostEstimator()
+        self.max_duration_factor = max_duration_factor
+        self.min_extra_seconds = min_extra_seconds
+        self.repeat_window = max(2, math.ceil(repeat_window_seconds * XTTS_AUDIO_TOKENS_PER_SECOND))
+        self.max_period = max_period
+
+    def max_new_tokens(self, text: str, language: str) -> int:
+        # speed chỉ co giãn latent sau GPT, không đổi số token, nên ước lượng với speed = 1
+        expected_seconds = self.cost_estimator.estimate_audio_seconds(len(text), language)
+        return math.ceil((expected_seconds * self.max_duration_factor + self.min_extra_seconds) * XTTS_AUDIO_TOKENS_PER_SECOND)
+
+    def criteria_for(self, text: str, language: str, chunks: list[str] | None = None) -> RunawayGenerationCriteria:
+        """`chunks`: các đoạn mà Xtts.inference sẽ generate lần lượt (enable_text_splitting), mỗi đoạn có giới hạn riêng."""
+        chunk_caps = [self.max_new_tokens(chunk, language) for chunk in chunks] if chunks else None
+        return RunawayGenerationCriteria(self.max_new_tokens(text, language), self.repeat_window, self.max_period,
+                                         chunk_max_new_tokens=chunk_caps)
+
+    @staticmethod
+    def finish(criteria: RunawayGenerationCriteria, result: dict, language: str) -> dict:
+        """Ghi metrics và cắt đoạn lặp/im lặng ở cuối `wav` nếu generate bị dừng sớm."""
+        metrics.observe("tts_generation_audio_tokens", criteria.total_generated_tokens)
+        if not criteria.stop_reasons:
+            return result
+        for stop_reason in criteria.stop_reasons:
+            metrics.increment("tts_generation_truncated_total", reason=stop_reason, language=language)
+        logger.warning("GenerationGuard: Dừng sinh sớm (%s) trong %d/%d lần generate, tổng %d token.",
+                       ", ".join(criteria.stop_reasons), len(criteria.stop_reasons), criteria.generation_count,
+                       criteria.total_generated_tokens)
+        keep_fraction = criteria.keep_fraction()
+        wav = result.get("wav")
+        if keep_fraction is not None and wav is not None and len(wav) > 0:
+            result["wav"] = wav[:max(1, int(len(wav) * keep_fraction))]
+        return result
+
+
+def benchmark_generation_guard(sentences: list[str], language: str = "vi", seeds: range = range(5)) -> dict:
+    """
+    Tổng hợp các câu với nhiều seed khi tắt và bật guard; báo cáo thời gian, thời lượng âm thanh và số lần bị dừng sớm.
+    Phần tiết kiệm chỉ xuất hiện ở các lần sinh bị "chạy quá" (lặp, im lặng dài), nên dùng đủ nhiều seed/câu.
+    """
+    import time
+    from app.config import DEFAULT_SPEAKER_WAV_PATH, DEFAULT_TTS_PARAMS
+    from app.domain.tts_model import TTSModel
+
+    tts_model = TTSModel()
+    if not tts_model.is_loaded():
+        raise RuntimeError("Không tải được model mặc định.")
+    gpt_cond_latent, speaker_embedding = tts_model.get_conditioning_latents(DEFAULT_SPEAKER_WAV_PATH)
+    model_params = {k: v for k, v in DEFAULT_TTS_PARAMS.items() if k != "enable_text_splitting"}
+
+    def truncated_total() -> float:
+        return sum(metrics.get_counter("tts_generation_truncated_total", reason=reason, language=language)
+                   for reason in TRUNCATION_REASONS)
+
+    def run(use_guard: bool) -> dict:
+        total_seconds, audio_samples, truncated = 0.0, 0, 0
+        for seed in seeds:
+            for sentence in sentences:
+                torch.manual_seed(seed)
+                truncated_before = truncated_total()
+                started_at = time.perf_counter()
+                result = tts_model.inference(sentence, language, gpt_cond_latent, speaker_embedding, model_params,
+                                             use_generation_guard=use_guard)
+                total_seconds += time.perf_counter() - started_at
+                audio_samples += len(result["wav"])
+                truncated += int(truncated_total() > truncated_before)
+        runs = len(sentences) * len(seeds)
+        return {"seconds_per_sentence": round(total_seconds / runs, 4),
+                "audio_seconds_per_sentence": round(audio_samples / 24000 / runs, 3),
+                "truncated_generations": truncated}
+
+    run(False)  # warm-up
+    without_guard = run(False)
+    with_guard = run(True)
+    return {
+        "runs": len(sentences) * len(seeds),
+        "without_guard": without_guard,
+        "with_guard": with_guard,
+        "saved_seconds_per_sentence": round(without_guard["seconds_per_sentence"] - with_guard["seconds_per_sentence"], 4),
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    import json
+
+    logging.basicConfig(level=logging.INFO)
+    test_sentences = sys.argv[1:] or [
+        "Vâng.",
+        "Xin chào, đây là câu thử nghiệm ngắn.",
+        "Hôm nay chúng ta kiểm tra xem model có sinh quá độ dài cần thiết hay không.",
+    ]
+    print(json.dumps(benchmark_generation_guard(test_sentences), indent=2, ensure_ascii=False))
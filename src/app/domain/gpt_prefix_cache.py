@@ -0,0 +1,216 @@
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import torch
+
+from app.config import GPT_PREFIX_CACHE_SIZE
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# gpt_cond_latent của lời gọi TTSModel.inference hiện tại; None (ngoài inference hoặc use_prefix_cache=False) = forward gốc
+_active_cond_latent: ContextVar[torch.Tensor | None] = ContextVar("active_gpt_cond_latent", default=None)
+
+
+def _is_empty_cache(past_key_values) -> bool:
+    if past_key_values is None:
+        return True
+    if hasattr(past_key_values, "get_seq_length"):
+        return past_key_values.get_seq_length() == 0
+    return len(past_key_values) == 0
+
+
+def _to_legacy_cache(past_key_values) -> tuple:
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return past_key_values.to_legacy_cache()
+    return tuple(past_key_values)
+
+
+def _build_past(prefix_kv: tuple, batch_size: int, like_incoming):
+    """KV của phần conditioning, mở rộng theo batch, cùng kiểu với cache mà transformers truyền vào (tuple hoặc Cache)."""
+    legacy = tuple((k.expand(batch_size, -1, -1, -1), v.expand(batch_size, -1, -1, -1)) for k, v in prefix_kv)
+    if like_incoming is None or isinstance(like_incoming, tuple):
+        return legacy
+    from transformers import DynamicCache
+    if hasattr(DynamicCache, "from_legacy_cache"):
+        return DynamicCache.from_legacy_cache(legacy)
+    return DynamicCache(legacy)
+
+
+class _PrefixEntry:
+    __slots__ = ("cond_emb", "kv")
+
+    def __init__(self, cond_emb: torch.Tensor, kv: tuple):
+        self.cond_emb = cond_emb
+        self.kv = kv
+
+
+class GptPrefixCache:
+    """
+    Mỗi câu của XTTS được sinh với chuỗi đầu vào [gpt_cond_latent | văn bản | start_audio]. GPT là causal và không có
+    position embedding bên trong transformer, nên key/value của các vị trí gpt_cond_latent chỉ phụ thuộc vào giọng mẫu.
+    Lớp này thay `gpt_inference.forward` của model (ở mức instance) để bước đầu tiên của generate chỉ chạy phần văn bản
+    với KV của phần conditioning đã tính sẵn, thay vì chạy lại toàn bộ chuỗi. KV được cache (LRU) theo tensor
+    gpt_cond_latent: một lần cho mỗi request, và một lần cho mỗi giọng mẫu có latents được cache trong TTSModel.
+    """
+
+    def __init__(self, max_entries: int = GPT_PREFIX_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[int, _PrefixEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._installed = False
+
+    def install(self, xtts_model) -> bool:
+        gpt_inference = getattr(getattr(xtts_model, "gpt", None), "gpt_inference", None)
+        if gpt_inference is None or not hasattr(gpt_inference, "cached_prefix_emb"):
+            logger.warning("GptPrefixCache: Không tìm thấy gpt.gpt_inference (phiên bản TTS khác?), bỏ qua cache prefix.")
+            return False
+        original_forward = gpt_inference.forward
+        prefix_cache = self
+
+        def _forward_with_prefix_cache(input_ids=None, past_key_values=None, attention_mask=None, position_ids=None, **kwargs):
+            cond_latent = _active_cond_latent.get()
+            prefix_emb = gpt_inference.cached_prefix_emb
+            if (cond_latent is None or prefix_emb is None or input_ids is None or input_ids.shape[1] == 1
+                    or not _is_empty_cache(past_key_values) or kwargs.get("inputs_embeds") is not None
+                    or prefix_emb.shape[1] <= cond_latent.shape[1]):
+                return original_forward(input_ids=input_ids, past_key_values=past_key_values,
+                                        attention_mask=attention_mask, position_ids=position_ids, **kwargs)
+            return prefix_cache._forward_first_step(gpt_inference, cond_latent, input_ids, past_key_values,
+                                                    attention_mask, position_ids, kwargs)
+
+        gpt_inference.forward = _forward_with_prefix_cache
+        self._installed = True
+        return True
+
+    @contextmanager
+    def activate(self, gpt_cond_latent: torch.Tensor):
+        """Trong `with`, các lần generate của GPT dùng (và tạo nếu chưa có) KV cache của gpt_cond_latent này."""
+        if not self._installed:
+            yield
+            return
+        token = _active_cond_latent.set(gpt_cond_latent)
+        try:
+            yield
+        finally:
+            _active_cond_latent.reset(token)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _get_prefix_kv(self, gpt_inference, cond_latent: torch.Tensor, cond_emb: torch.Tensor) -> tuple:
+        entry_key = id(cond_latent)
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            # id() có thể được dùng lại sau khi tensor cũ bị thu hồi: so sánh nội dung trước khi dùng
+            if entry is not None and entry.cond_emb.shape == cond_emb.shape and entry.cond_emb.dtype == cond_emb.dtype \
+                    and torch.equal(entry.cond_emb, cond_emb):
+                self._entries.move_to_end(entry_key)
+                metrics.increment("tts_gpt_prefix_cache_hits_total")
+                return entry.kv
+
+        outputs = gpt_inference.transformer(inputs_embeds=cond_emb, use_cache=True, return_dict=True)
+        kv = _to_legacy_cache(outputs.past_key_values)
+        with self._lock:
+            self._entries[entry_key] = _PrefixEntry(cond_emb.clone(), kv)
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        metrics.increment("tts_gpt_prefix_cache_misses_total")
+        return kv
+
+    def _forward_first_step(self, gpt_inference, cond_latent, input_ids, past_key_values, attention_mask, position_ids, kwargs):
+        """Tương đương GPT2InferenceModel.forward ở bước đầu, nhưng chỉ chạy transformer trên phần sau conditioning."""
+        from transformers.modeling_outputs import CausalLMOutputWithCrossAttentions
+
+        cond_len = cond_latent.shape[1]
+        prefix_emb = gpt_inference.cached_prefix_emb
+        prefix_len = prefix_emb.shape[1]
+
+        gen_emb = gpt_inference.embeddings(input_ids[:, prefix_len:])
+        gen_emb = gen_emb + gpt_inference.pos_embedding(gen_emb)
+        batch_size = gen_emb.shape[0]
+        if prefix_emb.shape[0] != batch_size:
+            prefix_emb = prefix_emb.repeat_interleave(batch_size // prefix_emb.shape[0], 0)
+        prefix_emb = prefix_emb.to(gen_emb.dtype)
+
+        prefix_kv = self._get_prefix_kv(gpt_inference, cond_latent, prefix_emb[:1, :cond_len].contiguous())
+        suffix_emb = torch.cat([prefix_emb[:, cond_len:], gen_emb], dim=1)
+
+        transformer_outputs = gpt_inference.transformer(
+            inputs_embeds=suffix_emb,
+            past_key_values=_build_past(prefix_kv, batch_size, past_key_values),
+            attention_mask=attention_mask,
+            position_ids=position_ids[:, cond_len:] if position_ids is not None else None,
+            token_type_ids=kwargs["token_type_ids"][:, cond_len:] if kwargs.get("token_type_ids") is not None else None,
+            use_cache=True,
+            output_attentions=kwargs.get("output_attentions"),
+            output_hidden_states=kwargs.get("output_hidden_states"),
+            return_dict=True,
+        )
+        hidden_states = transformer_outputs[0]
+        lm_logits = gpt_inference.lm_head(gpt_inference.final_norm(hidden_states))
+        return CausalLMOutputWithCrossAttentions(
+            loss=None,
+            logits=lm_logits,
+            past_key_values=transformer_outputs.past_key_values,
+            hidden_states=transformer_outputs.hidden_states,
+            attentions=transformer_outputs.attentions,
+            cross_attentions=transformer_outputs.cross_attentions,
+        )
+
+
+def verify_and_benchmark(sentences: list[str], language: str = "vi", speaker_wav: str | None = None, seed: int = 1234) -> dict:
+    """
+    Kiểm tra tính đúng và đo thời gian: tổng hợp cùng các câu với cùng seed khi tắt và bật cache prefix,
+    so sánh gpt_latents (được suy ra từ chuỗi audio token sinh ra) và thời gian trung bình mỗi câu.
+    """
+    import time
+    from app.config import DEFAULT_SPEAKER_WAV_PATH, DEFAULT_TTS_PARAMS
+    from app.domain.tts_model import TTSModel
+
+    tts_model = TTSModel()
+    if not tts_model.is_loaded():
+        raise RuntimeError("Không tải được model mặc định.")
+    gpt_cond_latent, speaker_embedding = tts_model.get_conditioning_latents(speaker_wav or DEFAULT_SPEAKER_WAV_PATH)
+    model_params = {k: v for k, v in DEFAULT_TTS_PARAMS.items() if k != "enable_text_splitting"}
+
+    def run(use_prefix_cache: bool) -> tuple[list[torch.Tensor], float]:
+        tts_model.gpt_prefix_cache.clear()
+        outputs, started_at = [], time.perf_counter()
+        for sentence in sentences:
+            torch.manual_seed(seed)
+            result = tts_model.inference(sentence, language, gpt_cond_latent, speaker_embedding, model_params,
+                                         use_prefix_cache=use_prefix_cache)
+            outputs.append(result["gpt_latents"].float().cpu())
+        return outputs, (time.perf_counter() - started_at) / len(sentences)
+
+    run(False)  # warm-up
+    baseline_outputs, baseline_seconds = run(False)
+    cached_outputs, cached_seconds = run(True)
+    # gpt_latents được tính lại từ chuỗi token bằng một lượt forward không dùng cache: bằng nhau <=> cùng token
+    identical = all(torch.equal(a, b) for a, b in zip(baseline_outputs, cached_outputs))
+    return {
+        "sentences": len(sentences),
+        "identical_tokens": identical,
+        "seconds_per_sentence_without_cache": round(baseline_seconds, 4),
+        "seconds_per_sentence_with_cache": round(cached_seconds, 4),
+        "speedup": round(baseline_seconds / cached_seconds, 3) if cached_seconds > 0 else None,
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    import json
+
+    logging.basicConfig(level=logging.INFO)
+    test_sentences = sys.argv[1:] or [
+        "Xin chào, đây là câu thử nghiệm thứ nhất.",
+        "Hôm nay trời đẹp và chúng ta cùng kiểm tra tốc độ tổng hợp.",
+        "Câu cuối cùng dùng để so sánh độ trễ của từng câu.",
+    ]
+    print(json.dumps(verify_and_benchmark(test_sentences), indent=2, ensure_ascii=False))
@@ -0,0 +1,212 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Iterator
+
+from app.config import (
+    MODEL_PATH, CONFIG_PATH, VOCAB_PATH, SPEAKERS_XTTS_PATH, MODEL_FILENAME, CONFIG_FILENAME, VOCAB_FILENAME,
+    SPEAKERS_XTTS_FILENAME,
+    MODEL_CHECKPOINTS_DIR, DEFAULT_MODEL_ID, MODEL_POOL_MEMORY_BUDGET_MB, MODEL_POOL_PINNED_IDS, MODEL_QUEUE_PREFIX,
+)
+from app.domain.tts_model import TTSModel
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownModelError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    model_id: str
+    model_path: str
+    config_path: str
+    vocab_path: str
+    speakers_path: str
+
+
+def model_queue_name(model_id: str) -> str:
+    """Queue Celery dành cho các task dùng model `model_id`; chỉ worker đang giữ model đó mới consume."""
+    return f"{MODEL_QUEUE_PREFIX}{model_id}"
+
+
+def discover_model_specs(checkpoints_dir: str = MODEL_CHECKPOINTS_DIR) -> dict[str, ModelSpec]:
+    """
+    Liệt kê các checkpoint có thể tải: model mặc định (MODEL_DIR) và mỗi thư mục con của
+    MODEL_CHECKPOINTS_DIR chứa model.pth, config.json, vocab.json (tên thư mục là model_id).
+    speakers_xtts.pth (giọng có sẵn theo tên) là tùy chọn.
+    """
+    specs = {DEFAULT_MODEL_ID: ModelSpec(DEFAULT_MODEL_ID, MODEL_PATH, CONFIG_PATH, VOCAB_PATH, SPEAKERS_XTTS_PATH)}
+    if not os.path.isdir(checkpoints_dir):
+        return specs
+    for entry in sorted(os.listdir(checkpoints_dir)):
+        checkpoint_dir = os.path.join(checkpoints_dir, entry)
+        model_path = os.path.join(checkpoint_dir, MODEL_FILENAME)
+        if entry == DEFAULT_MODEL_ID or not os.path.isfile(model_path):
+            continue
+        specs[entry] = ModelSpec(
+            model_id=entry,
+            model_path=model_path,
+            config_path=os.path.join(checkpoint_dir, CONFIG_FILENAME),
+            vocab_path=os.path.join(checkpoint_dir, VOCAB_FILENAME),
+            speakers_path=os.path.join(checkpoint_dir, SPEAKERS_XTTS_FILENAME)
+        )
+    return specs
+
+
+class ModelRegistry:
+    """
+    Pool các model XTTS theo model_id: tải theo yêu cầu, giữ trong giới hạn bộ nhớ (RAM/VRAM)
+    và giải phóng model ít được dùng gần đây nhất (LRU). Việc tải một model không chặn các
+    request dùng model đã có sẵn trong bộ nhớ.
+    """
+
+    def __init__(self,
+                 model_specs: dict[str, ModelSpec] | None = None,
+                 memory_budget_bytes: int = MODEL_POOL_MEMORY_BUDGET_MB * 1024 * 1024,
+                 pinned_model_ids: list[str] = MODEL_POOL_PINNED_IDS,
+                 on_model_loaded: Callable[[str], None] | None = None,
+                 on_model_evicted: Callable[[str], None] | None = None):
+        self.model_specs = model_specs if model_specs is not None else discover_model_specs()
+        self.memory_budget_bytes = memory_budget_bytes
+        self.pinned_model_ids = set(pinned_model_ids)
+        self.on_model_loaded = on_model_loaded
+        self.on_model_evicted = on_model_evicted
+        self._loaded: OrderedDict[str, TTSModel] = OrderedDict()
+        self._sizes: dict[str, int] = {}
+        self._in_use: dict[str, int] = {}
+        self._load_locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def known_model_ids(self) -> list[str]:
+        return list(self.model_specs)
+
+    def resident_model_ids(self) -> list[str]:
+        with self._lock:
+            return list(self._loaded)
+
+    def adopt(self, model_id: str, tts_model: TTSModel) -> None:
+        """Đưa một model đã tải sẵn (ví dụ model mặc định của worker) vào pool."""
+        if not tts_model.is_loaded():
+            return
+        with self._lock:
+            self._loaded[model_id] = tts_model
+            self._sizes[model_id] = tts_model.estimated_memory_bytes()
+            metrics.set_gauge("tts_model_pool_bytes", self._used_bytes())
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "known_models": list(self.model_specs),
+                "resident_models": {model_id: self._sizes.get(model_id, 0) for model_id in self._loaded},
+                "in_use": {model_id: count for model_id, count in self._in_use.items() if count},
+                "used_bytes": self._used_bytes(),
+                "memory_budget_bytes": self.memory_budget_bytes,
+            }
+
+    def _used_bytes(self) -> int:
+        return sum(self._sizes.values())
+
+    def _evict_until_fits(self, required_bytes: int, keep_model_id: str | None = None) -> list[tuple[str, TTSModel]]:
+        """Chọn các model LRU cần giải phóng để còn đủ `required_bytes`. Gọi khi đang giữ self._lock."""
+        if self.memory_budget_bytes <= 0:
+            return []
+        evicted = []
+        for model_id in list(self._loaded):
+            if self._used_bytes() + required_bytes <= self.memory_budget_bytes:
+                break
+            if model_id == keep_model_id or model_id in self.pinned_model_ids or self._in_use.get(model_id):
+                continue
+            evicted.append((model_id, self._loaded.pop(model_id)))
+            self._sizes.pop(model_id, None)
+            logger.info(f"ModelRegistry: Giải phóng model '{model_id}' (LRU) để nằm trong giới hạn bộ nhớ.")
+        return evicted
+
+    def _finish_evictions(self, evicted_models: list[tuple[str, TTSModel]]) -> None:
+        for evicted_id, evicted_model in evicted_models:
+            evicted_model.unload()
+            metrics.increment("tts_model_evictions_total", model_id=evicted_id)
+            if self.on_model_evicted:
+                try:
+                    self.on_model_evicted(evicted_id)
+                except Exception as e_callback:
+                    logger.warning(f"ModelRegistry: Lỗi callback khi giải phóng model '{evicted_id}': {e_callback}")
+
+    def evict(self, model_id: str) -> bool:
+        """Giải phóng ngay một model (nếu không có request nào đang dùng nó)."""
+        with self._lock:
+            if model_id not in self._loaded or self._in_use.get(model_id):
+                return False
+            evicted = [(model_id, self._loaded.pop(model_id))]
+            self._sizes.pop(model_id, None)
+            metrics.set_gauge("tts_model_pool_bytes", self._used_bytes())
+        self._finish_evictions(evicted)
+        return True
+
+    def get(self, model_id: str | None = None) -> TTSModel:
+        model_id = model_id or next(iter(self.model_specs))
+        with self._lock:
+            if model_id in self._loaded:
+                self._loaded.move_to_end(model_id)
+                metrics.increment("tts_model_pool_hits_total", model_id=model_id)
+                return self._loaded[model_id]
+            spec = self.model_specs.get(model_id)
+            if spec is None:
+                raise UnknownModelError(f"Model '{model_id}' không tồn tại. Các model có sẵn: {', '.join(self.model_specs)}")
+            load_lock = self._load_locks.setdefault(model_id, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                if model_id in self._loaded:
+                    self._loaded.move_to_end(model_id)
+                    return self._loaded[model_id]
+                estimated_bytes = os.path.getsize(spec.model_path) if os.path.exists(spec.model_path) else 0
+                evicted = self._evict_until_fits(estimated_bytes, keep_model_id=model_id)
+            self._finish_evictions(evicted)
+
+            logger.info(f"ModelRegistry: Đang tải model '{model_id}' từ {spec.model_path}...")
+            load_started_at = time.perf_counter()
+            tts_model = TTSModel(spec.model_path, spec.config_path, spec.vocab_path, spec.speakers_path)
+            if not tts_model.is_loaded():
+                tts_model.unload()
+                raise RuntimeError(f"Không thể tải model '{model_id}'.")
+            metrics.increment("tts_model_loads_total", model_id=model_id)
+            metrics.observe("tts_model_load_seconds", time.perf_counter() - load_started_at)
+
+            with self._lock:
+                self._loaded[model_id] = tts_model
+                self._sizes[model_id] = tts_model.estimated_memory_bytes()
+                evicted = self._evict_until_fits(0, keep_model_id=model_id)
+                metrics.set_gauge("tts_model_pool_bytes", self._used_bytes())
+            self._finish_evictions(evicted)
+            logger.info(f"ModelRegistry: Model '{model_id}' đã sẵn sàng ({self._sizes.get(model_id, 0) / 1024 / 1024:.0f} MB).")
+
+        if self.on_model_loaded:
+            try:
+                self.on_model_loaded(model_id)
+            except Exception as e_callback:
+                logger.warning(f"ModelRegistry: Lỗi callback khi tải model '{model_id}': {e_callback}")
+        return tts_model
+
+    @contextmanager
+    def use(self, model_id: str | None = None) -> Iterator[TTSModel]:
+        """Lấy model và giữ cho nó không bị giải phóng trong phạm vi `with`."""
+        resolved_id = model_id or next(iter(self.model_specs))
+        while True:
+            tts_model = self.get(resolved_id)
+            with self._lock:
+                # Model có thể vừa bị giải phóng giữa get() và lúc đánh dấu đang dùng; khi đó tải lại.
+                if self._loaded.get(resolved_id) is tts_model:
+                    self._in_use[resolved_id] = self._in_use.get(resolved_id, 0) + 1
+                    break
+        try:
+            yield tts_model
+        finally:
+            with self._lock:
+                self._in_use[resolved_id] -= 1
@@ -0,0 +1,293 @@
+import copy
+import hashlib
+import inspect
+import json
+import logging
+import os
+import threading
+
+import torch
+
+from app.config import (
+    ONNX_DECODER_FILENAME, ONNX_DECODER_CACHE_DIR, ONNX_DECODER_INTRA_OP_THREADS, ONNX_DECODER_OPSET,
+    ONNX_DECODER_MAX_REL_DIFF,
+)
+
+logger = logging.getLogger(__name__)
+
+_INPUT_LATENTS = "latents"
+_INPUT_SPEAKER_EMBEDDING = "speaker_embedding"
+_OUTPUT_WAVEFORM = "waveform"
+_VERIFY_FRAMES = 24
+
+
+def onnx_decoder_path(model_path: str, cache_dir: str = ONNX_DECODER_CACHE_DIR) -> str:
+    """
+    File ONNX của decoder (mỗi checkpoint một file): cạnh checkpoint, hoặc trong `cache_dir` dưới thư mục con
+    <tên thư mục checkpoint>-<băm đường dẫn> khi thư mục model chỉ đọc.
+    """
+    checkpoint_dir = os.path.dirname(os.path.abspath(model_path))
+    if not cache_dir:
+        return os.path.join(checkpoint_dir, ONNX_DECODER_FILENAME)
+    dir_hash = hashlib.sha1(checkpoint_dir.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(cache_dir, f"{os.path.basename(checkpoint_dir)}-{dir_hash}", ONNX_DECODER_FILENAME)
+
+
+def _checkpoint_fingerprint(checkpoint_path: str, opset: int) -> dict:
+    stat = os.stat(checkpoint_path)
+    return {
+        "checkpoint_size": stat.st_size,
+        "checkpoint_mtime": int(stat.st_mtime),
+        "opset": opset,
+        "torch_version": torch.__version__.split("+")[0],
+    }
+
+
+def _relative_max_diff(reference: torch.Tensor, candidate: torch.Tensor) -> float:
+    reference, candidate = reference.float().reshape(-1), candidate.float().reshape(-1)
+    if reference.shape != candidate.shape:
+        return float("inf")
+    return float((reference - candidate).abs().max() / reference.abs().max().clamp_min(1e-6))
+
+
+class _DecoderExportWrapper(torch.nn.Module):
+    """Đầu vào dạng positional cho torch.onnx.export: HifiDecoder.forward(latents, g=speaker_embedding)."""
+
+    def __init__(self, decoder: torch.nn.Module):
+        super().__init__()
+        self.decoder = decoder
+
+    def forward(self, latents: torch.Tensor, speaker_embedding: torch.Tensor) -> torch.Tensor:
+        return self.decoder(latents, g=speaker_embedding)
+
+
+class OnnxHifiganDecoder:
+    """
+    Chạy HiFi-GAN decoder của XTTS (gpt_latents -> waveform) bằng ONNX Runtime trên CPU. Decoder được export một lần
+    ra file ONNX cạnh checkpoint hoặc trong ONNX_DECODER_CACHE_DIR (kèm file .json ghi kích thước/mtime checkpoint, opset và phiên bản torch; khác thì
+    export lại), được kiểm tra sai khác so với PyTorch ngay sau khi tải và chỉ thay `hifigan_decoder.forward` khi đạt.
+    """
+
+    def __init__(self, onnx_path: str,
+                 intra_op_threads: int = ONNX_DECODER_INTRA_OP_THREADS,
+                 opset: int = ONNX_DECODER_OPSET,
+                 max_rel_diff: float = ONNX_DECODER_MAX_REL_DIFF):
+        self.onnx_path = onnx_path
+        self.metadata_path = f"{onnx_path}.json"
+        self.intra_op_threads = intra_op_threads
+        self.opset = opset
+        self.max_rel_diff = max_rel_diff
+        self.torch_forward = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_ready(self) -> bool:
+        return self._session is not None
+
+    def is_stale(self, checkpoint_path: str) -> bool:
+        if not os.path.exists(self.onnx_path) or not os.path.exists(self.metadata_path):
+            return True
+        try:
+            with open(self.metadata_path, "r", encoding="utf-8") as f:
+                return json.load(f) != _checkpoint_fingerprint(checkpoint_path, self.opset)
+        except (OSError, ValueError):
+            return True
+
+    def export(self, xtts_model, checkpoint_path: str) -> None:
+        """Export decoder ra ONNX (ghi file tạm rồi os.replace, an toàn khi nhiều worker cùng export)."""
+        decoder = copy.deepcopy(xtts_model.hifigan_decoder).cpu().float().eval()
+        # bản sao mang theo forward đã bị thay ở mức instance (ví dụ _keep_decoder_in_fp32), trỏ về decoder gốc
+        decoder.__dict__.pop("forward", None)
+        try:
+            # gộp weight norm vào trọng số để graph ONNX không phải tính lại mỗi lần chạy
+            decoder.waveform_decoder.remove_weight_norm()
+        except (AttributeError, ValueError) as e_weight_norm:
+            logger.debug(f"OnnxHifiganDecoder: Không gộp được weight norm ({e_weight_norm}), export nguyên trạng.")
+
+        latent_dim = getattr(xtts_model.args, "gpt_n_model_channels", 1024)
+        speaker_dim = getattr(xtts_model.args, "d_vector_dim", 512)
+        dummy_inputs = (torch.randn(1, _VERIFY_FRAMES, latent_dim), torch.randn(1, speaker_dim, 1))
+        export_kwargs = {}
+        if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+            export_kwargs["dynamo"] = False  # dynamic_axes thuộc exporter TorchScript
+
+        os.makedirs(os.path.dirname(self.onnx_path), exist_ok=True)
+        tmp_path = f"{self.onnx_path}.{os.getpid()}.tmp"
+        logger.info(f"OnnxHifiganDecoder: Đang export HiFi-GAN decoder sang ONNX: {self.onnx_path}")
+        try:
+            with torch.no_grad():
+                torch.onnx.export(
+                    _DecoderExportWrapper(decoder), dummy_inputs, tmp_path,
+                    input_names=[_INPUT_LATENTS, _INPUT_SPEAKER_EMBEDDING],
+                    output_names=[_OUTPUT_WAVEFORM],
+                    dynamic_axes={_INPUT_LATENTS: {1: "frames"}, _OUTPUT_WAVEFORM: {2: "samples"}},
+                    opset_version=self.opset,
+                    do_constant_folding=True,
+                    **export_kwargs,
+                )
+            os.replace(tmp_path, self.onnx_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        # fingerprint cũng ghi qua file tạm: worker khác đọc song song không thấy JSON dở dang rồi export lại
+        tmp_metadata_path = f"{self.metadata_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_metadata_path, "w", encoding="utf-8") as f:
+                json.dump(_checkpoint_fingerprint(checkpoint_path, self.opset), f)
+            os.replace(tmp_metadata_path, self.metadata_path)
+        finally:
+            if os.path.exists(tmp_metadata_path):
+                os.remove(tmp_metadata_path)
+
+    def load_session(self, intra_op_threads: int | None = None) -> None:
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+        options.intra_op_num_threads = self.intra_op_threads if intra_op_threads is None else intra_op_threads
+        options.inter_op_num_threads = 1
+        # decoder chạy xen kẽ với GPT (PyTorch) trên cùng các nhân CPU: không để thread ORT quay chờ giữa các câu
+        options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+        self._session = onnxruntime.InferenceSession(self.onnx_path, sess_options=options,
+                                                     providers=["CPUExecutionProvider"])
+
+    def run(self, latents: torch.Tensor, speaker_embedding: torch.Tensor) -> torch.Tensor:
+        (waveform,) = self._session.run([_OUTPUT_WAVEFORM], {
+            _INPUT_LATENTS: latents.detach().float().cpu().numpy(),
+            _INPUT_SPEAKER_EMBEDDING: speaker_embedding.detach().float().cpu().numpy(),
+        })
+        return torch.from_numpy(waveform)
+
+    def compare(self, torch_forward, latents: torch.Tensor, speaker_embedding: torch.Tensor) -> float:
+        """Sai khác tương đối lớn nhất (max|ONNX - PyTorch| / max|PyTorch|) trên cùng một đầu vào."""
+        with torch.inference_mode():
+            reference = torch_forward(latents, g=speaker_embedding)
+        return _relative_max_diff(reference, self.run(latents, speaker_embedding))
+
+    def prepare(self, xtts_model, checkpoint_path: str) -> bool:
+        """Export (nếu chưa có hoặc đã cũ), tạo session và kiểm tra sai khác; False nếu không dùng được ONNX."""
+        with self._lock:
+            try:
+                if self.is_stale(checkpoint_path):
+                    self.export(xtts_model, checkpoint_path)
+                self.load_session()
+                generator = torch.Generator().manual_seed(0)
+                latent_dim = getattr(xtts_model.args, "gpt_n_model_channels", 1024)
+                speaker_dim = getattr(xtts_model.args, "d_vector_dim", 512)
+                rel_diff = self.compare(xtts_model.hifigan_decoder.forward,
+                                        torch.randn(1, _VERIFY_FRAMES, latent_dim, generator=generator),
+                                        torch.randn(1, speaker_dim, 1, generator=generator))
+            except ImportError as e_import:
+                logger.warning(f"OnnxHifiganDecoder: Thiếu thư viện ({e_import}), decoder tiếp tục chạy bằng PyTorch.")
+                self._session = None
+                return False
+            except Exception as e:
+                logger.error(f"OnnxHifiganDecoder: Không dùng được decoder ONNX, tiếp tục chạy bằng PyTorch: {e}",
+                             exc_info=True)
+                self._session = None
+                return False
+
+            if rel_diff > self.max_rel_diff:
+                logger.error(f"OnnxHifiganDecoder: Sai khác so với PyTorch quá lớn ({rel_diff:.2e} > "
+                             f"{self.max_rel_diff:.0e}), decoder tiếp tục chạy bằng PyTorch.")
+                self._session = None
+                return False
+            logger.info(f"OnnxHifiganDecoder: Decoder ONNX sẵn sàng (sai khác tương đối {rel_diff:.2e}, "
+                        f"intra_op_threads={self.intra_op_threads or 'mặc định'}).")
+            return True
+
+    def install(self, xtts_model, checkpoint_path: str) -> bool:
+        """Thay `hifigan_decoder.forward` (mức instance) bằng lời gọi ONNX Runtime."""
+        if not self.prepare(xtts_model, checkpoint_path):
+            return False
+        decoder = xtts_model.hifigan_decoder
+        torch_forward = decoder.forward
+        onnx_decoder = self
+
+        def _onnx_forward(latents, g=None):
+            if g is None:
+                return torch_forward(latents, g=g)
+            return onnx_decoder.run(latents, g)
+
+        self.torch_forward = torch_forward
+        decoder.forward = _onnx_forward
+        return True
+
+
+def verify_and_benchmark(thread_counts: list[int], sentences: list[str], language: str = "vi",
+                         speaker_wav: str | None = None, runs: int = 5) -> dict:
+    """
+    So sánh decoder ONNX với PyTorch trên gpt_latents thật (sinh từ các câu thử với giọng mẫu mặc định): sai khác
+    tương đối lớn nhất và thời gian decode trung bình mỗi câu trên CPU với từng số intra-op thread của ONNX Runtime.
+    """
+    import time
+    from app.config import DEFAULT_SPEAKER_WAV_PATH, DEFAULT_TTS_PARAMS
+    from app.domain.tts_model import TTSModel
+
+    tts_model = TTSModel()
+    if not tts_model.is_loaded():
+        raise RuntimeError("Không tải được model mặc định.")
+    if tts_model.device_type != "cpu":
+        raise RuntimeError("Benchmark dành cho node chỉ có CPU, hãy chạy với CUDA_VISIBLE_DEVICES=\"\".")
+    gpt_cond_latent, speaker_embedding = tts_model.get_conditioning_latents(speaker_wav or DEFAULT_SPEAKER_WAV_PATH)
+    speaker_embedding = speaker_embedding.float().cpu()
+    model_params = {k: v for k, v in DEFAULT_TTS_PARAMS.items() if k != "enable_text_splitting"}
+
+    onnx_decoder = tts_model.onnx_decoder or OnnxHifiganDecoder(onnx_decoder_path(tts_model.model_path))
+    if not onnx_decoder.is_ready and not onnx_decoder.prepare(tts_model.model, tts_model.model_path):
+        raise RuntimeError("Không export/tải được decoder ONNX (xem log).")
+    torch_forward = onnx_decoder.torch_forward or tts_model.model.hifigan_decoder.forward
+
+    latents_list = []
+    for sentence in sentences:
+        result = tts_model.inference(sentence, language, gpt_cond_latent, speaker_embedding, model_params)
+        latents_list.append(result["gpt_latents"].float().cpu())
+
+    def timed(decode) -> float:
+        decode(latents_list[0])  # warm-up
+        started_at = time.perf_counter()
+        for _ in range(runs):
+            for latents in latents_list:
+                decode(latents)
+        return (time.perf_counter() - started_at) / (runs * len(latents_list))
+
+    with torch.inference_mode():
+        torch_seconds = timed(lambda latents: torch_forward(latents, g=speaker_embedding))
+    rel_diff = max(onnx_decoder.compare(torch_forward, latents, speaker_embedding) for latents in latents_list)
+
+    onnx_timings = {}
+    for threads in thread_counts:
+        onnx_decoder.load_session(intra_op_threads=threads)
+        onnx_seconds = timed(lambda latents: onnx_decoder.run(latents, speaker_embedding))
+        onnx_timings[str(threads or "default")] = {
+            "seconds_per_sentence": round(onnx_seconds, 4),
+            "speedup": round(torch_seconds / onnx_seconds, 3) if onnx_seconds > 0 else None,
+        }
+    onnx_decoder.load_session()
+    return {
+        "sentences": len(latents_list),
+        "frames": [latents.shape[1] for latents in latents_list],
+        "max_rel_diff": rel_diff,
+        "equivalent": rel_diff <= onnx_decoder.max_rel_diff,
+        "torch_threads": torch.get_num_threads(),
+        "torch_seconds_per_sentence": round(torch_seconds, 4),
+        "onnx": onnx_timings,
+    }
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    # python -m app.domain.onnx_decoder [số_intra_op_thread ...]   (0 = ONNX Runtime tự chọn)
+    test_thread_counts = [int(arg) for arg in sys.argv[1:]] or [ONNX_DECODER_INTRA_OP_THREADS]
+    test_sentences = [
+        "Xin chào, đây là câu thử nghiệm thứ nhất.",
+        "Hôm nay trời đẹp và chúng ta cùng kiểm tra tốc độ của bộ giải mã âm thanh trên CPU.",
+        "Câu ngắn.",
+    ]
+    report = verify_and_benchmark(test_thread_counts, test_sentences)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    sys.exit(0 if report["equivalent"] else 1)
@@ -5,13 +5,18 @@ import logging
 import io
 
 import librosa 
-import noisereduce 
 from pedalboard import ( 
     Pedalboard, Compressor, Gain, LowShelfFilter, HighShelfFilter, PeakFilter, Limiter
 )
 from app.config import XTTS_SAMPLE_RATE 
+from app.domain.services.denoisers import get_denoiser
+from app.domain.services.resampler import resample
+from app.tracing import tracer
+from app.logging_setup import get_hot_path_logger
 
 logger = logging.getLogger(__name__)
+# Log theo từng bước hậu kỳ: được lấy mẫu theo LOG_HOT_PATH_SAMPLE_RATE / LOG_HOT_PATH_MAX_PER_SECOND
+hot_path_logger = get_hot_path_logger(__name__)
 
 class AudioPostprocessorService:
     def __init__(self, sample_rate: int = XTTS_SAMPLE_RATE):
@@ -34,7 +39,7 @@ class AudioPostprocessorService:
         if audio_tensor.numel() == 0: 
             logger.warning("Trimming: Input audio tensor is empty, skipping.")
             return audio_tensor
-        logger.info(f"Trimming silence with top_db={top_db}...")
+        hot_path_logger.info("Trimming silence with top_db=%s...", top_db)
         audio_np = self._to_numpy(audio_tensor)
         
         if audio_np.ndim == 0 or audio_np.size == 0 : 
@@ -43,37 +48,54 @@ class AudioPostprocessorService:
         
         try:
             trimmed_audio_np, _ = librosa.effects.trim(audio_np, top_db=top_db)
-            logger.info(f"Trimming: Original samples: {len(audio_np)}, Trimmed samples: {len(trimmed_audio_np)}")
+            hot_path_logger.info("Trimming: Original samples: %d, Trimmed samples: %d", len(audio_np), len(trimmed_audio_np))
             return self._to_tensor(trimmed_audio_np)
         except Exception as e:
             logger.error(f"Error during librosa trimming: {e}", exc_info=True)
             return audio_tensor
 
 
-    def _reduce_noise_basic(self, audio_tensor: torch.Tensor) -> torch.Tensor:
+    def output_sample_rate(self, processing_params: dict) -> int:
+        """Tần số lấy mẫu của file kết quả: output_sample_rate nếu được đặt (> 0), ngược lại tần số của model."""
+        requested_rate = int(processing_params.get("output_sample_rate") or 0)
+        return requested_rate if requested_rate > 0 else self.sample_rate
+
+    def _resample(self, audio_tensor: torch.Tensor, orig_rate: int, new_rate: int) -> torch.Tensor:
+        if orig_rate == new_rate or audio_tensor.numel() == 0:
+            return audio_tensor
+        # Không nuốt lỗi ở đây: trả lại audio ở tần số cũ sẽ làm file kết quả bị sai cao độ.
+        hot_path_logger.info("Resampling %d Hz -> %d Hz...", orig_rate, new_rate)
+        return resample(audio_tensor.cpu(), orig_rate, new_rate)
+
+    def _reduce_noise(self, audio_tensor: torch.Tensor, denoise_method: str | None, noise_profile_key: str | None = None,
+                      sample_rate: int | None = None) -> torch.Tensor:
         if audio_tensor.numel() == 0: 
             logger.warning("Noise Reduction: Input audio tensor is empty, skipping.")
             return audio_tensor
-        logger.info("Reducing noise (basic using noisereduce)...")
+        denoiser = get_denoiser(denoise_method)
+        hot_path_logger.info("Reducing noise (method: %s)...", denoiser.name)
         audio_np = self._to_numpy(audio_tensor)
 
         if audio_np.ndim == 0 or audio_np.size == 0:
             logger.warning("Noise Reduction: Audio numpy array is scalar or empty, skipping.")
             return audio_tensor
 
+        sample_rate = sample_rate or self.sample_rate
+        if noise_profile_key is not None:
+            noise_profile_key = f"{noise_profile_key}@{sample_rate}"
         try:
-            reduced_noise_audio_np = noisereduce.reduce_noise(y=audio_np, sr=self.sample_rate, stationary=True)
-            logger.info("Noise reduction applied.")
+            reduced_noise_audio_np = denoiser.denoise(audio_np, sample_rate, noise_profile_key=noise_profile_key)
+            hot_path_logger.info("Noise reduction applied.")
             return self._to_tensor(reduced_noise_audio_np)
         except Exception as e:
-            logger.error(f"Error during noisereduce processing: {e}", exc_info=True)
+            logger.error(f"Error during noise reduction ({denoiser.name}): {e}", exc_info=True)
             return audio_tensor
 
-    def _apply_pedalboard_effects(self, audio_tensor: torch.Tensor, params: dict) -> torch.Tensor:
+    def _apply_pedalboard_effects(self, audio_tensor: torch.Tensor, params: dict, sample_rate: int | None = None) -> torch.Tensor:
         if audio_tensor.numel() == 0:
             logger.warning("Pedalboard: Input audio tensor is empty, skipping.")
             return audio_tensor
-        logger.info(f"Applying Pedalboard effects with params: {params}...")
+        hot_path_logger.info("Applying Pedalboard effects with params: %s...", params)
         audio_np = self._to_numpy(audio_tensor)
 
         if audio_np.ndim == 0 or audio_np.size == 0:
@@ -111,15 +133,15 @@ class AudioPostprocessorService:
             ))
 
         if not board_effects:
-            logger.info("Pedalboard: No effects enabled.")
+            hot_path_logger.info("Pedalboard: No effects enabled.")
             return audio_tensor
 
         try:
             board = Pedalboard(board_effects)  
-            processed_audio_pb = board.process(audio_np_for_pb, sample_rate=self.sample_rate)  # Và sửa ở đây
+            processed_audio_pb = board.process(audio_np_for_pb, sample_rate=sample_rate or self.sample_rate)  # Và sửa ở đây
 
             final_processed_np = processed_audio_pb.reshape(-1) if audio_np_for_pb.shape[0] == 1 else processed_audio_pb
-            logger.info("Pedalboard effects applied.")
+            hot_path_logger.info("Pedalboard effects applied.")
             return self._to_tensor(final_processed_np)
         except Exception as e:
             logger.error(f"Error during pedalboard effects processing: {e}", exc_info=True)
@@ -127,28 +149,47 @@ class AudioPostprocessorService:
 
 
 
-    def process_audio(self, audio_tensor: torch.Tensor, processing_params: dict) -> torch.Tensor:
+    def process_audio(self, audio_tensor: torch.Tensor, processing_params: dict, noise_profile_key: str | None = None) -> torch.Tensor:
         if not isinstance(audio_tensor, torch.Tensor) or audio_tensor.numel() == 0:
             logger.warning("Audio Postprocess: Input audio_tensor không hợp lệ hoặc rỗng, không xử lý.")
             return audio_tensor if isinstance(audio_tensor, torch.Tensor) else torch.empty(0)
 
+        with tracer.span("postprocess.process_audio", input_samples=audio_tensor.numel()):
+            return self._process_audio(audio_tensor, processing_params, noise_profile_key)
+
+    def _process_audio(self, audio_tensor: torch.Tensor, processing_params: dict, noise_profile_key: str | None) -> torch.Tensor:
         current_audio = audio_tensor
-        logger.info(f"Starting audio post-processing with params: {processing_params}")
+        hot_path_logger.info("Starting audio post-processing with params: %s", processing_params)
+
+        # Hạ tần số lấy mẫu trước để các bước sau xử lý ít mẫu hơn; tăng tần số (nếu có) thì làm sau cùng.
+        target_rate = self.output_sample_rate(processing_params)
+        current_rate = self.sample_rate
+        if target_rate < current_rate:
+            with tracer.span("postprocess.resample", orig_rate=current_rate, new_rate=target_rate):
+                current_audio = self._resample(current_audio, current_rate, target_rate)
+            current_rate = target_rate
 
         if processing_params.get("trim_silence", False):
-            current_audio = self._trim_silence(current_audio, top_db=int(processing_params.get("trim_top_db", 20)))
+            with tracer.span("postprocess.trim_silence"):
+                current_audio = self._trim_silence(current_audio, top_db=int(processing_params.get("trim_top_db", 20)))
             if current_audio.numel() == 0: logger.warning("Audio became empty after trimming."); return current_audio
         
         if processing_params.get("reduce_noise", False):
-            current_audio = self._reduce_noise_basic(current_audio)
+            with tracer.span("postprocess.reduce_noise", method=processing_params.get("denoise_method")):
+                current_audio = self._reduce_noise(current_audio, processing_params.get("denoise_method"), noise_profile_key, sample_rate=current_rate)
             if current_audio.numel() == 0: logger.warning("Audio became empty after noise reduction."); return current_audio
             
         is_pedalboard_needed = any(
             processing_params.get(key, False) for key in ["apply_compressor", "apply_eq", "normalize_volume"]
         )
         if is_pedalboard_needed:
-            current_audio = self._apply_pedalboard_effects(current_audio, processing_params)
+            with tracer.span("postprocess.pedalboard_effects"):
+                current_audio = self._apply_pedalboard_effects(current_audio, processing_params, sample_rate=current_rate)
             if current_audio.numel() == 0: logger.warning("Audio became empty after pedalboard effects."); return current_audio
+
+        if target_rate != current_rate:
+            with tracer.span("postprocess.resample", orig_rate=current_rate, new_rate=target_rate):
+                current_audio = self._resample(current_audio, current_rate, target_rate)
         
-        logger.info("Hoàn tất xử lý hậu kỳ âm thanh.")
+        hot_path_logger.info("Hoàn tất xử lý hậu kỳ âm thanh.")
         return current_audio
\ No newline at end of file
@@ -0,0 +1,39 @@
+import logging
+import threading
+
+import torch
+import torchaudio
+
+logger = logging.getLogger(__name__)
+
+# Tham số Kaiser tương đương "kaiser_best" của librosa/resampy: lọc chống aliasing dốc, phù hợp khi hạ xuống 8/16 kHz
+_KAISER_BEST = {"lowpass_filter_width": 64, "rolloff": 0.9475937167399596, "beta": 14.769656459379492}
+
+_resamplers: dict[tuple[int, int], torchaudio.transforms.Resample] = {}
+_resamplers_lock = threading.Lock()
+
+
+def _build_resampler(orig_freq: int, new_freq: int) -> torchaudio.transforms.Resample:
+    try:
+        return torchaudio.transforms.Resample(orig_freq, new_freq, resampling_method="sinc_interp_kaiser", **_KAISER_BEST)
+    except ValueError:
+        # torchaudio < 2.1 dùng tên cũ của phương pháp Kaiser
+        return torchaudio.transforms.Resample(orig_freq, new_freq, resampling_method="kaiser_window", **_KAISER_BEST)
+
+
+def get_resampler(orig_freq: int, new_freq: int) -> torchaudio.transforms.Resample:
+    """Resampler polyphase (kernel sinc cửa sổ Kaiser) dùng chung cho mỗi cặp tần số; kernel chỉ được tính một lần."""
+    key = (orig_freq, new_freq)
+    with _resamplers_lock:
+        resampler = _resamplers.get(key)
+        if resampler is None:
+            logger.info(f"Resampler: Tạo kernel {orig_freq} Hz -> {new_freq} Hz.")
+            resampler = _resamplers[key] = _build_resampler(orig_freq, new_freq)
+        return resampler
+
+
+def resample(audio: torch.Tensor, orig_freq: int, new_freq: int) -> torch.Tensor:
+    if orig_freq == new_freq or audio.numel() == 0:
+        return audio
+    with torch.inference_mode():
+        return get_resampler(orig_freq, new_freq)(audio.to(torch.float32))
@@ -0,0 +1,102 @@
+import io
+import logging
+from dataclasses import dataclass
+from typing import BinaryIO
+
+import torch
+import torchaudio
+
+from app.config import (
+    SPEAKER_UPLOAD_MAX_BYTES, SPEAKER_UPLOAD_MAX_SECONDS,
+    SPEAKER_REFERENCE_SAMPLE_RATE, SPEAKER_REFERENCE_MAX_SECONDS,
+)
+from app.domain.services.resampler import resample
+
+logger = logging.getLogger(__name__)
+
+_COPY_CHUNK_SIZE = 256 * 1024
+
+
+class SpeakerReferenceError(ValueError):
+    """Giọng mẫu không hợp lệ; `status_code` là mã HTTP nên trả cho client."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass(frozen=True)
+class PreparedSpeakerReference:
+    audio_data: io.BytesIO
+    source_seconds: float
+    reference_seconds: float
+    sample_rate: int
+
+
+def copy_bounded(source: BinaryIO, destination: BinaryIO, max_bytes: int = SPEAKER_UPLOAD_MAX_BYTES) -> int:
+    """Chép stream theo từng khối, dừng ngay khi vượt `max_bytes` (không đọc hết file quá lớn)."""
+    total_bytes = 0
+    while True:
+        chunk = source.read(_COPY_CHUNK_SIZE)
+        if not chunk:
+            return total_bytes
+        total_bytes += len(chunk)
+        if total_bytes > max_bytes:
+            raise SpeakerReferenceError(f"File giọng mẫu quá lớn. Tối đa {max_bytes // (1024 * 1024)} MB.", status_code=413)
+        destination.write(chunk)
+
+
+class SpeakerReferenceProcessor:
+    """
+    Chuẩn hóa giọng mẫu trước khi đưa vào hàng đợi: chỉ giải mã phần đầu đủ cho cửa sổ conditioning của model,
+    trộn về mono, resample về SPEAKER_REFERENCE_SAMPLE_RATE, cắt còn SPEAKER_REFERENCE_MAX_SECONDS và lưu WAV PCM16.
+    Worker nhờ đó luôn nhận một file nhỏ, tính conditioning latents với chi phí ổn định.
+    """
+
+    def __init__(self,
+                 max_source_seconds: float = SPEAKER_UPLOAD_MAX_SECONDS,
+                 reference_sample_rate: int = SPEAKER_REFERENCE_SAMPLE_RATE,
+                 reference_max_seconds: float = SPEAKER_REFERENCE_MAX_SECONDS):
+        self.max_source_seconds = max_source_seconds
+        self.reference_sample_rate = reference_sample_rate
+        self.reference_max_seconds = reference_max_seconds
+
+    def prepare(self, source_path: str) -> PreparedSpeakerReference:
+        try:
+            info = torchaudio.info(source_path)
+        except Exception as e_info:
+            raise SpeakerReferenceError(f"Không đọc được file giọng mẫu: {e_info}") from e_info
+
+        source_rate = int(info.sample_rate)
+        if source_rate <= 0:
+            raise SpeakerReferenceError("File giọng mẫu không có tần số lấy mẫu hợp lệ.")
+        source_seconds = info.num_frames / source_rate if info.num_frames > 0 else 0.0
+        if source_seconds > self.max_source_seconds:
+            raise SpeakerReferenceError(
+                f"Giọng mẫu quá dài ({source_seconds:.0f}s). Tối đa {self.max_source_seconds:.0f}s.", status_code=413
+            )
+
+        try:
+            waveform, decoded_rate = torchaudio.load(source_path, num_frames=int(self.reference_max_seconds * source_rate))
+        except Exception as e_load:
+            raise SpeakerReferenceError(f"Không giải mã được file giọng mẫu: {e_load}") from e_load
+        if waveform.numel() == 0:
+            raise SpeakerReferenceError("File giọng mẫu không chứa âm thanh.")
+
+        mono_waveform = waveform.to(torch.float32).mean(dim=0)
+        mono_waveform = resample(mono_waveform, int(decoded_rate), self.reference_sample_rate)
+        mono_waveform = mono_waveform[: int(self.reference_max_seconds * self.reference_sample_rate)]
+
+        audio_data = io.BytesIO()
+        torchaudio.save(audio_data, mono_waveform.clamp(-1.0, 1.0).unsqueeze(0), self.reference_sample_rate,
+                        format="wav", encoding="PCM_S", bits_per_sample=16)
+        audio_data.seek(0)
+        reference_seconds = mono_waveform.numel() / self.reference_sample_rate
+        logger.info(f"SpeakerReferenceProcessor: Giọng mẫu {source_seconds:.1f}s @ {source_rate} Hz, {info.num_channels} kênh "
+                    f"-> {reference_seconds:.1f}s mono @ {self.reference_sample_rate} Hz ({audio_data.getbuffer().nbytes} bytes).")
+        return PreparedSpeakerReference(
+            audio_data=audio_data,
+            source_seconds=source_seconds,
+            reference_seconds=reference_seconds,
+            sample_rate=self.reference_sample_rate
+        )
@@ -3,106 +3,227 @@ import torchaudio
 import io
 import logging
 import os
-from app.domain.tts_model import TTSModel
+from typing import Callable
+from app.domain.tts_model import TTSModel, UnknownSpeakerError
+from app.domain.model_registry import ModelRegistry, UnknownModelError
 from app.domain.services.text_processor import TextProcessor
 from app.domain.services.audio_postprocessor import AudioPostprocessorService
 from app.domain.value_objects import AudioOutput
+from app.tracing import tracer
+from app.logging_setup import get_hot_path_logger
 from app.config import MIN_CHAR_PER_SENTENCE_INPUT, XTTS_SAMPLE_RATE 
 
 logger = logging.getLogger(__name__)
+# Log lặp lại theo từng câu: được lấy mẫu theo LOG_HOT_PATH_SAMPLE_RATE / LOG_HOT_PATH_MAX_PER_SECOND
+hot_path_logger = get_hot_path_logger(__name__)
+
+
+class SynthesisCancelledError(Exception):
+    """Task bị hủy (cờ hủy được đặt) giữa hai câu; không được nuốt thành thông báo lỗi mà ném tiếp cho task."""
+
+    def __init__(self, sentences_done: int, sentences_total: int):
+        super().__init__(f"Tổng hợp bị hủy sau {sentences_done}/{sentences_total} câu.")
+        self.sentences_done = sentences_done
+        self.sentences_total = sentences_total
 
 class SpeechSynthesisService:
     def __init__(self, 
                  tts_model: TTSModel, 
                  text_processor: TextProcessor, 
-                 audio_postprocessor: AudioPostprocessorService):
+                 audio_postprocessor: AudioPostprocessorService,
+                 model_registry: ModelRegistry | None = None,
+                 fatal_exceptions: tuple[type[BaseException], ...] = ()):
         self.tts_model = tts_model
         self.text_processor = text_processor
         self.audio_postprocessor = audio_postprocessor
+        self.model_registry = model_registry
+        # Các exception không được nuốt thành thông báo lỗi (ví dụ SoftTimeLimitExceeded của Celery) mà phải ném tiếp cho task
+        self.fatal_exceptions = fatal_exceptions
 
     def synthesize(self,
                    full_text_input: str,
                    language_code: str,
-                   speaker_audio_path: str,
+                   speaker_audio_path: str | None,
                    apply_text_normalization: bool,
                    synthesis_model_params: dict, 
-                   audio_postproc_params: dict  
+                   audio_postproc_params: dict,
+                   model_id: str | None = None,
+                   checkpoint=None,
+                   progress_callback: Callable[[dict], None] | None = None,
+                   speaker_name: str | None = None,
+                   cancel_check: Callable[[], bool] | None = None
                    ) -> tuple[AudioOutput | None, str | None]:
+        """
+        Tổng hợp bằng model mặc định, hoặc bằng checkpoint `model_id` lấy từ model registry.
+        `speaker_name` (tùy chọn) dùng latents của giọng có sẵn trong speakers_xtts.pth thay cho `speaker_audio_path`.
+        `cancel_check` (tùy chọn) được gọi trước mỗi câu; trả về True thì dừng và ném SynthesisCancelledError.
+        `checkpoint` (tùy chọn, ví dụ SynthesisCheckpointStore) cho phép lưu âm thanh từng câu đã xong và dùng lại khi chạy lại.
+        `progress_callback` (tùy chọn) được gọi sau mỗi câu với dict tiến độ (xem `_report_progress`).
+        """
+        if not model_id or self.model_registry is None:
+            return self._synthesize_with_model(self.tts_model, full_text_input, language_code, speaker_audio_path,
+                                               apply_text_normalization, synthesis_model_params, audio_postproc_params,
+                                               checkpoint, progress_callback, speaker_name, cancel_check)
+        try:
+            with tracer.span("synthesis.acquire_model", model_id=model_id), self.model_registry.use(model_id) as tts_model:
+                return self._synthesize_with_model(tts_model, full_text_input, language_code, speaker_audio_path,
+                                                   apply_text_normalization, synthesis_model_params, audio_postproc_params,
+                                                   checkpoint, progress_callback, speaker_name, cancel_check)
+        except (UnknownModelError, RuntimeError) as e_model:
+            logger.error(f"SpeechSynthesisService: Không lấy được model '{model_id}': {e_model}")
+            return None, str(e_model)
 
-        if not self.tts_model.is_loaded():
+    @staticmethod
+    def _noise_profile_key(speaker_audio_path: str) -> str:
+        """Hồ sơ nhiễu được cache theo giọng mẫu (đường dẫn + thời điểm sửa đổi)."""
+        try:
+            return f"{os.path.abspath(speaker_audio_path)}:{os.path.getmtime(speaker_audio_path)}"
+        except OSError:
+            return os.path.abspath(speaker_audio_path)
+
+    def _report_progress(self,
+                         progress_callback: Callable[[dict], None] | None,
+                         progress: dict,
+                         sentence_index: int,
+                         sentence_text: str,
+                         sentence_audio: torch.Tensor,
+                         synthesized: bool) -> None:
+        """
+        Cập nhật và gửi tiến độ: số câu đã xử lý (mọi câu có chỉ số < sentences_done đã xong hoặc bị bỏ qua),
+        số ký tự đã xong, số ký tự thực sự được tổng hợp trong lần chạy này và số giây âm thanh đã tạo.
+        """
+        progress["sentences_done"] = sentence_index + 1
+        progress["chars_done"] += len(sentence_text)
+        if synthesized:
+            progress["synthesized_chars"] += len(sentence_text)
+        progress["audio_seconds"] = round(progress["audio_seconds"] + sentence_audio.numel() / XTTS_SAMPLE_RATE, 3)
+        if progress_callback is None:
+            return
+        try:
+            progress_callback(dict(progress))
+        except Exception as e_progress:
+            logger.warning(f"SpeechSynthesisService: Lỗi khi gửi tiến độ: {e_progress}")
+
+    def _synthesize_with_model(self,
+                               tts_model: TTSModel,
+                               full_text_input: str,
+                               language_code: str,
+                               speaker_audio_path: str | None,
+                               apply_text_normalization: bool,
+                               synthesis_model_params: dict,
+                               audio_postproc_params: dict,
+                               checkpoint=None,
+                               progress_callback: Callable[[dict], None] | None = None,
+                               speaker_name: str | None = None,
+                               cancel_check: Callable[[], bool] | None = None
+                               ) -> tuple[AudioOutput | None, str | None]:
+
+        if not tts_model.is_loaded():
             logger.error("SpeechSynthesisService: Model chưa được tải!")
             return None, "Lỗi hệ thống: Model giọng nói chưa sẵn sàng."
         
-        if not os.path.exists(speaker_audio_path):
+        if not speaker_name and not os.path.exists(speaker_audio_path):
             logger.error(f"SpeechSynthesisService: File âm thanh mẫu không tồn tại: {speaker_audio_path}")
             return None, f"Lỗi: File âm thanh mẫu '{os.path.basename(speaker_audio_path)}' không tồn tại."
 
-        logger.info(f"SpeechSynthesisService: Bắt đầu TTS. Lang='{language_code}', Speaker='{os.path.basename(speaker_audio_path)}'")
-        logger.debug(f"Model Params: {synthesis_model_params}")
-        logger.debug(f"Postproc Params: {audio_postproc_params}")
+        logger.info("SpeechSynthesisService: Bắt đầu TTS. Lang='%s', Speaker='%s'", language_code,
+                    f"preset:{speaker_name}" if speaker_name else os.path.basename(speaker_audio_path))
+        logger.debug("Model Params: %s", synthesis_model_params)
+        logger.debug("Postproc Params: %s", audio_postproc_params)
         
         processed_text = full_text_input
         if apply_text_normalization and language_code == "vi":
             logger.info("Áp dụng chuẩn hóa văn bản tiếng Việt...")
-            processed_text = self.text_processor.normalize_vietnamese_text(full_text_input)
-            logger.debug(f"Văn bản sau chuẩn hóa (100 chars): '{processed_text[:100]}...'")
+            with tracer.span("synthesis.normalize_text", chars=len(full_text_input)):
+                processed_text = self.text_processor.normalize_vietnamese_text(full_text_input)
+            logger.debug("Văn bản sau chuẩn hóa (100 chars): '%.100s...'", processed_text)
         else:
-            logger.debug(f"Văn bản gốc (100 chars): '{processed_text[:100]}...'")
+            logger.debug("Văn bản gốc (100 chars): '%.100s...'", processed_text)
 
         try:
-            gpt_cond_latent, speaker_embedding = self.tts_model.get_conditioning_latents(speaker_audio_path)
+            if speaker_name:
+                gpt_cond_latent, speaker_embedding = tts_model.get_speaker_preset_latents(speaker_name)
+            else:
+                gpt_cond_latent, speaker_embedding = tts_model.get_conditioning_latents(speaker_audio_path)
             
-            sentences = self.text_processor.tokenize_sentences(processed_text, language_code)
-            logger.info(f"Văn bản được tách thành {len(sentences)} câu.")
+            with tracer.span("synthesis.tokenize_sentences") as tokenize_span:
+                sentences = self.text_processor.tokenize_sentences(processed_text, language_code)
+                tokenize_span.set_attribute("sentence_count", len(sentences))
+            logger.info("Văn bản được tách thành %d câu.", len(sentences))
 
             if not sentences:
                 logger.warning("Không có câu nào được tách từ văn bản đầu vào.")
                 return None, "Văn bản đầu vào không chứa nội dung có thể xử lý."
 
             wav_generated_chunks = []
+            progress = {
+                "sentences_done": 0,
+                "sentences_total": len(sentences),
+                "chars_done": 0,
+                "chars_total": sum(len(sentence.strip()) for sentence in sentences),
+                "synthesized_chars": 0,
+                "audio_seconds": 0.0,
+            }
             for i, single_sentence_text in enumerate(sentences):
+                if cancel_check is not None and cancel_check():
+                    raise SynthesisCancelledError(i, len(sentences))
                 current_sentence_for_tts = single_sentence_text.strip()
                 
                 if not current_sentence_for_tts:
-                    logger.debug(f"Câu {i+1} rỗng, bỏ qua.")
+                    hot_path_logger.debug("Câu %d rỗng, bỏ qua.", i + 1)
                     continue
                 
                 if len(current_sentence_for_tts) < MIN_CHAR_PER_SENTENCE_INPUT:
                     logger.warning(f"Câu {i+1} ('{current_sentence_for_tts[:50]}...') quá ngắn ({len(current_sentence_for_tts)} ký tự so với min {MIN_CHAR_PER_SENTENCE_INPUT}). Bỏ qua.")
                     continue
                 
-                logger.info(f"Đang tổng hợp giọng nói cho câu {i+1}/{len(sentences)}: '{current_sentence_for_tts[:50]}...'")
+                if checkpoint is not None:
+                    with tracer.span("synthesis.checkpoint_load", sentence_index=i):
+                        checkpointed_audio = checkpoint.load_segment(i, current_sentence_for_tts)
+                    if checkpointed_audio is not None:
+                        hot_path_logger.info("Câu %d/%d đã có trong checkpoint, bỏ qua tổng hợp.", i + 1, len(sentences))
+                        wav_generated_chunks.append(checkpointed_audio)
+                        self._report_progress(progress_callback, progress, i, current_sentence_for_tts, checkpointed_audio, synthesized=False)
+                        continue
+
+                hot_path_logger.info("Đang tổng hợp giọng nói cho câu %d/%d: '%.50s...'", i + 1, len(sentences), current_sentence_for_tts)
                 
                 try:
-                    wav_output_dict = self.tts_model.inference(
+                    wav_output_dict = tts_model.inference(
                         text=current_sentence_for_tts,
                         language=language_code,
                         gpt_cond_latent=gpt_cond_latent,
                         speaker_embedding=speaker_embedding,
                         model_params=synthesis_model_params 
                     )
-                    
+                
                     audio_data_from_model = wav_output_dict["wav"] 
-                    
+                
                     if isinstance(audio_data_from_model, torch.Tensor):
                         audio_tensor_for_sentence = audio_data_from_model
                     else: 
                         audio_tensor_for_sentence = torch.tensor(audio_data_from_model, dtype=torch.float32)
-                    
+                
                     keep_length = self.text_processor.calculate_keep_length(current_sentence_for_tts, language_code)
                     if keep_length > 0 and audio_tensor_for_sentence.numel() > keep_length :
-                        logger.debug(f"Áp dụng cắt ngắn cho audio của câu '{current_sentence_for_tts[:30]}...': giữ lại {keep_length} samples.")
+                        hot_path_logger.debug("Áp dụng cắt ngắn cho audio của câu '%.30s...': giữ lại %d samples.", current_sentence_for_tts, keep_length)
                         audio_tensor_for_sentence = audio_tensor_for_sentence[:keep_length]
 
                     if audio_tensor_for_sentence.numel() > 0 :
                         wav_generated_chunks.append(audio_tensor_for_sentence)
+                        if checkpoint is not None:
+                            with tracer.span("synthesis.checkpoint_save", sentence_index=i):
+                                checkpoint.save_segment(i, current_sentence_for_tts, audio_tensor_for_sentence)
+                        self._report_progress(progress_callback, progress, i, current_sentence_for_tts, audio_tensor_for_sentence, synthesized=True)
                     else:
                         logger.warning(f"Câu {i+1} không tạo ra dữ liệu âm thanh hoặc audio rỗng sau khi cắt ngắn.")
 
+                except self.fatal_exceptions:
+                    raise
                 except Exception as e_inference_loop:
                     logger.error(f"Lỗi khi inference câu '{current_sentence_for_tts[:50]}...': {e_inference_loop}", exc_info=False)
                 finally:
-                    self.tts_model.clear_gpu_cache()
+                    tts_model.clear_gpu_cache()
 
 
             if not wav_generated_chunks:
@@ -110,14 +231,17 @@ class SpeechSynthesisService:
                 return None, "Không tạo được âm thanh từ văn bản (có thể tất cả các câu đều bị lỗi, quá ngắn, hoặc văn bản không hợp lệ)."
 
             final_output_wave = torch.cat([chunk.view(-1) for chunk in wav_generated_chunks if chunk.numel() > 0], dim=0)
-            logger.info(f"Ghép {len(wav_generated_chunks)} chunk âm thanh thành công. Tổng độ dài: {final_output_wave.shape[0]} samples.")
+            logger.info("Ghép %d chunk âm thanh thành công. Tổng độ dài: %d samples.", len(wav_generated_chunks), final_output_wave.shape[0])
             
             if final_output_wave.numel() == 0:
                 logger.error("Âm thanh cuối cùng rỗng sau khi ghép các chunks.")
                 return None, "Không tạo được nội dung âm thanh cuối cùng."
 
             logger.info("Bắt đầu xử lý hậu kỳ âm thanh...")
-            processed_wave = self.audio_postprocessor.process_audio(final_output_wave, audio_postproc_params)
+            processed_wave = self.audio_postprocessor.process_audio(
+                final_output_wave, audio_postproc_params,
+                noise_profile_key=f"speaker_preset:{speaker_name}" if speaker_name else self._noise_profile_key(speaker_audio_path)
+            )
             
             if processed_wave is None or processed_wave.numel() == 0:
                 logger.error("Âm thanh bị rỗng sau quá trình xử lý hậu kỳ.")
@@ -126,13 +250,29 @@ class SpeechSynthesisService:
             audio_bytes_io = io.BytesIO()
             wave_to_save = processed_wave.unsqueeze(0) if processed_wave.ndim == 1 else processed_wave
             
-            torchaudio.save(audio_bytes_io, wave_to_save.cpu(), self.audio_postprocessor.sample_rate, format="wav")
+            output_sample_rate = self.audio_postprocessor.output_sample_rate(audio_postproc_params)
+            with tracer.span("synthesis.encode_wav", sample_rate=output_sample_rate):
+                torchaudio.save(audio_bytes_io, wave_to_save.cpu(), output_sample_rate, format="wav")
             audio_bytes_io.seek(0)
-            logger.info(f"Đã tạo dữ liệu WAV (sau hậu kỳ) trong bộ nhớ, kích thước: {audio_bytes_io.getbuffer().nbytes} bytes.")
+            logger.info("Đã tạo dữ liệu WAV (sau hậu kỳ) trong bộ nhớ, kích thước: %d bytes.", audio_bytes_io.getbuffer().nbytes)
             
             output_filename = self.text_processor.generate_safe_filename(full_text_input)
-            return AudioOutput(audio_data=audio_bytes_io, filename=output_filename), None
+            return AudioOutput(
+                audio_data=audio_bytes_io,
+                filename=output_filename,
+                duration_seconds=wave_to_save.shape[-1] / output_sample_rate,
+                sentence_count=len(sentences)
+            ), None
 
+        except SynthesisCancelledError as e_cancelled:
+            logger.info(f"SpeechSynthesisService: {e_cancelled}")
+            tts_model.clear_gpu_cache()
+            raise
+        except self.fatal_exceptions:
+            raise
+        except UnknownSpeakerError as e_speaker:
+            logger.error(f"SpeechSynthesisService: {e_speaker}")
+            return None, str(e_speaker)
         except FileNotFoundError as e_fnf: 
             logger.error(f"Lỗi FileNotFoundError trong SpeechSynthesisService: {e_fnf}")
             return None, str(e_fnf)
@@ -141,5 +281,5 @@ class SpeechSynthesisService:
             return None, str(e_rt)
         except Exception as e_main_tts:
             logger.error(f"Lỗi chung không xác định trong SpeechSynthesisService: {e_main_tts}", exc_info=True)
-            self.tts_model.clear_gpu_cache()
+            tts_model.clear_gpu_cache()
             return None, f"Lỗi hệ thống không mong muốn trong quá trình tổng hợp giọng nói."
\ No newline at end of file
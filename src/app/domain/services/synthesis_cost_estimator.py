@@ -0,0 +1,106 @@
+import re
+import logging
+import threading
+from dataclasses import dataclass
+
+from app.config import (
+    CHARS_PER_AUDIO_SECOND, DEFAULT_CHARS_PER_AUDIO_SECOND,
+    COST_MODEL_DEFAULT_RTF, COST_MODEL_FIXED_OVERHEAD_SECONDS,
+    COST_MODEL_PER_SENTENCE_OVERHEAD_SECONDS, COST_MODEL_EMA_ALPHA,
+)
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_END_RE = re.compile(r"[.!?…。！？]+(?:\s|$)")
+
+
+@dataclass(frozen=True)
+class SynthesisCostEstimate:
+    text_chars: int
+    sentence_count: int
+    audio_seconds: float
+    worker_seconds: float
+
+
+class SynthesisCostEstimator:
+    """
+    Mô hình chi phí tổng hợp giọng nói:
+        audio_seconds  = số ký tự / (ký tự mỗi giây audio của ngôn ngữ) / speed
+        worker_seconds = overhead cố định + số câu * overhead mỗi câu + audio_seconds * RTF
+    Các hệ số được hiệu chỉnh dần (EMA) từ thời gian thực tế của các task đã hoàn thành.
+    """
+
+    def __init__(self,
+                 chars_per_audio_second: dict[str, float] = CHARS_PER_AUDIO_SECOND,
+                 default_chars_per_audio_second: float = DEFAULT_CHARS_PER_AUDIO_SECOND,
+                 real_time_factor: float = COST_MODEL_DEFAULT_RTF,
+                 fixed_overhead_seconds: float = COST_MODEL_FIXED_OVERHEAD_SECONDS,
+                 per_sentence_overhead_seconds: float = COST_MODEL_PER_SENTENCE_OVERHEAD_SECONDS,
+                 ema_alpha: float = COST_MODEL_EMA_ALPHA):
+        self._chars_per_audio_second = dict(chars_per_audio_second)
+        self.default_chars_per_audio_second = default_chars_per_audio_second
+        self.real_time_factor = real_time_factor
+        self.fixed_overhead_seconds = fixed_overhead_seconds
+        self.per_sentence_overhead_seconds = per_sentence_overhead_seconds
+        self.ema_alpha = ema_alpha
+        self.mean_task_worker_seconds: float | None = None
+        self.observations = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def count_sentences(text: str) -> int:
+        return max(1, len(_SENTENCE_END_RE.findall(text.strip())))
+
+    def chars_per_audio_second(self, language: str) -> float:
+        return self._chars_per_audio_second.get(language, self.default_chars_per_audio_second)
+
+    def estimate_audio_seconds(self, text_chars: int, language: str, speed: float = 1.0) -> float:
+        return text_chars / self.chars_per_audio_second(language) / max(speed, 0.1)
+
+    def estimate(self, text: str, language: str, speed: float = 1.0, sentence_count: int | None = None) -> SynthesisCostEstimate:
+        text_chars = len(text)
+        if sentence_count is None:
+            sentence_count = self.count_sentences(text)
+        audio_seconds = self.estimate_audio_seconds(text_chars, language, speed)
+        worker_seconds = (
+            self.fixed_overhead_seconds
+            + sentence_count * self.per_sentence_overhead_seconds
+            + audio_seconds * self.real_time_factor
+        )
+        return SynthesisCostEstimate(
+            text_chars=text_chars,
+            sentence_count=sentence_count,
+            audio_seconds=round(audio_seconds, 3),
+            worker_seconds=round(worker_seconds, 3)
+        )
+
+    def _ema(self, current: float, observed: float) -> float:
+        return (1.0 - self.ema_alpha) * current + self.ema_alpha * observed
+
+    def observe(self, language: str, text_chars: int, sentence_count: int, audio_seconds: float, worker_seconds: float) -> None:
+        """Hiệu chỉnh mô hình từ số liệu thực tế của một task đã hoàn thành."""
+        if text_chars <= 0 or audio_seconds <= 0 or worker_seconds <= 0:
+            return
+        with self._lock:
+            observed_cps = text_chars / audio_seconds
+            self._chars_per_audio_second[language] = self._ema(self.chars_per_audio_second(language), observed_cps)
+
+            overhead = self.fixed_overhead_seconds + sentence_count * self.per_sentence_overhead_seconds
+            observed_rtf = max(0.01, (worker_seconds - overhead) / audio_seconds)
+            self.real_time_factor = self._ema(self.real_time_factor, observed_rtf)
+
+            if self.mean_task_worker_seconds is None:
+                self.mean_task_worker_seconds = worker_seconds
+            else:
+                self.mean_task_worker_seconds = self._ema(self.mean_task_worker_seconds, worker_seconds)
+            self.observations += 1
+        logger.debug(f"Cost model: lang='{language}' cps={observed_cps:.2f} rtf={observed_rtf:.3f} (sau {self.observations} quan sát)")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "chars_per_audio_second": dict(self._chars_per_audio_second),
+                "real_time_factor": round(self.real_time_factor, 4),
+                "mean_task_worker_seconds": self.mean_task_worker_seconds,
+                "observations": self.observations,
+            }
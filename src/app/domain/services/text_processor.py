@@ -3,15 +3,29 @@ import string
 import re
 import unicodedata
 from unidecode import unidecode 
-from underthesea import sent_tokenize 
 from datetime import datetime
 import logging
-from app.config import MAX_FILENAME_PREFIX_CHAR 
+from app.config import MAX_FILENAME_PREFIX_CHAR, VI_SENTENCE_SPLITTER
+from app.domain.services.vietnamese_sentence_splitter import VietnameseSentenceSplitter
 
 DIR = os.path.dirname(os.path.realpath(__file__))
 logger = logging.getLogger(__name__)
 
 class TextProcessor:
+    def __init__(self, vi_sentence_splitter: str = VI_SENTENCE_SPLITTER):
+        if vi_sentence_splitter not in ("underthesea", "rule_based"):
+            logger.warning(f"VI_SENTENCE_SPLITTER không hợp lệ: '{vi_sentence_splitter}'. Sử dụng 'underthesea'.")
+            vi_sentence_splitter = "underthesea"
+        self.vi_sentence_splitter = vi_sentence_splitter
+        self._rule_based_vi_splitter = VietnameseSentenceSplitter()
+        self._underthesea_sent_tokenize = None
+
+    def _get_underthesea_sent_tokenize(self):
+        if self._underthesea_sent_tokenize is None:
+            from underthesea import sent_tokenize
+            self._underthesea_sent_tokenize = sent_tokenize
+        return self._underthesea_sent_tokenize
+
     def normalize_vietnamese_text(self, text: str) -> str:
         try:
             processed_text = (
@@ -57,7 +71,9 @@ class TextProcessor:
             logger.debug(f"Sử dụng split('。') cho ngôn ngữ {lang_code}")
             return text.split("。") 
         elif lang_code == "vi":
-            return sent_tokenize(text)
+            if self.vi_sentence_splitter == "rule_based":
+                return self._rule_based_vi_splitter.split(text)
+            return self._get_underthesea_sent_tokenize()(text)
         else: 
             logger.debug(f"Sử dụng split cơ bản cho ngôn ngữ {lang_code}")
             text_with_delimiters = text.replace("!", "!<SPLIT>").replace("?", "?<SPLIT>").replace(".", ".<SPLIT>")
@@ -0,0 +1,201 @@
+import re
+import logging
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+# Các từ viết tắt (viết thường, không có dấu chấm cuối) không được coi là kết thúc câu.
+VIETNAMESE_ABBREVIATIONS = frozenset({
+    "tp", "tt", "tx", "ts", "ths", "ncs", "pgs", "gs", "bs", "bsck", "ks", "ls", "th",
+    "ubnd", "hđnd", "tw", "st", "sđt", "đt", "mr", "mrs", "ms", "dr",
+    "prof", "jr", "sr", "vs", "tp.hcm", "tp.hn", "pt",
+})
+# Viết tắt trùng với từ thường hoặc đơn vị ("ăn no.", "50.000 đ.", "8 h."): chỉ là viết tắt khi token sau
+# bắt đầu bằng chữ thường hoặc chữ số ("Q. 1", "tr. 15", "No. 5").
+AMBIGUOUS_VIETNAMESE_ABBREVIATIONS = frozenset({
+    "no", "đ", "h", "x", "p", "q", "tr", "ng", "ct", "tk", "cn",
+})
+
+_TERMINATORS = ".!?…"
+_CLOSING_CHARS = "\"'”’»)]}"
+_OPENING_CHARS = "\"'“‘«([{-–—"
+
+_CANDIDATE_RE = re.compile(
+    rf"(?P<punct>[{re.escape(_TERMINATORS)}]+)(?P<close>[{re.escape(_CLOSING_CHARS)}]*)(?P<space>\s+)"
+    r"|(?P<newline>[^\S\n]*\n\s*)"
+)
+_LAST_TOKEN_RE = re.compile(r"(\S+)$")
+_LAST_TOKEN_BEFORE_SPACE_RE = re.compile(r"(\S+)\s*$")
+_INITIAL_RE = re.compile(r"([^\W\d_])\.(?=\s|$)")
+_MAX_TOKEN_LOOKBACK = 24
+
+
+class VietnameseSentenceSplitter:
+    """
+    Bộ tách câu tiếng Việt dựa trên luật, dùng regex biên dịch sẵn.
+    Thay thế nhanh cho underthesea.sent_tokenize: mỗi ký tự chỉ được quét một lần
+    và các câu được trả về dần qua generator.
+    """
+
+    def __init__(self, abbreviations: frozenset[str] = VIETNAMESE_ABBREVIATIONS,
+                 ambiguous_abbreviations: frozenset[str] = AMBIGUOUS_VIETNAMESE_ABBREVIATIONS):
+        self.abbreviations = abbreviations
+        self.ambiguous_abbreviations = ambiguous_abbreviations
+
+    @staticmethod
+    def _next_token_continues(text: str, next_pos: int) -> bool:
+        """Token sau bắt đầu bằng chữ thường hoặc chữ số: câu chưa kết thúc."""
+        while next_pos < len(text) and text[next_pos] in _OPENING_CHARS:
+            next_pos += 1
+        return next_pos < len(text) and (text[next_pos].islower() or text[next_pos].isdigit())
+
+    @staticmethod
+    def _is_name_initial(text: str, token_start: int, next_pos: int, sentence_start: int) -> bool:
+        """
+        Một chữ in hoa + "." chỉ là chữ viết tắt tên khi đứng cạnh một chữ viết tắt khác ("N. V. A.") hoặc đứng sau
+        một từ viết hoa / ở đầu câu ("Nguyễn V. Nam", "John F. Kennedy"). Sau từ viết thường ("vitamin C.",
+        "loại A.") là hết câu. Đánh đổi: "Vitamin C. Nó..." ở đầu câu vẫn không được tách.
+        """
+        next_initial = _INITIAL_RE.match(text, next_pos)
+        if next_initial and next_initial.group(1).isupper():
+            return True
+        previous_match = _LAST_TOKEN_BEFORE_SPACE_RE.search(text, max(sentence_start, token_start - _MAX_TOKEN_LOOKBACK), token_start)
+        if not previous_match or previous_match.end() != token_start:
+            return True  # đầu câu
+        previous_token = previous_match.group(1).lstrip(_OPENING_CHARS)
+        return bool(previous_token) and previous_token[0].isupper()
+
+    def _is_abbreviation(self, text: str, punct_start: int, sentence_start: int, next_pos: int) -> bool:
+        window_start = max(sentence_start, punct_start - _MAX_TOKEN_LOOKBACK)
+        token_match = _LAST_TOKEN_RE.search(text, window_start, punct_start)
+        if not token_match:
+            return False
+        original_token = token_match.group(1).lstrip(_OPENING_CHARS)
+        token = original_token.lower()
+        if not token:
+            return False
+        if token in self.abbreviations:
+            return True
+        if token in self.ambiguous_abbreviations and self._next_token_continues(text, next_pos):
+            return True
+        if len(token) == 1 and token.isalpha():
+            return original_token.isupper() and self._is_name_initial(text, token_match.start(1), next_pos, sentence_start)
+        return False
+
+    def iter_sentences(self, text: str) -> Iterator[str]:
+        if not text:
+            return
+        text_length = len(text)
+        sentence_start = 0
+
+        for match in _CANDIDATE_RE.finditer(text):
+            if match.group("newline") is not None:
+                sentence = text[sentence_start:match.start()].strip()
+                if sentence:
+                    yield sentence
+                sentence_start = match.end()
+                continue
+
+            punct = match.group("punct")
+            is_hard_break = "\n" in match.group("space")
+            next_pos = match.end()
+
+            if not is_hard_break and next_pos < text_length:
+                next_char = text[next_pos]
+                if not (next_char.isupper() or next_char.isdigit() or next_char in _OPENING_CHARS):
+                    continue  # Sau dấu câu là chữ thường: vẫn cùng một câu (ví dụ "..." giữa câu).
+                if punct == "." and self._is_abbreviation(text, match.start(), sentence_start, next_pos):
+                    continue
+
+            sentence = text[sentence_start:match.end("close")].strip()
+            if sentence:
+                yield sentence
+            sentence_start = next_pos
+
+        tail = text[sentence_start:].strip()
+        if tail:
+            yield tail
+
+    def split(self, text: str) -> list[str]:
+        return list(self.iter_sentences(text))
+
+
+# Các trường hợp biên của luật chữ viết tắt (chữ cái đầu tên, viết tắt trùng từ thường/đơn vị), dùng để kiểm tra nhanh và ghép vào corpus so sánh.
+ABBREVIATION_CASES: tuple[tuple[str, list[str]], ...] = (
+    ("Uống vitamin C. Nó tốt cho sức khỏe.", ["Uống vitamin C.", "Nó tốt cho sức khỏe."]),
+    ("Chọn loại A. Sau đó bấm nút.", ["Chọn loại A.", "Sau đó bấm nút."]),
+    ("Ông N. V. A. đã đến. Bà ấy về.", ["Ông N. V. A. đã đến.", "Bà ấy về."]),
+    ("Ông Nguyễn V. Nam đến nhà. Trời mưa.", ["Ông Nguyễn V. Nam đến nhà.", "Trời mưa."]),
+    ("Tổng thống John F. Kennedy phát biểu. Mọi người vỗ tay.", ["Tổng thống John F. Kennedy phát biểu.", "Mọi người vỗ tay."]),
+    ("Nhà ở P. 5, Q. 3. Giá rẻ.", ["Nhà ở P. 5, Q. 3.", "Giá rẻ."]),
+    ("Xem tr. 15 của sách. Rất hay.", ["Xem tr. 15 của sách.", "Rất hay."]),
+    ("Tôi ăn no. Bạn thì sao?", ["Tôi ăn no.", "Bạn thì sao?"]),
+    ("Giá 50.000 đ. Rất rẻ.", ["Giá 50.000 đ.", "Rất rẻ."]),
+    ("Cửa hàng mở lúc 8 h. Mời bạn ghé.", ["Cửa hàng mở lúc 8 h.", "Mời bạn ghé."]),
+)
+
+
+def check_abbreviation_cases(splitter: VietnameseSentenceSplitter | None = None) -> list[dict]:
+    """Trả về danh sách các trường hợp trong ABBREVIATION_CASES bị tách sai (rỗng nếu tất cả đều đúng)."""
+    splitter = splitter or VietnameseSentenceSplitter()
+    failures = []
+    for text, expected in ABBREVIATION_CASES:
+        actual = splitter.split(text)
+        if actual != expected:
+            failures.append({"text": text, "expected": expected, "actual": actual})
+    return failures
+
+
+def compare_with_underthesea(text: str, repeat: int = 3) -> dict:
+    """
+    So sánh kết quả và thông lượng của bộ tách câu dựa trên luật với underthesea.sent_tokenize.
+    Độ chính xác được tính theo tỉ lệ biên câu (vị trí kết thúc câu) trùng với underthesea.
+    Văn bản được nối thêm các câu trong ABBREVIATION_CASES để luôn đo cả các trường hợp chữ viết tắt một chữ cái.
+    """
+    import time
+    from underthesea import sent_tokenize
+
+    def _boundaries(sentences: list[str]) -> set[int]:
+        positions, offset = set(), 0
+        for sentence in sentences:
+            compact = "".join(sentence.split())
+            offset += len(compact)
+            positions.add(offset)
+        return positions
+
+    text = " ".join([text, *(case for case, _ in ABBREVIATION_CASES)])
+    splitter = VietnameseSentenceSplitter()
+    timings = {}
+    results = {}
+    for name, func in (("rule_based", splitter.split), ("underthesea", sent_tokenize)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            results[name] = func(text)
+        timings[name] = (time.perf_counter() - start) / repeat
+
+    reference, candidate = _boundaries(results["underthesea"]), _boundaries(results["rule_based"])
+    matched = len(reference & candidate)
+    return {
+        "chars": len(text),
+        "sentences": {name: len(sents) for name, sents in results.items()},
+        "precision": matched / len(candidate) if candidate else 0.0,
+        "recall": matched / len(reference) if reference else 0.0,
+        "seconds_per_run": timings,
+        "chars_per_second": {name: len(text) / t if t > 0 else float("inf") for name, t in timings.items()},
+    }
+
+
+if __name__ == "__main__":
+    import sys
+    import json
+
+    failures = check_abbreviation_cases()
+    if failures:
+        print(json.dumps(failures, ensure_ascii=False, indent=2))
+        sys.exit(1)
+    if len(sys.argv) < 2:
+        print(f"{len(ABBREVIATION_CASES)} trường hợp chữ viết tắt đều đúng. "
+              "So sánh với underthesea: python -m app.domain.services.vietnamese_sentence_splitter <file_van_ban.txt>")
+        sys.exit(0)
+    with open(sys.argv[1], encoding="utf-8") as f_in:
+        print(json.dumps(compare_with_underthesea(f_in.read()), ensure_ascii=False, indent=2))
@@ -1,35 +1,73 @@
 import os
+import math
 import torch
 import logging
+import threading
+from contextlib import contextmanager, nullcontext
 from TTS.tts.configs.xtts_config import XttsConfig 
 from TTS.tts.models.xtts import Xtts 
-from app.config import MODEL_PATH, CONFIG_PATH, VOCAB_PATH, DEFAULT_SPEAKER_WAV_PATH
+from app.tracing import tracer
+from app.domain.gpt_prefix_cache import GptPrefixCache
+from app.domain.generation_guard import GenerationGuard
+from app.domain.onnx_decoder import OnnxHifiganDecoder, onnx_decoder_path
+from app.config import (
+    MODEL_PATH, CONFIG_PATH, VOCAB_PATH, SPEAKERS_XTTS_PATH, DEFAULT_SPEAKER_WAV_PATH, TTS_INFERENCE_PRECISION,
+    PRECISION_CHECK_MIN_SIMILARITY,
+    GPT_PREFIX_CACHE_ENABLED, GENERATION_GUARD_ENABLED, ONNX_DECODER_ENABLED,
+)
 
 logger = logging.getLogger(__name__)
 
+SUPPORTED_PRECISIONS = ("fp32", "bf16", "fp16")
+
+
+class UnknownSpeakerError(ValueError):
+    pass
+
+
 class TTSModel:
-    _instance = None
-    _initialized_flag = False 
+    """Model XTTS đã tải. Mỗi checkpoint (model_path) chỉ có một instance trong process."""
+    _instances: dict[str, "TTSModel"] = {}
 
-    def __new__(cls, *args, **kwargs):
-        if not cls._instance:
-            cls._instance = super(TTSModel, cls).__new__(cls)
-        return cls._instance
+    def __new__(cls, model_path=MODEL_PATH, *args, **kwargs):
+        instance_key = os.path.abspath(model_path)
+        if instance_key not in cls._instances:
+            instance = super(TTSModel, cls).__new__(cls)
+            instance._initialized = False
+            cls._instances[instance_key] = instance
+        return cls._instances[instance_key]
 
-    def __init__(self, model_path=MODEL_PATH, config_path=CONFIG_PATH, vocab_path=VOCAB_PATH):
-        if TTSModel._initialized_flag:
+    def __init__(self, model_path=MODEL_PATH, config_path=CONFIG_PATH, vocab_path=VOCAB_PATH, speakers_path=SPEAKERS_XTTS_PATH):
+        if self._initialized:
             return
         
         self.model: Xtts = None
         self.model_path = model_path
         self.config_path = config_path
         self.vocab_path = vocab_path
+        self.speakers_path = speakers_path
+        self._speaker_latents_cache: dict[str, tuple[float, tuple]] = {}
+        self._speaker_presets: dict[str, tuple[torch.Tensor, torch.Tensor]] = {}
+        self.device_type = "cpu"
+        self.precision = "fp32"
+        self._autocast_dtype: torch.dtype | None = None
+        self._decoder_pinned_fp32 = False
+        self.gpt_prefix_cache = GptPrefixCache()
+        self.generation_guard = GenerationGuard()
+        self.onnx_decoder: OnnxHifiganDecoder | None = None
         
         if not os.path.exists(DEFAULT_SPEAKER_WAV_PATH):
              logger.warning(f"File âm thanh mẫu mặc định không tồn tại: {DEFAULT_SPEAKER_WAV_PATH}")
 
         self._load_model()
-        TTSModel._initialized_flag = True
+        if self.is_loaded():
+            self._load_speaker_presets()
+            self._configure_precision(TTS_INFERENCE_PRECISION)
+            if GPT_PREFIX_CACHE_ENABLED and self.gpt_prefix_cache.install(self.model):
+                logger.info("TTSModel: Bật cache KV cho phần conditioning của GPT (GPT_PREFIX_CACHE_ENABLED).")
+            if ONNX_DECODER_ENABLED:
+                self._enable_onnx_decoder()
+        self._initialized = True
 
 
     def _check_files_exist(self) -> tuple[bool, list[str]]:
@@ -64,6 +102,7 @@ class TTSModel:
             if torch.cuda.is_available():
                 logger.info("Phát hiện GPU, model sẽ được chuyển sang CUDA.")
                 self.model.cuda()
+                self.device_type = "cuda"
             else:
                 logger.info("Không phát hiện GPU, model sẽ sử dụng CPU.")
             logger.info("Model XTTS đã được tải thành công!")
@@ -74,6 +113,90 @@ class TTSModel:
     def is_loaded(self) -> bool:
         return self.model is not None
 
+    def _load_speaker_presets(self):
+        """
+        Nạp các giọng có sẵn từ speakers_xtts.pth ({tên: {"gpt_cond_latent", "speaker_embedding"}}): latents đã được
+        tính sẵn nên request dùng `speaker_name` đi thẳng vào inference, không tốn chi phí conditioning.
+        """
+        if not self.speakers_path or not os.path.exists(self.speakers_path):
+            logger.info(f"TTSModel: Không có file giọng có sẵn ({self.speakers_path}), chỉ dùng giọng mẫu dạng file âm thanh.")
+            return
+        try:
+            raw_presets = torch.load(self.speakers_path, map_location="cpu", weights_only=True)
+            device = next(self.model.parameters()).device
+            self._speaker_presets = {
+                str(name): (entry["gpt_cond_latent"].float().to(device), entry["speaker_embedding"].float().to(device))
+                for name, entry in raw_presets.items()
+            }
+            logger.info(f"TTSModel: Đã nạp {len(self._speaker_presets)} giọng có sẵn từ {self.speakers_path}.")
+        except Exception as e:
+            logger.error(f"TTSModel: Lỗi khi nạp giọng có sẵn từ '{self.speakers_path}': {e}", exc_info=True)
+            self._speaker_presets = {}
+
+    def speaker_names(self) -> list[str]:
+        return sorted(self._speaker_presets)
+
+    def get_speaker_preset_latents(self, speaker_name: str):
+        """(gpt_cond_latent, speaker_embedding) của một giọng có sẵn trong speakers_xtts.pth."""
+        latents = self._speaker_presets.get(speaker_name)
+        if latents is None:
+            raise UnknownSpeakerError(f"Giọng '{speaker_name}' không có trong danh sách giọng có sẵn.")
+        return latents
+
+    def _configure_precision(self, requested_precision: str):
+        """
+        Chọn chế độ độ chính xác khi inference: fp32, bf16 (autocast, CPU hoặc GPU hỗ trợ bf16) hoặc fp16 (autocast, chỉ GPU).
+        Trọng số giữ nguyên fp32; HiFi-GAN decoder luôn chạy fp32 để tránh suy giảm chất lượng âm thanh.
+        """
+        precision = (requested_precision or "fp32").lower()
+        if precision not in SUPPORTED_PRECISIONS:
+            logger.warning(f"TTS_INFERENCE_PRECISION không hợp lệ: '{requested_precision}'. Sử dụng fp32.")
+            precision = "fp32"
+        if precision == "fp16" and self.device_type != "cuda":
+            logger.warning("fp16 chỉ được hỗ trợ trên GPU. Sử dụng fp32 trên CPU.")
+            precision = "fp32"
+        if precision == "bf16" and self.device_type == "cuda" and not torch.cuda.is_bf16_supported():
+            logger.warning("GPU hiện tại không hỗ trợ bf16. Sử dụng fp32.")
+            precision = "fp32"
+
+        self.precision = precision
+        self._autocast_dtype = {"bf16": torch.bfloat16, "fp16": torch.float16}.get(precision)
+        if self._autocast_dtype is not None and not self._decoder_pinned_fp32:
+            self._keep_decoder_in_fp32()
+            self._decoder_pinned_fp32 = True
+        logger.info(f"TTSModel: Chế độ độ chính xác inference: {self.precision} trên {self.device_type}.")
+
+    def _keep_decoder_in_fp32(self):
+        decoder = self.model.hifigan_decoder
+        original_forward = decoder.forward
+        device_type = self.device_type
+
+        def _fp32_forward(*args, **kwargs):
+            with torch.autocast(device_type=device_type, enabled=False):
+                args = [a.float() if torch.is_tensor(a) and a.is_floating_point() else a for a in args]
+                kwargs = {k: (v.float() if torch.is_tensor(v) and v.is_floating_point() else v) for k, v in kwargs.items()}
+                return original_forward(*args, **kwargs)
+
+        decoder.forward = _fp32_forward
+
+    def _enable_onnx_decoder(self):
+        if self.device_type != "cpu":
+            logger.info("TTSModel: ONNX_DECODER_ENABLED chỉ áp dụng cho worker CPU, decoder chạy bằng PyTorch trên GPU.")
+            return
+        onnx_decoder = OnnxHifiganDecoder(onnx_decoder_path(self.model_path))
+        if onnx_decoder.install(self.model, self.model_path):
+            self.onnx_decoder = onnx_decoder
+            logger.info(f"TTSModel: HiFi-GAN decoder chạy bằng ONNX Runtime ({onnx_decoder.onnx_path}).")
+
+    @contextmanager
+    def _inference_context(self):
+        with torch.inference_mode():
+            if self._autocast_dtype is None:
+                yield
+            else:
+                with torch.autocast(device_type=self.device_type, dtype=self._autocast_dtype):
+                    yield
+
     def get_conditioning_latents(self, audio_path: str):
         if not self.is_loaded():
             logger.error("Cố gắng lấy conditioning latents nhưng model chưa được tải.")
@@ -82,35 +205,228 @@ class TTSModel:
             logger.error(f"File âm thanh mẫu không tồn tại để lấy conditioning latents: {audio_path}")
             raise FileNotFoundError(f"File âm thanh mẫu không tồn tại: {audio_path}")
 
+        cache_key = os.path.abspath(audio_path)
+        cached_entry = self._speaker_latents_cache.get(cache_key)
+        if cached_entry is not None and cached_entry[0] == os.path.getmtime(audio_path):
+            logger.debug("Sử dụng conditioning latents đã tính sẵn cho '%s'.", audio_path)
+            return cached_entry[1]
+
         try:
-            return self.model.get_conditioning_latents(
-                audio_path=audio_path,
-                gpt_cond_len=self.model.config.gpt_cond_len,
-                max_ref_length=self.model.config.max_ref_len,
-                sound_norm_refs=self.model.config.sound_norm_refs
-            )
+            with tracer.span("tts_model.conditioning_latents"), self._inference_context():
+                gpt_cond_latent, speaker_embedding = self.model.get_conditioning_latents(
+                    audio_path=audio_path,
+                    gpt_cond_len=self.model.config.gpt_cond_len,
+                    max_ref_length=self.model.config.max_ref_len,
+                    sound_norm_refs=self.model.config.sound_norm_refs
+                )
+            return gpt_cond_latent.float(), speaker_embedding.float()
         except Exception as e:
             logger.error(f"Lỗi khi lấy conditioning latents từ '{audio_path}': {e}", exc_info=True)
             raise
 
-    def inference(self, text: str, language: str, gpt_cond_latent, speaker_embedding, model_params: dict):
+    def precompute_speaker_latents(self, audio_path: str) -> None:
+        """Tính trước và giữ lại conditioning latents của một giọng mẫu dùng thường xuyên (ví dụ giọng mặc định)."""
+        latents = self.get_conditioning_latents(audio_path)
+        self._speaker_latents_cache[os.path.abspath(audio_path)] = (os.path.getmtime(audio_path), latents)
+        logger.info(f"Đã tính trước conditioning latents cho giọng mẫu: {audio_path}")
+
+    def inference(self, text: str, language: str, gpt_cond_latent, speaker_embedding, model_params: dict,
+                  use_prefix_cache: bool = True, use_generation_guard: bool = GENERATION_GUARD_ENABLED):
+        """
+        `use_prefix_cache=False` bỏ qua cache KV của phần conditioning (dùng để so sánh khi kiểm tra/benchmark).
+        `use_generation_guard` giới hạn số audio token theo độ dài văn bản và dừng sớm khi GPT sinh lặp / im lặng.
+        """
         if not self.is_loaded():
             logger.error("Cố gắng thực hiện inference nhưng model chưa được tải.")
             raise RuntimeError("Model chưa được tải.")
         
         try:
-            return self.model.inference(
-                text=text,
-                language=language,
-                gpt_cond_latent=gpt_cond_latent,
-                speaker_embedding=speaker_embedding,
-                **model_params 
-            )
+            prefix_cache_context = self.gpt_prefix_cache.activate(gpt_cond_latent) if use_prefix_cache else nullcontext()
+            generation_criteria = None
+            if use_generation_guard and "stopping_criteria" not in model_params:
+                from transformers import StoppingCriteriaList
+                generation_criteria = self.generation_guard.criteria_for(
+                    text, language, self._generation_chunks(text, language, model_params))
+                model_params = {**model_params, "stopping_criteria": StoppingCriteriaList([generation_criteria])}
+            with tracer.span("tts_model.inference", chars=len(text), language=language) as inference_span, \
+                    self._inference_context(), prefix_cache_context:
+                result = self.model.inference(
+                    text=text,
+                    language=language,
+                    gpt_cond_latent=gpt_cond_latent,
+                    speaker_embedding=speaker_embedding,
+                    **model_params 
+                )
+                if generation_criteria is not None:
+                    inference_span.set_attributes(audio_tokens=generation_criteria.total_generated_tokens,
+                                                  stop_reason=",".join(generation_criteria.stop_reasons) or None)
+                    result = self.generation_guard.finish(generation_criteria, result, language)
+                return result
         except Exception as e:
             logger.error(f"Lỗi trong quá trình inference của model XTTS: {e}", exc_info=True)
             raise
 
+    def _generation_chunks(self, text: str, language: str, model_params: dict) -> list[str] | None:
+        """Các đoạn Xtts.inference generate lần lượt khi enable_text_splitting (cùng cách tách của thư viện TTS)."""
+        if not model_params.get("enable_text_splitting"):
+            return None
+        try:
+            from TTS.tts.layers.xtts.tokenizer import split_sentence
+            base_language = language.split("-")[0]
+            return split_sentence(text, base_language, self.model.tokenizer.char_limits.get(base_language, 250))
+        except (ImportError, AttributeError) as e_split:
+            logger.debug(f"Không tách được đoạn như Xtts.inference ({e_split}), dùng giới hạn token của cả câu.")
+            return None
+
+    def estimated_memory_bytes(self) -> int:
+        """Dung lượng bộ nhớ (RAM hoặc VRAM) mà trọng số và buffer của model đang chiếm."""
+        if not self.is_loaded():
+            return 0
+        return sum(t.numel() * t.element_size() for t in list(self.model.parameters()) + list(self.model.buffers()))
+
+    def unload(self):
+        """Giải phóng model khỏi bộ nhớ và xóa instance khỏi danh sách model của process."""
+        logger.info(f"Giải phóng model XTTS: {self.model_path}")
+        self.model = None
+        self._speaker_latents_cache.clear()
+        self._speaker_presets.clear()
+        self.gpt_prefix_cache.clear()
+        self.onnx_decoder = None
+        TTSModel._instances.pop(os.path.abspath(self.model_path), None)
+        self.clear_gpu_cache()
+
     def clear_gpu_cache(self):
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
-            logger.debug("Đã xóa GPU cache.")
\ No newline at end of file
+            logger.debug("Đã xóa GPU cache.")
+
+
+def _waveform_similarity(reference, candidate) -> dict:
+    """
+    So sánh hai waveform (cắt về độ dài ngắn hơn): cosine và SNR trên mẫu thời gian (nhạy với lệch pha), cosine của
+    log-magnitude STFT (ít nhạy pha, dùng làm ngưỡng) và tỉ lệ độ dài.
+    """
+    reference = torch.as_tensor(reference, dtype=torch.float32).reshape(-1)
+    candidate = torch.as_tensor(candidate, dtype=torch.float32).reshape(-1)
+    length = min(len(reference), len(candidate))
+    ref, cand = reference[:length], candidate[:length]
+    noise_energy = float(((ref - cand) ** 2).sum())
+    window = torch.hann_window(1024)
+    ref_spec = torch.log1p(torch.stft(ref, 1024, 256, window=window, return_complex=True).abs())
+    cand_spec = torch.log1p(torch.stft(cand, 1024, 256, window=window, return_complex=True).abs())
+    return {
+        "waveform_cosine": round(float(torch.nn.functional.cosine_similarity(ref, cand, dim=0)), 4),
+        "snr_db": round(10 * math.log10(float((ref ** 2).sum()) / noise_energy), 2) if noise_energy > 0 else None,
+        "spectral_cosine": round(float(torch.nn.functional.cosine_similarity(ref_spec.reshape(-1), cand_spec.reshape(-1), dim=0)), 4),
+        "length_ratio": round(len(candidate) / len(reference), 3),
+    }
+
+
+class _PeakMemorySampler:
+    """Bộ nhớ đỉnh trong một khoảng chạy: VRAM từ allocator của CUDA, trên CPU lấy mẫu RSS của process (Linux)."""
+
+    def __init__(self, device_type: str, interval_seconds: float = 0.01):
+        self.device_type = device_type
+        self.interval_seconds = interval_seconds
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @staticmethod
+    def _rss_bytes() -> int:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval_seconds):
+            self.peak_bytes = max(self.peak_bytes, self._rss_bytes())
+
+    def __enter__(self):
+        if self.device_type == "cuda":
+            torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+        else:
+            self.peak_bytes = self._rss_bytes()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.device_type == "cuda":
+            torch.cuda.synchronize()
+            self.peak_bytes = torch.cuda.max_memory_allocated()
+        else:
+            self._stop.set()
+            self._thread.join()
+            self.peak_bytes = max(self.peak_bytes, self._rss_bytes())
+        return False
+
+
+def benchmark_precisions(sentences: list[str], language: str = "vi", seed: int = 1234,
+                         min_similarity: float = PRECISION_CHECK_MIN_SIMILARITY) -> dict:
+    """
+    Chạy cùng các câu ở từng chế độ độ chính xác mà thiết bị hỗ trợ (fp32 làm chuẩn): bộ nhớ đỉnh, thời gian mỗi câu
+    và độ tương đồng waveform của bf16/fp16 so với fp32. Sinh token bằng greedy (do_sample=False, cùng seed) để khác
+    biệt chỉ đến từ độ chính xác; `passed` = mọi câu có cosine log-STFT >= min_similarity.
+    """
+    import time
+    from app.config import DEFAULT_TTS_PARAMS
+
+    tts_model = TTSModel()
+    if not tts_model.is_loaded():
+        raise RuntimeError("Không tải được model mặc định.")
+    gpt_cond_latent, speaker_embedding = tts_model.get_conditioning_latents(DEFAULT_SPEAKER_WAV_PATH)
+    model_params = {k: v for k, v in DEFAULT_TTS_PARAMS.items() if k != "enable_text_splitting"}
+    model_params["do_sample"] = False
+    original_precision = tts_model.precision
+
+    def run() -> tuple[list, float]:
+        wavs, started_at = [], time.perf_counter()
+        for sentence in sentences:
+            torch.manual_seed(seed)
+            wavs.append(tts_model.inference(sentence, language, gpt_cond_latent, speaker_embedding, model_params)["wav"])
+        if tts_model.device_type == "cuda":
+            torch.cuda.synchronize()
+        return wavs, (time.perf_counter() - started_at) / len(sentences)
+
+    report = {"device": tts_model.device_type, "sentences": len(sentences), "min_similarity": min_similarity, "modes": {}}
+    reference_wavs = None
+    try:
+        for mode in SUPPORTED_PRECISIONS:
+            tts_model._configure_precision(mode)
+            tts_model.gpt_prefix_cache.clear()  # KV của phần conditioning được tính ở chế độ trước
+            if tts_model.precision != mode:
+                report["modes"][mode] = {"skipped": f"không hỗ trợ trên {tts_model.device_type}"}
+                continue
+            run()  # warm-up (cấp phát, autotune của kernel)
+            with _PeakMemorySampler(tts_model.device_type) as memory:
+                wavs, seconds_per_sentence = run()
+            mode_report = {"seconds_per_sentence": round(seconds_per_sentence, 4),
+                           "peak_memory_mb": round(memory.peak_bytes / 2 ** 20, 1)}
+            if reference_wavs is None:
+                reference_wavs = wavs
+            else:
+                similarities = [_waveform_similarity(ref, wav) for ref, wav in zip(reference_wavs, wavs)]
+                mode_report["similarity"] = similarities
+                mode_report["min_spectral_cosine"] = min(item["spectral_cosine"] for item in similarities)
+                mode_report["passed"] = mode_report["min_spectral_cosine"] >= min_similarity
+            report["modes"][mode] = mode_report
+    finally:
+        tts_model._configure_precision(original_precision)
+    report["passed"] = all(item.get("passed", True) for item in report["modes"].values())
+    return report
+
+
+if __name__ == "__main__":
+    import sys
+    import json
+
+    logging.basicConfig(level=logging.INFO)
+    test_sentences = sys.argv[1:] or [
+        "Xin chào, đây là câu thử nghiệm thứ nhất.",
+        "Hôm nay trời đẹp và chúng ta cùng so sánh chất lượng giữa các chế độ độ chính xác.",
+        "Câu cuối cùng dùng để đo độ trễ của từng câu.",
+    ]
+    precision_report = benchmark_precisions(test_sentences)
+    print(json.dumps(precision_report, indent=2, ensure_ascii=False))
+    sys.exit(0 if precision_report["passed"] else 1)
@@ -32,4 +32,6 @@ class AudioPostprocessingParameters:
 class AudioOutput:
     audio_data: io.BytesIO
     filename: str
-    mimetype: str = "audio/wav"
\ No newline at end of file
+    mimetype: str = "audio/wav"
+    duration_seconds: float = 0.0
+    sentence_count: int = 0
\ No newline at end of file
@@ -0,0 +1,21 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def get_queue_lengths(celery_app, queue_names: list[str]) -> dict[str, int]:
+    """
+    Đọc số message đang chờ của từng queue trên broker (một kết nối, mỗi queue một channel).
+    Queue chưa tồn tại được coi là rỗng.
+    """
+    lengths: dict[str, int] = {}
+    with celery_app.connection_for_read() as connection:
+        for queue_name in queue_names:
+            try:
+                with connection.channel() as channel:
+                    _, message_count, _ = channel.queue_declare(queue=queue_name, passive=True)
+                lengths[queue_name] = int(message_count)
+            except Exception as e:
+                logger.debug(f"Không đọc được độ dài queue '{queue_name}' (coi như rỗng): {e}")
+                lengths[queue_name] = 0
+    return lengths
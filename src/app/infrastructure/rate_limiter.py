@@ -0,0 +1,234 @@
+import hashlib
+import logging
+from dataclasses import dataclass
+
+from app.config import (
+    RATE_LIMIT_ENABLED, RATE_LIMIT_REQUESTS_PER_MINUTE, RATE_LIMIT_CHARS_PER_MINUTE, API_KEY_RATE_LIMITS,
+)
+from app.infrastructure.redis_client import get_redis_client
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_BUCKET_KEY_PREFIX = "tts:ratelimit:"
+_USAGE_KEY_PREFIX = "tts:usage:"
+
+# Hai token bucket (request, ký tự) của một key trong cùng một hash, nạp lại theo thời gian của Redis (TIME) để
+# mọi process API dùng chung một đồng hồ. Chỉ trừ khi cả hai bucket đủ; capacity <= 0 nghĩa là không giới hạn.
+# Đồng thời cộng counter sử dụng của key. Trả về {allowed, số giây phải chờ, bucket gây chặn, mức request, mức ký tự}.
+_TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'requests', 'chars', 'ts')
+local elapsed = math.max(0, now - (tonumber(state[3]) or now))
+
+local function refill(level, capacity, rate)
+    if capacity <= 0 then return 0 end
+    return math.min(capacity, (tonumber(level) or capacity) + elapsed * rate)
+end
+
+local request_capacity, request_rate, request_cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local char_capacity, char_rate, char_cost = tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[6])
+local requests = refill(state[1], request_capacity, request_rate)
+local chars = refill(state[2], char_capacity, char_rate)
+
+local wait, limited_by = 0, ''
+if request_capacity > 0 and requests < request_cost then
+    wait, limited_by = (request_cost - requests) / request_rate, 'requests'
+end
+if char_capacity > 0 and chars < char_cost then
+    local char_wait = (char_cost - chars) / char_rate
+    if char_wait > wait then wait, limited_by = char_wait, 'chars' end
+end
+
+local allowed = 0
+if limited_by == '' then
+    allowed = 1
+    if request_capacity > 0 then requests = requests - request_cost end
+    if char_capacity > 0 then chars = chars - char_cost end
+    redis.call('HINCRBY', KEYS[2], 'requests', 1)
+    redis.call('HINCRBYFLOAT', KEYS[2], 'chars', char_cost)
+else
+    redis.call('HINCRBY', KEYS[2], 'rate_limited_requests', 1)
+end
+redis.call('HSET', KEYS[1], 'requests', tostring(requests), 'chars', tostring(chars), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[7]))
+return {allowed, tostring(wait), limited_by, tostring(requests), tostring(chars)}
+"""
+
+
+# Trả lại 1 request và ARGV[3] ký tự cho bucket (không vượt capacity) khi request đã bị trừ nhưng không được xử lý,
+# đồng thời chuyển nó từ counter `requests`/`chars` sang `admission_rejected_requests`. Bucket đã hết hạn = đang đầy.
+_REFUND_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    local state = redis.call('HMGET', KEYS[1], 'requests', 'chars')
+    local request_capacity, char_capacity, char_cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    if request_capacity > 0 then
+        redis.call('HSET', KEYS[1], 'requests', tostring(math.min(request_capacity, (tonumber(state[1]) or 0) + 1)))
+    end
+    if char_capacity > 0 then
+        redis.call('HSET', KEYS[1], 'chars', tostring(math.min(char_capacity, (tonumber(state[2]) or 0) + char_cost)))
+    end
+end
+redis.call('HINCRBYFLOAT', KEYS[2], 'requests', -1)
+redis.call('HINCRBYFLOAT', KEYS[2], 'chars', -tonumber(ARGV[3]))
+redis.call('HINCRBYFLOAT', KEYS[2], ARGV[4], 1)
+return 1
+"""
+
+
+def api_key_id(api_key: str) -> str:
+    """Định danh ổn định của một API key để dùng trong Redis/response, không lộ key gốc."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def usage_key(key_id: str) -> str:
+    return f"{_USAGE_KEY_PREFIX}{key_id}"
+
+
+@dataclass(frozen=True)
+class RateLimits:
+    requests_per_minute: float
+    chars_per_minute: float
+
+
+@dataclass(frozen=True)
+class RateLimitDecision:
+    allowed: bool
+    limits: RateLimits
+    retry_after_seconds: float = 0.0
+    limited_by: str | None = None
+    remaining_requests: float | None = None
+    remaining_chars: float | None = None
+    status_code: int = 200
+    reason: str | None = None
+
+
+class ApiKeyRateLimiter:
+    """
+    Giới hạn số request và số ký tự mỗi phút cho từng API key bằng token bucket trong Redis (một script Lua,
+    nguyên tử giữa nhiều process API). Bucket đầy bằng hạn mức một phút, nạp lại đều theo thời gian.
+    Có thể chạy với client Redis giả lập hỗ trợ Lua (fakeredis[lua]) qua `redis_client` hoặc set_redis_client.
+    """
+
+    def __init__(self, redis_client=None,
+                 enabled: bool = RATE_LIMIT_ENABLED,
+                 requests_per_minute: float = RATE_LIMIT_REQUESTS_PER_MINUTE,
+                 chars_per_minute: float = RATE_LIMIT_CHARS_PER_MINUTE,
+                 per_key_limits: dict[str, str] = API_KEY_RATE_LIMITS):
+        self._redis = redis_client
+        self.enabled = enabled
+        self.default_limits = RateLimits(requests_per_minute, chars_per_minute)
+        self._per_key_limits: dict[str, RateLimits] = {}
+        for api_key, limit_spec in per_key_limits.items():
+            try:
+                requests_limit, chars_limit = limit_spec.split(":", 1)
+                self._per_key_limits[api_key_id(api_key)] = RateLimits(float(requests_limit), float(chars_limit))
+            except ValueError:
+                logger.warning(f"API_KEY_RATE_LIMITS: Bỏ qua giá trị không hợp lệ '{limit_spec}' (cần 'requests:chars').")
+        self._script = None
+        self._refund_script = None
+
+    @property
+    def redis(self):
+        return self._redis or get_redis_client()
+
+    def limits_for(self, key_id: str) -> RateLimits:
+        return self._per_key_limits.get(key_id, self.default_limits)
+
+    def _bucket_key(self, key_id: str) -> str:
+        return f"{_BUCKET_KEY_PREFIX}{key_id}"
+
+    def check_and_consume(self, key_id: str, chars: int) -> RateLimitDecision:
+        """Trừ 1 request và `chars` ký tự khỏi bucket của key nếu đủ; nếu không, cho biết phải chờ bao lâu."""
+        limits = self.limits_for(key_id)
+        if not self.enabled:
+            self.record_usage(key_id, requests=1, chars=chars)
+            return RateLimitDecision(allowed=True, limits=limits)
+
+        if 0 < limits.chars_per_minute < chars:
+            self.record_usage(key_id, rate_limited_requests=1)
+            metrics.increment("tts_rate_limited_total", limit="chars")
+            return RateLimitDecision(
+                allowed=False, limits=limits, limited_by="chars", status_code=413,
+                reason=f"Văn bản ({chars} ký tự) vượt hạn mức {limits.chars_per_minute:.0f} ký tự mỗi phút của API key."
+            )
+
+        if self._script is None:
+            self._script = self.redis.register_script(_TOKEN_BUCKET_SCRIPT)
+        # bucket hết hạn sau khi đã nạp đầy lại (không còn trạng thái cần giữ)
+        bucket_ttl = 120
+        allowed, wait, limited_by, remaining_requests, remaining_chars = self._script(
+            keys=[self._bucket_key(key_id), usage_key(key_id)],
+            args=[limits.requests_per_minute, limits.requests_per_minute / 60.0, 1,
+                  limits.chars_per_minute, limits.chars_per_minute / 60.0, chars, bucket_ttl],
+            client=self.redis,
+        )
+        remaining_requests = float(remaining_requests) if limits.requests_per_minute > 0 else None
+        remaining_chars = float(remaining_chars) if limits.chars_per_minute > 0 else None
+        if int(allowed):
+            return RateLimitDecision(allowed=True, limits=limits,
+                                     remaining_requests=remaining_requests, remaining_chars=remaining_chars)
+
+        metrics.increment("tts_rate_limited_total", limit=limited_by)
+        return RateLimitDecision(
+            allowed=False, limits=limits, retry_after_seconds=float(wait), limited_by=limited_by,
+            remaining_requests=remaining_requests, remaining_chars=remaining_chars, status_code=429,
+            reason=("Vượt quá số request mỗi phút của API key." if limited_by == "requests"
+                    else "Vượt quá số ký tự mỗi phút của API key.")
+        )
+
+    def refund(self, key_id: str, chars: int, rejected_counter: str = "admission_rejected_requests") -> None:
+        """
+        Hoàn lại phần đã trừ bởi check_and_consume cho request bị từ chối ở bước sau (admission control, giọng mẫu
+        không hợp lệ, lỗi tổng hợp/gửi task); request được tính vào counter `rejected_counter` thay vì `requests`.
+        """
+        if not self.enabled:
+            self.record_usage(key_id, requests=-1, chars=-chars, **{rejected_counter: 1})
+            return
+        if self._refund_script is None:
+            self._refund_script = self.redis.register_script(_REFUND_SCRIPT)
+        limits = self.limits_for(key_id)
+        self._refund_script(keys=[self._bucket_key(key_id), usage_key(key_id)],
+                            args=[limits.requests_per_minute, limits.chars_per_minute, chars, rejected_counter],
+                            client=self.redis)
+
+    def record_usage(self, key_id: str, **counters: float) -> None:
+        pipe = self.redis.pipeline()
+        for name, value in counters.items():
+            pipe.hincrbyfloat(usage_key(key_id), name, value)
+        pipe.execute()
+
+    def get_usage(self, key_id: str) -> dict:
+        """Counter cộng dồn của key và mức hiện tại của hai bucket (chưa tính phần nạp lại từ lần cập nhật cuối)."""
+        pipe = self.redis.pipeline()
+        pipe.hgetall(usage_key(key_id))
+        pipe.hgetall(self._bucket_key(key_id))
+        raw_usage, raw_bucket = pipe.execute()
+        limits = self.limits_for(key_id)
+        return {
+            "usage": {name: float(value) for name, value in raw_usage.items()},
+            "limits": {"requests_per_minute": limits.requests_per_minute, "chars_per_minute": limits.chars_per_minute},
+            "buckets": {
+                "requests": float(raw_bucket["requests"]) if "requests" in raw_bucket else limits.requests_per_minute,
+                "chars": float(raw_bucket["chars"]) if "chars" in raw_bucket else limits.chars_per_minute,
+            } if self.enabled else None,
+        }
+
+
+if __name__ == "__main__":
+    # Kiểm tra nhanh với Redis giả lập trong bộ nhớ: pip install "fakeredis[lua]"
+    import json
+    import fakeredis
+
+    limiter = ApiKeyRateLimiter(redis_client=fakeredis.FakeRedis(decode_responses=True),
+                                enabled=True, requests_per_minute=3, chars_per_minute=100, per_key_limits={})
+    key = api_key_id("demo-key")
+    for chars in (40, 40, 40, 10, 10):
+        decision = limiter.check_and_consume(key, chars)
+        print(chars, decision.allowed, decision.limited_by, round(decision.retry_after_seconds, 2))
+    limiter.refund(key, 40)  # request trước đó bị admission control từ chối
+    decision = limiter.check_and_consume(key, 30)
+    print("sau refund", 30, decision.allowed, decision.limited_by)
+    limiter.refund(key, 30, rejected_counter="rejected_requests")  # giọng mẫu tải lên không hợp lệ
+    print(json.dumps(limiter.get_usage(key), indent=2))
@@ -0,0 +1,47 @@
+import os
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+_REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
+_REDIS_USERNAME = os.environ.get('REDIS_USERNAME', None)
+_REDIS_PASSWORD = os.environ.get('REDIS_PASSWORD', None)
+_APP_REDIS_DB = int(os.environ.get('REDIS_APP_DB', 2))
+
+_redis_auth_string = ""
+if _REDIS_PASSWORD:
+    if _REDIS_USERNAME:
+        _redis_auth_string = f"{_REDIS_USERNAME}:{_REDIS_PASSWORD}@"
+    else:
+        _redis_auth_string = f":{_REDIS_PASSWORD}@"
+
+# Redis dùng cho dữ liệu của ứng dụng (heartbeat worker, cờ hủy task, rate limit...), tách DB khỏi broker/result backend.
+APP_REDIS_URL = os.environ.get("APP_REDIS_URL", f"redis://{_redis_auth_string}{_REDIS_HOST}:{_REDIS_PORT}/{_APP_REDIS_DB}")
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_redis_client():
+    """Trả về client Redis dùng chung của process (redis-py tự tạo lại kết nối sau khi fork)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import redis
+                _client = redis.Redis.from_url(
+                    APP_REDIS_URL,
+                    decode_responses=True,
+                    socket_timeout=2.0,
+                    socket_connect_timeout=2.0,
+                )
+    return _client
+
+
+def set_redis_client(client) -> None:
+    """Thay client Redis dùng chung (ví dụ một client giả lập khi chạy thử cục bộ)."""
+    global _client
+    with _client_lock:
+        _client = client
@@ -0,0 +1,347 @@
+import os
+import uuid
+import shutil
+import logging
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator
+
+from app.config import (
+    OUTPUT_DIR, STORAGE_BACKEND, STORAGE_CHUNK_SIZE,
+    S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION,
+    S3_ACCESS_KEY_ID, S3_SECRET_ACCESS_KEY, S3_MULTIPART_THRESHOLD_BYTES,
+    S3_PRESIGNED_URL_EXPIRES,
+)
+
+logger = logging.getLogger(__name__)
+
+RESULTS_PREFIX = "results"
+SPEAKER_UPLOADS_PREFIX = "speakers"
+CHECKPOINTS_PREFIX = "checkpoints"
+PROFILES_PREFIX = "profiles"
+
+
+class StorageError(Exception):
+    pass
+
+
+class ObjectNotFoundError(StorageError):
+    pass
+
+
+class ResultStorage(ABC):
+    """Giao diện lưu trữ dùng chung giữa API và worker (kết quả âm thanh, file giọng mẫu tải lên)."""
+
+    @abstractmethod
+    def save_stream(self, key: str, stream: BinaryIO, content_type: str = "application/octet-stream") -> None:
+        """Ghi nội dung từ một stream (đọc theo từng khối) vào key."""
+
+    @abstractmethod
+    def open_stream(self, key: str) -> BinaryIO:
+        """Mở key để đọc tuần tự. Ném ObjectNotFoundError nếu không tồn tại."""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def list_keys(self, prefix: str) -> list[str]:
+        """Các key bắt đầu bằng `prefix` (coi như thư mục, ví dụ 'checkpoints/<task_id>/')."""
+
+    def delete_prefix(self, prefix: str) -> int:
+        keys = self.list_keys(prefix)
+        for key in keys:
+            self.delete(key)
+        return len(keys)
+
+    def local_path(self, key: str) -> str | None:
+        """Đường dẫn trên đĩa cục bộ nếu backend hỗ trợ, ngược lại None."""
+        return None
+
+    def get_download_url(self, key: str, download_name: str | None = None) -> str | None:
+        """URL tải trực tiếp (ví dụ presigned URL) nếu backend hỗ trợ, ngược lại None."""
+        return None
+
+    def iter_chunks(self, key: str, chunk_size: int = STORAGE_CHUNK_SIZE) -> Iterator[bytes]:
+        stream = self.open_stream(key)
+        try:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            stream.close()
+
+    @contextmanager
+    def fetch_to_local_file(self, key: str, suffix: str = "") -> Iterator[str]:
+        """
+        Trả về một đường dẫn cục bộ chứa nội dung của key trong phạm vi `with`.
+        Backend không có đĩa cục bộ sẽ tải về file tạm và xóa khi thoát.
+        """
+        existing_path = self.local_path(key)
+        if existing_path is not None:
+            if not os.path.exists(existing_path):
+                raise ObjectNotFoundError(f"Không tìm thấy object '{key}' trong storage.")
+            yield existing_path
+            return
+
+        tmp_file = tempfile.NamedTemporaryFile(suffix=suffix or os.path.splitext(key)[1], prefix="storage_fetch_", delete=False)
+        try:
+            with tmp_file:
+                stream = self.open_stream(key)
+                try:
+                    shutil.copyfileobj(stream, tmp_file, STORAGE_CHUNK_SIZE)
+                finally:
+                    stream.close()
+            yield tmp_file.name
+        finally:
+            try:
+                os.remove(tmp_file.name)
+            except OSError:
+                pass
+
+
+class LocalDiskStorage(ResultStorage):
+    def __init__(self, base_dir: str = OUTPUT_DIR):
+        self.base_dir = os.path.abspath(base_dir)
+        os.makedirs(self.base_dir, exist_ok=True)
+        logger.info(f"LocalDiskStorage sử dụng thư mục: {self.base_dir}")
+
+    def _resolve(self, key: str) -> str:
+        path = os.path.abspath(os.path.join(self.base_dir, key))
+        if os.path.commonpath([path, self.base_dir]) != self.base_dir:
+            raise StorageError(f"Key không hợp lệ (nằm ngoài thư mục lưu trữ): '{key}'")
+        return path
+
+    def save_stream(self, key: str, stream: BinaryIO, content_type: str = "application/octet-stream") -> None:
+        path = self._resolve(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # mỗi lần ghi một file tạm riêng: hai writer cùng key không ghi đè file .part của nhau
+        tmp_path = f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.part"
+        try:
+            with open(tmp_path, "wb") as f_out:
+                shutil.copyfileobj(stream, f_out, STORAGE_CHUNK_SIZE)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def open_stream(self, key: str) -> BinaryIO:
+        path = self._resolve(key)
+        try:
+            return open(path, "rb")
+        except FileNotFoundError as e:
+            raise ObjectNotFoundError(f"Không tìm thấy object '{key}' trong storage.") from e
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._resolve(key))
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._resolve(key))
+        except FileNotFoundError:
+            pass
+
+    def list_keys(self, prefix: str) -> list[str]:
+        prefix_dir = self._resolve(prefix)
+        if not os.path.isdir(prefix_dir):
+            return []
+        keys = []
+        for dir_path, _, file_names in os.walk(prefix_dir):
+            for file_name in file_names:
+                if file_name.endswith(".part"):
+                    continue
+                keys.append(os.path.relpath(os.path.join(dir_path, file_name), self.base_dir).replace(os.sep, "/"))
+        return sorted(keys)
+
+    def delete_prefix(self, prefix: str) -> int:
+        deleted_count = super().delete_prefix(prefix)
+        shutil.rmtree(self._resolve(prefix), ignore_errors=True)
+        return deleted_count
+
+    def local_path(self, key: str) -> str | None:
+        return self._resolve(key)
+
+
+class S3Storage(ResultStorage):
+    """
+    Backend object store tương thích S3 (AWS S3, MinIO, Ceph...).
+    Đặt S3_ENDPOINT_URL để trỏ tới một dịch vụ S3 cục bộ khi phát triển/kiểm thử.
+    """
+
+    def __init__(self,
+                 bucket: str = S3_BUCKET,
+                 prefix: str = S3_PREFIX,
+                 endpoint_url: str | None = S3_ENDPOINT_URL,
+                 region_name: str | None = S3_REGION,
+                 client=None):
+        if not bucket:
+            raise StorageError("STORAGE_BACKEND=s3 nhưng S3_BUCKET chưa được cấu hình.")
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+        except ImportError as e:
+            raise StorageError("STORAGE_BACKEND=s3 yêu cầu thư viện 'boto3' (pip install boto3).") from e
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self._client = client or boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            region_name=region_name or None,
+            aws_access_key_id=S3_ACCESS_KEY_ID or None,
+            aws_secret_access_key=S3_SECRET_ACCESS_KEY or None,
+        )
+        self._transfer_config = TransferConfig(
+            multipart_threshold=S3_MULTIPART_THRESHOLD_BYTES,
+            multipart_chunksize=max(S3_MULTIPART_THRESHOLD_BYTES, 5 * 1024 * 1024),
+        )
+        logger.info(f"S3Storage sử dụng bucket '{self.bucket}', prefix '{self.prefix}', endpoint '{endpoint_url or 'mặc định'}'")
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def save_stream(self, key: str, stream: BinaryIO, content_type: str = "application/octet-stream") -> None:
+        self._client.upload_fileobj(
+            stream, self.bucket, self._object_key(key),
+            ExtraArgs={"ContentType": content_type},
+            Config=self._transfer_config,
+        )
+
+    def open_stream(self, key: str) -> BinaryIO:
+        try:
+            response = self._client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except self._client.exceptions.NoSuchKey as e:
+            raise ObjectNotFoundError(f"Không tìm thấy object '{key}' trong storage.") from e
+        return response["Body"]
+
+    def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+        try:
+            self._client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def delete(self, key: str) -> None:
+        self._client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def list_keys(self, prefix: str) -> list[str]:
+        object_prefix = self._object_key(prefix)
+        strip_length = len(self.prefix) + 1 if self.prefix else 0
+        keys = []
+        paginator = self._client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=object_prefix):
+            keys.extend(item["Key"][strip_length:] for item in page.get("Contents", []))
+        return sorted(keys)
+
+    def get_download_url(self, key: str, download_name: str | None = None) -> str | None:
+        params = {"Bucket": self.bucket, "Key": self._object_key(key)}
+        if download_name:
+            params["ResponseContentDisposition"] = f'attachment; filename="{download_name}"'
+        return self._client.generate_presigned_url("get_object", Params=params, ExpiresIn=S3_PRESIGNED_URL_EXPIRES)
+
+
+_storage_instance: ResultStorage | None = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> ResultStorage:
+    """Trả về instance storage dùng chung cho process hiện tại, theo STORAGE_BACKEND."""
+    global _storage_instance
+    if _storage_instance is None:
+        with _storage_lock:
+            if _storage_instance is None:
+                if STORAGE_BACKEND == "s3":
+                    _storage_instance = S3Storage()
+                else:
+                    if STORAGE_BACKEND != "local":
+                        logger.warning(f"STORAGE_BACKEND không hợp lệ: '{STORAGE_BACKEND}'. Sử dụng 'local'.")
+                    _storage_instance = LocalDiskStorage()
+    return _storage_instance
+
+
+def result_key(filename: str) -> str:
+    return f"{RESULTS_PREFIX}/{filename}"
+
+
+def speaker_upload_key(filename: str) -> str:
+    return f"{SPEAKER_UPLOADS_PREFIX}/{filename}"
+
+
+def checkpoint_prefix(task_id: str) -> str:
+    return f"{CHECKPOINTS_PREFIX}/{task_id}/"
+
+
+def profile_key(task_id: str) -> str:
+    return f"{PROFILES_PREFIX}/{task_id}.zip"
+
+
+def check_storage_roundtrip(storage: ResultStorage) -> dict:
+    """
+    Kiểm tra các thao tác của một backend: ghi nhỏ và lớn (vượt ngưỡng multipart với S3), đọc lại, exists, list_keys,
+    fetch_to_local_file, URL tải, ObjectNotFoundError, delete_prefix. Ném AssertionError nếu có thao tác sai.
+    """
+    import io
+
+    prefix = f"storage_check_{uuid.uuid4().hex[:8]}/"
+    small_payload = b"RIFF" + os.urandom(1024)
+    large_payload = os.urandom(max(S3_MULTIPART_THRESHOLD_BYTES, 5 * 1024 * 1024) + 1024 * 1024)
+    report = {"backend": type(storage).__name__}
+    try:
+        storage.save_stream(f"{prefix}small.wav", io.BytesIO(small_payload), content_type="audio/wav")
+        storage.save_stream(f"{prefix}nested/large.bin", io.BytesIO(large_payload))
+        assert b"".join(storage.iter_chunks(f"{prefix}small.wav")) == small_payload, "nội dung file nhỏ không khớp"
+        assert b"".join(storage.iter_chunks(f"{prefix}nested/large.bin")) == large_payload, "nội dung file lớn không khớp"
+        assert storage.exists(f"{prefix}small.wav") and not storage.exists(f"{prefix}missing.wav"), "exists sai"
+        listed = storage.list_keys(prefix)
+        assert listed == [f"{prefix}nested/large.bin", f"{prefix}small.wav"], f"list_keys sai: {listed}"
+        with storage.fetch_to_local_file(f"{prefix}small.wav") as local_path:
+            with open(local_path, "rb") as f:
+                assert f.read() == small_payload, "fetch_to_local_file sai"
+        try:
+            storage.open_stream(f"{prefix}missing.wav")
+            raise AssertionError("open_stream không ném ObjectNotFoundError")
+        except ObjectNotFoundError:
+            pass
+        report["download_url"] = storage.get_download_url(f"{prefix}small.wav", download_name="small.wav")
+        report["large_object_bytes"] = len(large_payload)
+    finally:
+        report["deleted_keys"] = storage.delete_prefix(prefix)
+    assert not storage.list_keys(prefix), "delete_prefix còn sót key"
+    report["passed"] = True
+    return report
+
+
+if __name__ == "__main__":
+    # cd src && python -m app.infrastructure.storage [local|s3]
+    # s3 không có S3_ENDPOINT_URL: chạy với S3 giả lập trong process (pip install "moto[s3]" boto3);
+    # có S3_ENDPOINT_URL và S3_BUCKET (ví dụ MinIO): chạy với dịch vụ thật.
+    import sys
+    import json
+
+    logging.basicConfig(level=logging.INFO)
+    backend = sys.argv[1] if len(sys.argv) > 1 else "s3"
+    if backend == "local":
+        with tempfile.TemporaryDirectory(prefix="storage_check_") as tmp_dir:
+            print(json.dumps(check_storage_roundtrip(LocalDiskStorage(tmp_dir)), indent=2, ensure_ascii=False))
+    elif S3_ENDPOINT_URL:
+        print(json.dumps(check_storage_roundtrip(S3Storage()), indent=2, ensure_ascii=False))
+    else:
+        import boto3
+        from moto import mock_aws
+
+        with mock_aws():
+            boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="tts-storage-check")
+            s3_storage = S3Storage(bucket="tts-storage-check", prefix="tts", region_name="us-east-1",
+                                   client=boto3.client("s3", region_name="us-east-1"))
+            print(json.dumps(check_storage_roundtrip(s3_storage), indent=2, ensure_ascii=False))
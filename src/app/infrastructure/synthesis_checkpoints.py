@@ -0,0 +1,158 @@
+import io
+import json
+import hashlib
+import logging
+
+import torch
+import torchaudio
+
+from app.config import XTTS_SAMPLE_RATE
+from app.infrastructure.storage import ResultStorage, ObjectNotFoundError, checkpoint_prefix
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_MANIFEST_NAME = "manifest.json"
+_SEGMENT_SUFFIX = ".wav"
+
+
+def synthesis_fingerprint(**inputs) -> str:
+    """Dấu vân tay của các tham số ảnh hưởng tới âm thanh từng câu; checkpoint chỉ được dùng lại khi khớp."""
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+def _sentence_digest(sentence_text: str) -> str:
+    return hashlib.sha1(sentence_text.encode("utf-8")).hexdigest()[:12]
+
+
+def _segment_index(key: str) -> int | None:
+    name = key.rsplit("/", 1)[-1]
+    if not (name.startswith("segment_") and name.endswith(_SEGMENT_SUFFIX)):
+        return None
+    try:
+        return int(name.split("_")[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def read_segment(storage: ResultStorage, key: str) -> torch.Tensor:
+    stream = storage.open_stream(key)
+    try:
+        waveform, _ = torchaudio.load(io.BytesIO(stream.read()), format="wav")
+    finally:
+        stream.close()
+    return waveform.view(-1)
+
+
+def list_segments(storage: ResultStorage, task_id: str) -> list[tuple[int, str]]:
+    """
+    Các segment đã lưu của task theo thứ tự câu: [(chỉ số câu, key)]. Các câu được tổng hợp tuần tự nên
+    đây luôn là phần đầu đã xong của kết quả (câu bị bỏ qua/lỗi cũng vắng mặt trong kết quả cuối).
+    """
+    segments = []
+    for key in storage.list_keys(checkpoint_prefix(task_id)):
+        index = _segment_index(key)
+        if index is not None:
+            segments.append((index, key))
+    return sorted(segments)
+
+
+def build_partial_wav(storage: ResultStorage, task_id: str,
+                      sample_rate: int = XTTS_SAMPLE_RATE) -> tuple[io.BytesIO, float] | None:
+    """Ghép các segment đã xong thành một file WAV PCM16 (chưa qua hậu kỳ). Trả về (dữ liệu, số giây) hoặc None."""
+    segments = list_segments(storage, task_id)
+    if not segments:
+        return None
+    waveform = torch.cat([read_segment(storage, key) for _, key in segments])
+    buffer = io.BytesIO()
+    torchaudio.save(buffer, waveform.clamp(-1.0, 1.0).view(1, -1), sample_rate, format="wav", encoding="PCM_S", bits_per_sample=16)
+    buffer.seek(0)
+    return buffer, waveform.numel() / sample_rate
+
+
+class SynthesisCheckpointStore:
+    """
+    Lưu âm thanh của từng câu đã tổng hợp xong dưới `checkpoints/<task_id>/` trong storage, để task
+    bị giao lại (worker mất, retry sau soft time limit) bỏ qua các câu đã xong và tiếp tục từ câu dang dở.
+    Segment là WAV float32 ở XTTS_SAMPLE_RATE (trước hậu kỳ), tên gồm chỉ số câu và hash nội dung câu.
+    """
+
+    def __init__(self, storage: ResultStorage, task_id: str, fingerprint: str, sample_rate: int = XTTS_SAMPLE_RATE):
+        self.storage = storage
+        self.task_id = task_id
+        self.fingerprint = fingerprint
+        self.sample_rate = sample_rate
+        self.prefix = checkpoint_prefix(task_id)
+        self._existing_keys: set[str] = set()
+        self.resumed_count = 0
+
+    def _segment_key(self, index: int, sentence_text: str) -> str:
+        return f"{self.prefix}segment_{index:05d}_{_sentence_digest(sentence_text)}{_SEGMENT_SUFFIX}"
+
+    def prepare(self) -> int:
+        """Đọc checkpoint sẵn có; xóa chúng nếu được tạo với tham số khác. Trả về số segment dùng lại được."""
+        manifest_key = f"{self.prefix}{_MANIFEST_NAME}"
+        try:
+            stream = self.storage.open_stream(manifest_key)
+            try:
+                manifest = json.loads(stream.read())
+            finally:
+                stream.close()
+        except ObjectNotFoundError:
+            manifest = None
+        except Exception as e_manifest:
+            logger.warning(f"Checkpoint [{self.task_id}]: Manifest không đọc được, bắt đầu lại từ đầu: {e_manifest}")
+            manifest = {}
+
+        if manifest is not None and manifest.get("fingerprint") != self.fingerprint:
+            logger.info(f"Checkpoint [{self.task_id}]: Tham số tổng hợp đã thay đổi, xóa checkpoint cũ.")
+            self.storage.delete_prefix(self.prefix)
+            manifest = None
+
+        if manifest is None:
+            self.storage.save_stream(
+                manifest_key,
+                io.BytesIO(json.dumps({"fingerprint": self.fingerprint, "sample_rate": self.sample_rate}).encode("utf-8")),
+                content_type="application/json"
+            )
+            self._existing_keys = set()
+        else:
+            self._existing_keys = {key for key in self.storage.list_keys(self.prefix) if key.endswith(_SEGMENT_SUFFIX)}
+            if self._existing_keys:
+                logger.info(f"Checkpoint [{self.task_id}]: Tìm thấy {len(self._existing_keys)} câu đã tổng hợp, tiếp tục từ checkpoint.")
+        return len(self._existing_keys)
+
+    def load_segment(self, index: int, sentence_text: str) -> torch.Tensor | None:
+        key = self._segment_key(index, sentence_text)
+        if key not in self._existing_keys:
+            return None
+        try:
+            waveform = read_segment(self.storage, key)
+        except Exception as e_load:
+            logger.warning(f"Checkpoint [{self.task_id}]: Không đọc được segment câu {index + 1}, tổng hợp lại: {e_load}")
+            self._existing_keys.discard(key)
+            return None
+        self.resumed_count += 1
+        metrics.increment("tts_checkpoint_segments_resumed_total")
+        return waveform
+
+    def save_segment(self, index: int, sentence_text: str, waveform: torch.Tensor) -> None:
+        """Lỗi khi ghi checkpoint không làm hỏng task; câu đó chỉ không được dùng lại nếu task bị giao lại."""
+        key = self._segment_key(index, sentence_text)
+        try:
+            buffer = io.BytesIO()
+            torchaudio.save(buffer, waveform.detach().float().cpu().view(1, -1), self.sample_rate,
+                            format="wav", encoding="PCM_F", bits_per_sample=32)
+            buffer.seek(0)
+            self.storage.save_stream(key, buffer, content_type="audio/wav")
+            self._existing_keys.add(key)
+            metrics.increment("tts_checkpoint_segments_saved_total")
+        except Exception as e_save:
+            logger.warning(f"Checkpoint [{self.task_id}]: Không ghi được segment câu {index + 1}: {e_save}")
+
+    def clear(self) -> None:
+        try:
+            deleted_count = self.storage.delete_prefix(self.prefix)
+            logger.debug(f"Checkpoint [{self.task_id}]: Đã xóa {deleted_count} object checkpoint.")
+        except Exception as e_clear:
+            logger.warning(f"Checkpoint [{self.task_id}]: Không xóa được checkpoint: {e_clear}")
@@ -0,0 +1,58 @@
+import logging
+
+from app.config import TASK_CANCEL_FLAG_TTL_SECONDS
+from app.infrastructure.redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+_CANCEL_KEY_PREFIX = "tts:cancel:"
+_OWNER_KEY_PREFIX = "tts:task_owner:"
+
+
+class TaskCancellationRegistry:
+    """
+    Cờ hủy task trong Redis. API đặt cờ khi client hủy request; worker kiểm tra trước khi bắt đầu và giữa các câu
+    để dừng trong vòng một câu, dispatcher của FairTaskScheduler bỏ các task bị hủy khi còn chờ trong hàng đợi theo key.
+    """
+
+    def __init__(self, redis_client=None, flag_ttl_seconds: int = TASK_CANCEL_FLAG_TTL_SECONDS):
+        self._redis = redis_client
+        self.flag_ttl_seconds = flag_ttl_seconds
+
+    @property
+    def redis(self):
+        return self._redis or get_redis_client()
+
+    def register_task(self, task_id: str, key_id: str) -> None:
+        """Ghi nhận task do API tạo cho key nào, để DELETE phân biệt task đang chờ trong broker với task_id không tồn tại."""
+        self.redis.set(f"{_OWNER_KEY_PREFIX}{task_id}", key_id, ex=self.flag_ttl_seconds)
+
+    def task_owner(self, task_id: str) -> str | None:
+        return self.redis.get(f"{_OWNER_KEY_PREFIX}{task_id}")
+
+    def request_cancel(self, task_id: str, reason: str = "client") -> bool:
+        """Đặt cờ hủy; trả về False nếu task đã được yêu cầu hủy trước đó."""
+        return bool(self.redis.set(f"{_CANCEL_KEY_PREFIX}{task_id}", reason, nx=True, ex=self.flag_ttl_seconds))
+
+    def is_cancelled(self, task_id: str) -> bool:
+        return bool(self.redis.exists(f"{_CANCEL_KEY_PREFIX}{task_id}"))
+
+    def cancel_checker(self, task_id: str):
+        """Hàm không tham số cho vòng lặp tổng hợp; lỗi Redis không làm dừng task (coi như chưa bị hủy)."""
+        def is_cancelled() -> bool:
+            try:
+                return self.is_cancelled(task_id)
+            except Exception as e_redis:
+                logger.warning(f"TaskCancellation: Không đọc được cờ hủy của task {task_id}: {e_redis}")
+                return False
+        return is_cancelled
+
+
+_cancellation_instance: TaskCancellationRegistry | None = None
+
+
+def get_task_cancellation() -> TaskCancellationRegistry:
+    global _cancellation_instance
+    if _cancellation_instance is None:
+        _cancellation_instance = TaskCancellationRegistry()
+    return _cancellation_instance
@@ -0,0 +1,138 @@
+import json
+import time
+import logging
+
+from app.config import WORKER_HEARTBEAT_INTERVAL_SECONDS, WORKER_RTF_WINDOW
+from app.infrastructure.redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+_WORKER_KEY_PREFIX = "tts:worker:"
+_WORKERS_SET_KEY = "tts:workers"
+_FLEET_COUNTERS_KEY = "tts:fleet_counters"
+
+
+class WorkerRegistry:
+    """
+    Lưu heartbeat, thời gian xử lý gần đây (RTF) của từng worker và các counter cộng dồn của cả fleet trong Redis.
+    Worker ghi, API đọc để tính năng lực xử lý (capacity).
+    """
+
+    def __init__(self, redis_client=None,
+                 heartbeat_interval_seconds: float = WORKER_HEARTBEAT_INTERVAL_SECONDS,
+                 rtf_window: int = WORKER_RTF_WINDOW):
+        self._redis = redis_client
+        self.heartbeat_interval_seconds = heartbeat_interval_seconds
+        self.heartbeat_ttl_seconds = max(int(heartbeat_interval_seconds * 3), 5)
+        self.rtf_window = rtf_window
+
+    @property
+    def redis(self):
+        return self._redis or get_redis_client()
+
+    def publish_heartbeat(self, hostname: str, info: dict) -> None:
+        key = f"{_WORKER_KEY_PREFIX}{hostname}"
+        fields = {name: json.dumps(value) for name, value in info.items()}
+        fields["hostname"] = json.dumps(hostname)
+        fields["heartbeat_at"] = json.dumps(time.time())
+        pipe = self.redis.pipeline()
+        pipe.hset(key, mapping=fields)
+        pipe.expire(key, self.heartbeat_ttl_seconds)
+        pipe.sadd(_WORKERS_SET_KEY, hostname)
+        pipe.execute()
+
+    def record_task_timing(self, hostname: str, worker_seconds: float, audio_seconds: float) -> None:
+        if audio_seconds <= 0:
+            return
+        key = f"{_WORKER_KEY_PREFIX}{hostname}:rtf"
+        pipe = self.redis.pipeline()
+        pipe.lpush(key, json.dumps([round(worker_seconds, 3), round(audio_seconds, 3)]))
+        pipe.ltrim(key, 0, self.rtf_window - 1)
+        pipe.expire(key, max(self.heartbeat_ttl_seconds, 3600))
+        pipe.execute()
+
+    def set_resident_models(self, hostname: str, pid: int, model_ids: list[str]) -> None:
+        """Ghi danh sách model đang nằm trong bộ nhớ của một process (pid) thuộc worker."""
+        key = f"{_WORKER_KEY_PREFIX}{hostname}:models"
+        pipe = self.redis.pipeline()
+        if model_ids:
+            pipe.hset(key, str(pid), json.dumps(sorted(model_ids)))
+        else:
+            pipe.hdel(key, str(pid))
+        pipe.expire(key, max(self.heartbeat_ttl_seconds, 3600))
+        pipe.execute()
+
+    def set_process_warmup(self, hostname: str, pid: int, warmup: dict | None) -> None:
+        """Ghi trạng thái warm-up của một process con (pid) thuộc worker; None để xóa khi process kết thúc."""
+        key = f"{_WORKER_KEY_PREFIX}{hostname}:warmup"
+        pipe = self.redis.pipeline()
+        if warmup is not None:
+            pipe.hset(key, str(pid), json.dumps(warmup))
+        else:
+            pipe.hdel(key, str(pid))
+        pipe.expire(key, max(self.heartbeat_ttl_seconds, 3600))
+        pipe.execute()
+
+    def get_process_warmups(self, hostname: str) -> dict[int, dict]:
+        raw_warmups = self.redis.hgetall(f"{_WORKER_KEY_PREFIX}{hostname}:warmup")
+        return {int(pid): json.loads(value) for pid, value in raw_warmups.items()}
+
+    def get_resident_models(self, hostname: str) -> set[str]:
+        raw_models = self.redis.hgetall(f"{_WORKER_KEY_PREFIX}{hostname}:models")
+        return {model_id for value in raw_models.values() for model_id in json.loads(value)}
+
+    def flush_counter_deltas(self, deltas: dict[str, float]) -> None:
+        if not deltas:
+            return
+        pipe = self.redis.pipeline()
+        for series, delta in deltas.items():
+            pipe.hincrbyfloat(_FLEET_COUNTERS_KEY, series, delta)
+        pipe.execute()
+
+    def get_fleet_counters(self) -> dict[str, float]:
+        return {series: float(value) for series, value in self.redis.hgetall(_FLEET_COUNTERS_KEY).items()}
+
+    def list_workers(self) -> list[dict]:
+        """Danh sách worker còn heartbeat, kèm RTF gần đây (worker_seconds / audio_seconds)."""
+        hostnames = sorted(self.redis.smembers(_WORKERS_SET_KEY))
+        if not hostnames:
+            return []
+
+        pipe = self.redis.pipeline()
+        for hostname in hostnames:
+            pipe.hgetall(f"{_WORKER_KEY_PREFIX}{hostname}")
+            pipe.lrange(f"{_WORKER_KEY_PREFIX}{hostname}:rtf", 0, self.rtf_window - 1)
+            pipe.hgetall(f"{_WORKER_KEY_PREFIX}{hostname}:models")
+        raw_results = pipe.execute()
+
+        workers, stale_hostnames = [], []
+        now = time.time()
+        for index, hostname in enumerate(hostnames):
+            raw_info, raw_timings, raw_models = raw_results[3 * index:3 * index + 3]
+            if not raw_info:
+                stale_hostnames.append(hostname)
+                continue
+            info = {name: json.loads(value) for name, value in raw_info.items()}
+            timings = [json.loads(item) for item in raw_timings]
+            total_worker_seconds = sum(t[0] for t in timings)
+            total_audio_seconds = sum(t[1] for t in timings)
+            info["recent_rtf"] = round(total_worker_seconds / total_audio_seconds, 4) if total_audio_seconds > 0 else None
+            info["recent_task_count"] = len(timings)
+            info["recent_mean_task_seconds"] = round(total_worker_seconds / len(timings), 3) if timings else None
+            info["resident_models"] = sorted({model_id for value in raw_models.values() for model_id in json.loads(value)})
+            info["heartbeat_age_seconds"] = round(now - float(info.get("heartbeat_at", 0)), 3)
+            workers.append(info)
+
+        if stale_hostnames:
+            self.redis.srem(_WORKERS_SET_KEY, *stale_hostnames)
+        return workers
+
+
+_registry_instance: WorkerRegistry | None = None
+
+
+def get_worker_registry() -> WorkerRegistry:
+    global _registry_instance
+    if _registry_instance is None:
+        _registry_instance = WorkerRegistry()
+    return _registry_instance
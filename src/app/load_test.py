@@ -0,0 +1,423 @@
+"""
+Đo tải tầng HTTP API (Flask) với một fleet worker giả lập, không cần Redis, broker hay model thật.
+
+Cách dùng (từ thư mục src, cần "fakeredis[lua]" để thay Redis của ứng dụng):
+    python -m app.load_test --concurrency 1,8,32,64 --duration 20 --workers 4 --mix submit=1,poll=8,download=1
+
+Mỗi mức concurrency chạy N client đồng thời gọi trực tiếp các endpoint thật của `app.api` qua Flask test client
+(không qua mạng): gửi /tts, poll /tts/status và tải /tts/result theo tỉ lệ của --mix. Celery dùng broker và
+result backend trong bộ nhớ; worker giả lập (pool thread của Celery) chạy task `generate_tts_task` với thời gian
+tổng hợp giả lập (--task-seconds + --seconds-per-char * số ký tự, dao động ±--jitter), cập nhật PROGRESS theo câu
+và ghi một file WAV im lặng có độ dài ước lượng vào storage cục bộ tạm. Kết quả mỗi mức: throughput, p50/p90/p99
+độ trễ và tỉ lệ lỗi (5xx) / bị từ chối (429, 413) theo từng loại thao tác.
+
+Client và worker giả lập chạy chung một process (chung GIL), nên con số là cận dưới của một process API thật.
+"""
+import os
+import io
+import json
+import math
+import time
+import wave
+import random
+import logging
+import argparse
+import tempfile
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+LOAD_TEST_API_KEY_PREFIX = "loadtest-key-"
+OPERATIONS = ("submit", "poll", "download")
+
+_SAMPLE_SENTENCES = [
+    "Xin chào quý khách, cảm ơn quý khách đã gọi đến tổng đài chăm sóc khách hàng.",
+    "Hôm nay trời nắng đẹp, nhiệt độ dao động từ hai mươi lăm đến ba mươi hai độ.",
+    "Đơn hàng của bạn đã được xác nhận và sẽ được giao trong vòng ba ngày làm việc.",
+    "Chương một. Ngôi làng nhỏ nằm bên bờ sông, nơi những cánh đồng lúa trải dài tới chân trời.",
+    "Vui lòng nhấn phím một để gặp nhân viên tư vấn, phím hai để nghe lại thông tin.",
+]
+
+
+def parse_mix(mix_spec: str) -> dict[str, float]:
+    mix = {}
+    for item in mix_spec.split(","):
+        if not item.strip():
+            continue
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Thao tác không hợp lệ trong --mix: '{name}' (hợp lệ: {', '.join(OPERATIONS)}).")
+        mix[name] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("--mix phải có ít nhất một thao tác với trọng số dương.")
+    return mix
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float | None:
+    """Percentile theo nearest-rank của một danh sách đã sắp xếp."""
+    if not sorted_values:
+        return None
+    rank = max(1, min(len(sorted_values), math.ceil(fraction * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def make_text(rng: random.Random, min_chars: int, max_chars: int) -> str:
+    target_chars = rng.randint(min_chars, max_chars)
+    parts, length = [], 0
+    while length < target_chars:
+        sentence = rng.choice(_SAMPLE_SENTENCES)
+        parts.append(sentence)
+        length += len(sentence) + 1
+    return " ".join(parts)[:max(target_chars, min_chars)]
+
+
+def _silent_wav(seconds: float, sample_rate: int) -> io.BytesIO:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(b"\x00\x00" * max(1, int(seconds * sample_rate)))
+    buffer.seek(0)
+    return buffer
+
+
+class SimulatedSynthesis:
+    """Thân task giả lập thay cho generate_tts_task.run: ngủ theo mô hình thời gian, báo PROGRESS, lưu WAV im lặng."""
+
+    def __init__(self, task, cost_estimator, task_seconds: float, seconds_per_char: float, jitter: float,
+                 failure_rate: float, sample_rate: int, seed: int):
+        self.task = task
+        self.cost_estimator = cost_estimator
+        self.task_seconds = task_seconds
+        self.seconds_per_char = seconds_per_char
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.sample_rate = sample_rate
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.completed = 0
+        self._completed_lock = threading.Lock()
+
+    def __call__(self, text_input: str, language_code: str, speaker_audio_key_or_flag: str,
+                 apply_text_normalization: bool, synthesis_model_params: dict, audio_postproc_params: dict,
+                 model_id: str | None = None, profile: bool = False, speaker_name: str | None = None) -> dict:
+        from app.infrastructure.storage import get_storage, result_key
+
+        task_id = self.task.request.id
+        with self._rng_lock:
+            jitter_factor = 1.0 + self._rng.uniform(-self.jitter, self.jitter)
+            should_fail = self._rng.random() < self.failure_rate
+        worker_seconds = max(0.0, (self.task_seconds + self.seconds_per_char * len(text_input)) * jitter_factor)
+        sentence_count = max(1, self.cost_estimator.count_sentences(text_input))
+        audio_seconds = self.cost_estimator.estimate_audio_seconds(len(text_input), language_code)
+
+        started_at = time.perf_counter()
+        for sentence_index in range(sentence_count):
+            time.sleep(worker_seconds / sentence_count)
+            self.task.update_state(task_id=task_id, state="PROGRESS", meta={
+                "sentences_done": sentence_index + 1,
+                "sentences_total": sentence_count,
+                "audio_seconds": round(audio_seconds * (sentence_index + 1) / sentence_count, 3),
+                "elapsed_seconds": round(time.perf_counter() - started_at, 3),
+                "partial_available": False,
+            })
+        if should_fail:
+            raise RuntimeError("Lỗi giả lập của worker (--failure-rate).")
+
+        filename = f"{task_id}.wav"
+        get_storage().save_stream(result_key(filename), _silent_wav(audio_seconds, self.sample_rate), content_type="audio/wav")
+        with self._completed_lock:
+            self.completed += 1
+        return {
+            "status": "SUCCESS",
+            "storage_key": result_key(filename),
+            "filename": filename,
+            "metrics": {
+                "language": language_code,
+                "model_id": model_id or "default",
+                "text_chars": len(text_input),
+                "sentence_count": sentence_count,
+                "audio_seconds": round(audio_seconds, 3),
+                "worker_seconds": round(time.perf_counter() - started_at, 3),
+                "resumed_sentences": 0,
+            },
+        }
+
+
+class _TaskPool:
+    """Task id mà các client đã gửi (để poll) và đã thấy SUCCESS (để tải), dùng chung giữa các client."""
+
+    def __init__(self, max_tracked: int = 2000):
+        self._pending = deque(maxlen=max_tracked)
+        self._completed = deque(maxlen=max_tracked)
+        self._lock = threading.Lock()
+
+    def add_pending(self, task_id: str) -> None:
+        with self._lock:
+            self._pending.append(task_id)
+
+    def mark_finished(self, task_id: str, succeeded: bool) -> None:
+        with self._lock:
+            try:
+                self._pending.remove(task_id)
+            except ValueError:
+                pass
+            if succeeded:
+                self._completed.append(task_id)
+
+    def pick(self, rng: random.Random, completed: bool) -> str | None:
+        with self._lock:
+            source = self._completed if completed else self._pending
+            return source[rng.randrange(len(source))] if source else None
+
+
+class LoadTestRunner:
+    def __init__(self, api_module, simulated_synthesis: SimulatedSynthesis, api_keys: list[str], mix: dict[str, float],
+                 min_chars: int, max_chars: int, language: str, think_seconds: float, seed: int):
+        self.api = api_module
+        self.simulated_synthesis = simulated_synthesis
+        self.api_keys = api_keys
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.language = language
+        self.think_seconds = think_seconds
+        self.seed = seed
+
+    def _client_loop(self, client_index: int, deadline: float, task_pool: _TaskPool, records: list) -> None:
+        from app.config import API_KEY_HEADER
+
+        rng = random.Random(self.seed * 1000 + client_index)
+        client = self.api.app.test_client()
+        headers = {API_KEY_HEADER: self.api_keys[client_index % len(self.api_keys)]}
+        local_records = []
+        while time.perf_counter() < deadline:
+            operation = rng.choices(self.operations, self.weights)[0]
+            task_id = None
+            if operation == "download":
+                task_id = task_pool.pick(rng, completed=True)
+                if task_id is None:
+                    operation = "poll"
+            if operation == "poll":
+                task_id = task_pool.pick(rng, completed=False)
+                if task_id is None:
+                    operation = "submit"
+
+            started_at = time.perf_counter()
+            if operation == "submit":
+                response = client.post("/tts", headers=headers, data={
+                    "text": make_text(rng, self.min_chars, self.max_chars), "language": self.language})
+            elif operation == "poll":
+                response = client.get(f"/tts/status/{task_id}", headers=headers)
+            else:
+                response = client.get(f"/tts/result/{task_id}", headers=headers)
+            body = response.get_data()
+            latency = time.perf_counter() - started_at
+            response.close()
+            local_records.append((operation, response.status_code, latency))
+
+            if operation == "submit" and response.status_code == 202:
+                task_pool.add_pending(json.loads(body)["task_id"])
+            elif operation == "poll" and response.status_code == 200:
+                status = json.loads(body).get("status")
+                if status in ("SUCCESS", "FAILURE"):
+                    task_pool.mark_finished(task_id, succeeded=status == "SUCCESS")
+            if self.think_seconds > 0:
+                time.sleep(self.think_seconds)
+        records.extend(local_records)
+
+    def run_level(self, concurrency: int, duration_seconds: float) -> dict:
+        task_pool, records = _TaskPool(), []
+        completed_before = self.simulated_synthesis.completed
+        deadline = time.perf_counter() + duration_seconds
+        threads = [threading.Thread(target=self._client_loop, args=(index, deadline, task_pool, records),
+                                    name=f"loadtest-client-{index}", daemon=True) for index in range(concurrency)]
+        started_at = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started_at
+        return summarize_level(concurrency, elapsed, records, self.simulated_synthesis.completed - completed_before)
+
+
+def summarize_level(concurrency: int, elapsed_seconds: float, records: list[tuple[str, int, float]], tasks_completed: int) -> dict:
+    summary = {
+        "concurrency": concurrency,
+        "elapsed_seconds": round(elapsed_seconds, 3),
+        "requests": len(records),
+        "throughput_rps": round(len(records) / elapsed_seconds, 1) if elapsed_seconds > 0 else None,
+        "error_rate": round(sum(1 for _, status, _ in records if status >= 500) / len(records), 4) if records else None,
+        "rejected_rate": round(sum(1 for _, status, _ in records if status in (413, 429)) / len(records), 4) if records else None,
+        "tasks_completed": tasks_completed,
+        "operations": {},
+    }
+    for operation in OPERATIONS:
+        latencies = sorted(latency for name, _, latency in records if name == operation)
+        if not latencies:
+            continue
+        statuses = [status for name, status, _ in records if name == operation]
+        summary["operations"][operation] = {
+            "count": len(latencies),
+            "rps": round(len(latencies) / elapsed_seconds, 1),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+            "p90_ms": round(percentile(latencies, 0.90) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2),
+            "errors": sum(1 for status in statuses if status >= 500),
+            "rejected": sum(1 for status in statuses if status in (413, 429)),
+            "status_codes": {str(code): statuses.count(code) for code in sorted(set(statuses))},
+        }
+    return summary
+
+
+def format_summary_table(levels: list[dict]) -> str:
+    lines = [f"{'conc':>5} {'op':>9} {'count':>7} {'rps':>8} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} {'err':>5} {'429/413':>8}"]
+    for level in levels:
+        for operation, stats in level["operations"].items():
+            lines.append(f"{level['concurrency']:>5} {operation:>9} {stats['count']:>7} {stats['rps']:>8} "
+                         f"{stats['p50_ms']:>9} {stats['p90_ms']:>9} {stats['p99_ms']:>9} {stats['max_ms']:>9} "
+                         f"{stats['errors']:>5} {stats['rejected']:>8}")
+        lines.append(f"{level['concurrency']:>5} {'total':>9} {level['requests']:>7} {level['throughput_rps']:>8} "
+                     f"error_rate={level['error_rate']} rejected_rate={level['rejected_rate']} tasks_completed={level['tasks_completed']}")
+    return "\n".join(lines)
+
+
+def _configure_environment(output_dir: str, api_key_count: int, log_level: str) -> list[str]:
+    """Đặt biến môi trường trước khi import app.* (config đọc môi trường lúc import)."""
+    api_keys = [f"{LOAD_TEST_API_KEY_PREFIX}{index}" for index in range(api_key_count)]
+    os.environ["VALID_API_KEYS"] = ",".join(api_keys)
+    os.environ["OUTPUT_DIR"] = output_dir
+    os.environ["STORAGE_BACKEND"] = "local"
+    os.environ["CELERY_BROKER_URL"] = "memory://"
+    os.environ["CELERY_RESULT_BACKEND_URL"] = "cache+memory://"
+    os.environ.setdefault("TRACING_ENABLED", "false")
+    os.environ["LOG_LEVEL"] = log_level
+    return api_keys
+
+
+def run_load_test(concurrency_levels: list[int], duration_seconds: float, workers: int, mix: dict[str, float],
+                  task_seconds: float, seconds_per_char: float, jitter: float, failure_rate: float,
+                  min_chars: int, max_chars: int, language: str, api_key_count: int, think_seconds: float,
+                  keep_rate_limits: bool, seed: int, log_level: str = "WARNING") -> list[dict]:
+    with tempfile.TemporaryDirectory(prefix="tts_load_test_") as output_dir:
+        api_keys = _configure_environment(output_dir, api_key_count, log_level)
+
+        try:
+            import fakeredis
+        except ImportError as e:
+            raise RuntimeError('Load test cần Redis giả lập trong bộ nhớ: pip install "fakeredis[lua]"') from e
+        from celery.contrib.testing.worker import start_worker
+        from app.infrastructure.redis_client import set_redis_client
+        from app.infrastructure.rate_limiter import RateLimits
+        from app.infrastructure.worker_registry import get_worker_registry
+        from app.config import XTTS_SAMPLE_RATE
+        from app.celery_app import celery_app
+        from app.application_services.tts_service import ApplicationTTSService
+        from app import api as api_module
+
+        set_redis_client(fakeredis.FakeRedis(decode_responses=True))
+        # Không import app.worker_health: worker giả lập không tải model và không warm-up
+        celery_app.conf.update(broker_url="memory://", result_backend="cache+memory://", imports=(), include=())
+
+        class _SimulatedApplicationService(ApplicationTTSService):
+            """Chỉ dùng các hàm parse tham số của ApplicationTTSService; không tải model trong process API."""
+
+            def __init__(self):
+                pass
+
+            def check_model_health(self, log_on_success=False) -> tuple[bool, str]:
+                return True, "Model giả lập (load test)."
+
+        api_module.tts_app_service = _SimulatedApplicationService()
+        if not keep_rate_limits:
+            api_module.rate_limiter.default_limits = RateLimits(0, 0)
+        api_module.fair_scheduler.ensure_dispatcher_thread()
+
+        simulated_synthesis = SimulatedSynthesis(
+            api_module.generate_tts_task, api_module.cost_estimator, task_seconds, seconds_per_char, jitter,
+            failure_rate, XTTS_SAMPLE_RATE, seed
+        )
+        api_module.generate_tts_task.run = simulated_synthesis
+
+        registry = get_worker_registry()
+        heartbeat_stop = threading.Event()
+
+        def publish_heartbeats():
+            while True:
+                registry.publish_heartbeat("loadtest@simulated", {"ready": True, "concurrency": workers,
+                                                                  "warmup_completed": True, "resident_models": ["default"]})
+                if heartbeat_stop.wait(registry.heartbeat_interval_seconds):
+                    return
+
+        threading.Thread(target=publish_heartbeats, name="loadtest-heartbeat", daemon=True).start()
+        runner = LoadTestRunner(api_module, simulated_synthesis, api_keys, mix, min_chars, max_chars,
+                                language, think_seconds, seed)
+        levels = []
+        try:
+            with start_worker(celery_app, pool="threads", concurrency=workers, perform_ping_check=False,
+                              loglevel=log_level, shutdown_timeout=30.0):
+                for concurrency in concurrency_levels:
+                    logger.warning(f"Load test: Mức concurrency {concurrency} trong {duration_seconds}s...")
+                    levels.append(runner.run_level(concurrency, duration_seconds))
+                    _drain_queues(celery_app, api_module)
+        finally:
+            heartbeat_stop.set()
+            api_module.fair_scheduler.stop()
+        return levels
+
+
+def _drain_queues(celery_app, api_module) -> None:
+    """Bỏ các task còn chờ để mức concurrency sau bắt đầu với hàng đợi rỗng (task đang chạy được để chạy nốt)."""
+    from app.infrastructure.redis_client import get_redis_client
+
+    redis_client = get_redis_client()
+    for key in redis_client.scan_iter("tts:fair:*"):
+        redis_client.delete(key)
+    celery_app.control.purge()
+    api_module.admission_controller._cached_queue_depth = None
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Đo tải HTTP API với worker Celery giả lập (broker/backend/Redis trong bộ nhớ).")
+    parser.add_argument("--concurrency", default="1,4,16,64", help="Các mức số client đồng thời, cách nhau bởi dấu phẩy.")
+    parser.add_argument("--duration", type=float, default=15.0, help="Số giây chạy mỗi mức.")
+    parser.add_argument("--workers", type=int, default=4, help="Số slot của worker giả lập (thread).")
+    parser.add_argument("--mix", default="submit=1,poll=8,download=1", help="Tỉ lệ thao tác, ví dụ 'submit=1,poll=8,download=1'.")
+    parser.add_argument("--task-seconds", type=float, default=0.2, help="Thời gian cố định của mỗi task giả lập.")
+    parser.add_argument("--seconds-per-char", type=float, default=0.002, help="Thời gian thêm cho mỗi ký tự văn bản.")
+    parser.add_argument("--jitter", type=float, default=0.25, help="Dao động tương đối của thời gian task (0.25 = ±25%%).")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Tỉ lệ task giả lập thất bại.")
+    parser.add_argument("--text-chars", default="50,600", help="Độ dài văn bản gửi lên: 'min,max' ký tự.")
+    parser.add_argument("--language", default="vi")
+    parser.add_argument("--api-keys", type=int, default=4, help="Số API key (client được chia đều), để thử lập lịch công bằng.")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Thời gian nghỉ của mỗi client giữa hai request.")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="Giữ hạn mức request/ký tự mỗi phút theo cấu hình.")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output-json", help="Ghi kết quả chi tiết ra file JSON.")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    min_chars, max_chars = (int(value) for value in args.text_chars.split(",", 1))
+    levels = run_load_test(
+        concurrency_levels=[int(value) for value in args.concurrency.split(",") if value.strip()],
+        duration_seconds=args.duration, workers=args.workers, mix=parse_mix(args.mix),
+        task_seconds=args.task_seconds, seconds_per_char=args.seconds_per_char, jitter=args.jitter,
+        failure_rate=args.failure_rate, min_chars=min_chars, max_chars=max_chars, language=args.language,
+        api_key_count=max(1, args.api_keys), think_seconds=args.think_ms / 1000.0,
+        keep_rate_limits=args.keep_rate_limits, seed=args.seed, log_level=args.log_level.upper(),
+    )
+    print(format_summary_table(levels))
+    if args.output_json:
+        with open(args.output_json, "w", encoding="utf-8") as f_out:
+            json.dump(levels, f_out, ensure_ascii=False, indent=2)
+    return 0 if all(level["error_rate"] in (None, 0) for level in levels) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
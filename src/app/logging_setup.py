@@ -0,0 +1,166 @@
+import os
+import json
+import queue
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from app.config import (
+    LOG_LEVEL, LOG_FORMAT, LOG_ASYNC, LOG_HOT_PATH_SAMPLE_RATE, LOG_HOT_PATH_MAX_PER_SECOND,
+)
+from app.metrics import metrics
+from app.tracing import current_trace_id
+
+TEXT_LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(module)s.%(funcName)s:%(lineno)d] - %(message)s'
+HOT_PATH_LOGGER_SUFFIX = ".hot_path"
+
+
+class JsonLogFormatter(logging.Formatter):
+    """Mỗi record một dòng JSON (ts, level, logger, message, vị trí code, process, trace_id nếu có, exc_info)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "func": record.funcName,
+            "line": record.lineno,
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            entry["trace_id"] = trace_id
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class AsyncQueueHandler(QueueHandler):
+    """
+    Đưa record vào hàng đợi; QueueListener ghi ra các handler thật trên một thread nền. Khác QueueHandler gốc,
+    message không được format ở thread gọi log (chỉ traceback được render ngay vì nó giữ tham chiếu tới frame),
+    nên việc ghép chuỗi và I/O đều nằm ngoài hot path. Listener được khởi động lại theo pid (process con prefork).
+    """
+
+    def __init__(self, target_handlers: list[logging.Handler]):
+        super().__init__(queue.SimpleQueue())
+        self.target_handlers = list(target_handlers)
+        self._listener: QueueListener | None = None
+        self._pid = None
+        self._listener_lock = threading.Lock()
+        self._start_listener()
+
+    def _start_listener(self) -> None:
+        self.queue = queue.SimpleQueue()
+        self._listener = QueueListener(self.queue, *self.target_handlers, respect_handler_level=True)
+        self._listener.start()
+        self._pid = os.getpid()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.trace_id = current_trace_id()
+        return record
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self._pid != os.getpid():
+            with self._listener_lock:
+                if self._pid != os.getpid():
+                    self._start_listener()
+        super().emit(record)
+
+    def flush_and_stop(self) -> None:
+        """Ghi nốt các record trong hàng đợi (process con prefork thoát bằng os._exit nên không qua logging.shutdown)."""
+        with self._listener_lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+                self._listener = None
+
+    def close(self) -> None:
+        self.flush_and_stop()
+        super().close()
+
+
+class HotPathSamplingFilter(logging.Filter):
+    """
+    Lấy mẫu log INFO/DEBUG trên hot path: giữ 1 trên mỗi round(1 / sample_rate) record và tối đa
+    `max_per_second` record mỗi giây. WARNING trở lên luôn được giữ.
+    """
+
+    def __init__(self, sample_rate: float = LOG_HOT_PATH_SAMPLE_RATE, max_per_second: int = LOG_HOT_PATH_MAX_PER_SECOND):
+        super().__init__()
+        self.sample_every = max(1, round(1.0 / sample_rate)) if sample_rate > 0 else 0
+        self.max_per_second = max_per_second
+        self._seen = 0
+        self._window_started_at = 0.0
+        self._window_count = 0
+        self._lock = threading.Lock()
+
+    def _accept(self) -> bool:
+        with self._lock:
+            self._seen += 1
+            if self.sample_every == 0 or (self._seen - 1) % self.sample_every:
+                return False
+            if self.max_per_second > 0:
+                now = time.monotonic()
+                if now - self._window_started_at >= 1.0:
+                    self._window_started_at = now
+                    self._window_count = 0
+                if self._window_count >= self.max_per_second:
+                    return False
+                self._window_count += 1
+            return True
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self._accept():
+            return True
+        metrics.increment("tts_log_records_sampled_out_total")
+        return False
+
+
+def get_hot_path_logger(name: str) -> logging.Logger:
+    """Logger con `<name>.hot_path` cho các log lặp lại theo từng câu / từng bước, được lấy mẫu theo cấu hình."""
+    hot_path_logger = logging.getLogger(f"{name}{HOT_PATH_LOGGER_SUFFIX}")
+    if not any(isinstance(f, HotPathSamplingFilter) for f in hot_path_logger.filters):
+        hot_path_logger.addFilter(HotPathSamplingFilter())
+    return hot_path_logger
+
+
+def configure_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT, use_async: bool = LOG_ASYNC) -> None:
+    """
+    Cấu hình root logger. Các handler đã có (ví dụ handler Celery tạo cho worker) được giữ lại và đặt sau
+    hàng đợi; nếu chưa có handler nào thì tạo một StreamHandler. Gọi lại nhiều lần không tạo handler trùng.
+    """
+    root_logger = logging.getLogger()
+    root_logger.setLevel(level)
+    existing_async_handler = next((h for h in root_logger.handlers if isinstance(h, AsyncQueueHandler)), None)
+    if existing_async_handler is not None:
+        return
+
+    target_handlers = list(root_logger.handlers) or [logging.StreamHandler()]
+    formatter = JsonLogFormatter() if log_format == "json" else None
+    for handler in target_handlers:
+        if formatter is not None:
+            handler.setFormatter(formatter)
+        elif handler.formatter is None:
+            handler.setFormatter(logging.Formatter(TEXT_LOG_FORMAT))
+
+    if not use_async:
+        root_logger.handlers = target_handlers
+        return
+    root_logger.handlers = [AsyncQueueHandler(target_handlers)]
+
+
+def flush_logging() -> None:
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, AsyncQueueHandler):
+            handler.flush_and_stop()
@@ -0,0 +1,72 @@
+import threading
+import time
+
+
+def _series_name(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    label_str = ",".join(f'{key}="{labels[key]}"' for key in sorted(labels))
+    return f"{name}{{{label_str}}}"
+
+
+class MetricsRegistry:
+    """
+    Bộ đếm số liệu trong process (counter, gauge, summary), an toàn đa luồng.
+    Mỗi process (API, worker) có registry riêng; snapshot() trả về dict để xuất qua JSON.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = {}
+        self._gauges: dict[str, float] = {}
+        self._summaries: dict[str, dict] = {}
+        self._flushed_counters: dict[str, float] = {}
+        self._started_at = time.time()
+
+    def increment(self, name: str, value: float = 1.0, **labels) -> None:
+        series = _series_name(name, labels)
+        with self._lock:
+            self._counters[series] = self._counters.get(series, 0.0) + value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        series = _series_name(name, labels)
+        with self._lock:
+            self._gauges[series] = float(value)
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        series = _series_name(name, labels)
+        with self._lock:
+            summary = self._summaries.get(series)
+            if summary is None:
+                summary = self._summaries[series] = {"count": 0, "sum": 0.0, "min": value, "max": value}
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["min"] = min(summary["min"], value)
+            summary["max"] = max(summary["max"], value)
+
+    def get_counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(_series_name(name, labels), 0.0)
+
+    def pop_counter_deltas(self) -> dict[str, float]:
+        """Trả về phần tăng của các counter kể từ lần gọi trước (dùng để cộng dồn counter của nhiều process)."""
+        with self._lock:
+            deltas = {
+                series: value - self._flushed_counters.get(series, 0.0)
+                for series, value in self._counters.items()
+                if value != self._flushed_counters.get(series, 0.0)
+            }
+            self._flushed_counters = dict(self._counters)
+        return deltas
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "uptime_seconds": round(time.time() - self._started_at, 3),
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "summaries": {series: dict(summary) for series, summary in self._summaries.items()},
+            }
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,84 @@
+import io
+import os
+import time
+import pstats
+import cProfile
+import logging
+import zipfile
+import tempfile
+
+from app.config import PROFILING_TORCH_ENABLED, PROFILING_TORCH_RECORD_SHAPES
+from app.infrastructure.storage import ResultStorage, profile_key
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilingSession:
+    """
+    Chạy một đoạn code dưới cProfile và torch profiler (các op CPU), rồi đóng gói kết quả thành một file zip:
+    cprofile.pstats (mở bằng snakeviz/pstats), cprofile.txt, torch_trace.json (chrome://tracing, Perfetto)
+    và torch_ops.txt (bảng op tốn thời gian nhất).
+    """
+
+    def __init__(self, task_id: str, torch_enabled: bool = PROFILING_TORCH_ENABLED,
+                 record_shapes: bool = PROFILING_TORCH_RECORD_SHAPES):
+        self.task_id = task_id
+        self.torch_enabled = torch_enabled
+        self.record_shapes = record_shapes
+        self._cprofile = cProfile.Profile()
+        self._torch_profiler = None
+        self._started_at = None
+        self.wall_seconds = None
+
+    def __enter__(self) -> "ProfilingSession":
+        if self.torch_enabled:
+            try:
+                from torch.profiler import profile, ProfilerActivity
+                self._torch_profiler = profile(activities=[ProfilerActivity.CPU], record_shapes=self.record_shapes)
+                self._torch_profiler.__enter__()
+            except Exception as e_torch:
+                logger.warning(f"Profiling [{self.task_id}]: Không bật được torch profiler: {e_torch}")
+                self._torch_profiler = None
+        self._started_at = time.perf_counter()
+        self._cprofile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._cprofile.disable()
+        self.wall_seconds = time.perf_counter() - self._started_at
+        if self._torch_profiler is not None:
+            self._torch_profiler.__exit__(None, None, None)
+        metrics.increment("tts_profiled_tasks_total")
+
+    def _build_archive(self) -> io.BytesIO:
+        archive = io.BytesIO()
+        with tempfile.TemporaryDirectory(prefix="tts_profile_") as tmp_dir, \
+                zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+            pstats_path = os.path.join(tmp_dir, "cprofile.pstats")
+            self._cprofile.dump_stats(pstats_path)
+            zip_file.write(pstats_path, "cprofile.pstats")
+
+            summary = io.StringIO()
+            summary.write(f"task_id: {self.task_id}\nwall_seconds: {self.wall_seconds:.3f}\n\n")
+            pstats.Stats(self._cprofile, stream=summary).sort_stats("cumulative").print_stats(60)
+            zip_file.writestr("cprofile.txt", summary.getvalue())
+
+            if self._torch_profiler is not None:
+                trace_path = os.path.join(tmp_dir, "torch_trace.json")
+                self._torch_profiler.export_chrome_trace(trace_path)
+                zip_file.write(trace_path, "torch_trace.json")
+                zip_file.writestr("torch_ops.txt", self._torch_profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=50))
+        archive.seek(0)
+        return archive
+
+    def save(self, storage: ResultStorage) -> str | None:
+        """Lưu file zip vào storage (profiles/<task_id>.zip). Lỗi khi lưu không làm hỏng task."""
+        key = profile_key(self.task_id)
+        try:
+            storage.save_stream(key, self._build_archive(), content_type="application/zip")
+            logger.info(f"Profiling [{self.task_id}]: Đã lưu kết quả profiling vào storage với key: {key}")
+            return key
+        except Exception as e_save:
+            logger.error(f"Profiling [{self.task_id}]: Không lưu được kết quả profiling: {e_save}", exc_info=True)
+            return None
@@ -1,13 +1,25 @@
 import os
-import tempfile
+import time
 import logging
 import torch
+from contextlib import nullcontext, ExitStack
+from celery.exceptions import SoftTimeLimitExceeded, Ignore
 from app.celery_app import celery_app 
 from app.config import (
-    OUTPUT_DIR, DEFAULT_SPEAKER_WAV_PATH, XTTS_SAMPLE_RATE,
+    DEFAULT_SPEAKER_WAV_PATH, XTTS_SAMPLE_RATE, DEFAULT_TTS_PARAMS, DEFAULT_AUDIO_POSTPROCESSING_PARAMS,
+    WORKER_WARMUP_ENABLED, WORKER_WARMUP_LANGUAGES, WORKER_WARMUP_RUNS, WORKER_WARMUP_TEXTS,
+    DEFAULT_MODEL_ID, TTS_CHECKPOINTS_ENABLED, TTS_SOFT_TIME_LIMIT_MAX_RETRIES,
 )
 
-from app.domain.services.speech_synthesis_service import SpeechSynthesisService
+from app.domain.services.speech_synthesis_service import SpeechSynthesisService, SynthesisCancelledError
+from app.domain.model_registry import ModelRegistry, model_queue_name
+from app.infrastructure.storage import get_storage, result_key
+from app.infrastructure.synthesis_checkpoints import SynthesisCheckpointStore, synthesis_fingerprint
+from app.infrastructure.task_cancellation import get_task_cancellation
+from app.infrastructure.worker_registry import get_worker_registry
+from app.metrics import metrics
+from app.profiling import ProfilingSession
+from app.tracing import tracer, TRACEPARENT_HEADER, ENQUEUED_AT_HEADER
 
 logger = logging.getLogger(__name__)
 
@@ -20,7 +32,7 @@ class WorkerServices:
             cls._instance = super(WorkerServices, cls).__new__(cls)
         return cls._instance
 
-    def __init__(self):
+    def __init__(self, warm_up: bool = True):
         if WorkerServices._initialized_flag:
             return
 
@@ -29,20 +41,141 @@ class WorkerServices:
         from app.domain.services.text_processor import TextProcessor
         from app.domain.services.audio_postprocessor import AudioPostprocessorService
 
+        self.hostname: str | None = None
         self.tts_model: TTSModel = TTSModel() 
         if not self.tts_model.is_loaded():
             logger.critical("Celery Task Worker: MODEL KHÔNG THỂ TẢI! Worker này có thể không xử lý được task.")
 
+        self.model_registry = ModelRegistry(
+            on_model_loaded=self._on_model_loaded, on_model_evicted=self._on_model_evicted
+        )
+        self.model_registry.adopt(DEFAULT_MODEL_ID, self.tts_model)
+
         self.text_processor: TextProcessor = TextProcessor()
         self.audio_postprocessor: AudioPostprocessorService = AudioPostprocessorService(sample_rate=XTTS_SAMPLE_RATE)
         
         self.synthesis_service: SpeechSynthesisService = SpeechSynthesisService(
-            self.tts_model, self.text_processor, self.audio_postprocessor
+            self.tts_model, self.text_processor, self.audio_postprocessor, model_registry=self.model_registry,
+            fatal_exceptions=(SoftTimeLimitExceeded,)
         )
+
+        self.warmup_completed = False
+        self.warmup_seconds: float | None = None
+        self.warmup_pid: int | None = None
+        if warm_up:
+            self._warm_up()
         
         WorkerServices._initialized_flag = True
         logger.info("Celery Task Worker: Services initialized successfully for this worker process.")
 
+    def warm_up_process(self) -> None:
+        """
+        Warm-up trong process hiện tại nếu chưa làm. Với pool prefork, task chạy trong process con; trạng thái CUDA,
+        autotune cuDNN và bộ nhớ đã cấp phát của process cha không được dùng lại, nên mỗi process con tự warm-up.
+        """
+        if self.warmup_pid == os.getpid():
+            return
+        self.warmup_completed = False
+        self.warmup_seconds = None
+        self._warm_up()
+
+    def _warm_up(self):
+        """
+        Chạy một số lần tổng hợp giả cho các ngôn ngữ được bật và tính trước latents của giọng mặc định,
+        để task đầu tiên không phải trả chi phí khởi động (autotune cuDNN, cấp phát bộ nhớ, tokenizer...).
+        """
+        self.warmup_pid = os.getpid()
+        if not WORKER_WARMUP_ENABLED:
+            logger.info("Celery Task Worker: Warm-up bị tắt (WORKER_WARMUP_ENABLED=false).")
+            self.warmup_completed = True
+            return
+        if not self.tts_model.is_loaded():
+            logger.error("Celery Task Worker: Bỏ qua warm-up vì model chưa được tải.")
+            return
+
+        warmup_started_at = time.perf_counter()
+        try:
+            if os.path.exists(DEFAULT_SPEAKER_WAV_PATH):
+                self.tts_model.precompute_speaker_latents(DEFAULT_SPEAKER_WAV_PATH)
+            else:
+                logger.warning(f"Celery Task Worker: Không có giọng mẫu mặc định để warm-up: {DEFAULT_SPEAKER_WAV_PATH}")
+                return
+
+            for language_code in WORKER_WARMUP_LANGUAGES:
+                warmup_text = WORKER_WARMUP_TEXTS.get(language_code, WORKER_WARMUP_TEXTS["en"])
+                for run_index in range(WORKER_WARMUP_RUNS):
+                    language_started_at = time.perf_counter()
+                    _, error_msg = self.synthesis_service.synthesize(
+                        full_text_input=warmup_text,
+                        language_code=language_code,
+                        speaker_audio_path=DEFAULT_SPEAKER_WAV_PATH,
+                        apply_text_normalization=(language_code == "vi"),
+                        synthesis_model_params=DEFAULT_TTS_PARAMS,
+                        audio_postproc_params=DEFAULT_AUDIO_POSTPROCESSING_PARAMS
+                    )
+                    if error_msg:
+                        logger.warning(f"Celery Task Worker: Warm-up '{language_code}' lần {run_index + 1} lỗi: {error_msg}")
+                    else:
+                        logger.info(f"Celery Task Worker: Warm-up '{language_code}' lần {run_index + 1} mất {time.perf_counter() - language_started_at:.2f}s.")
+
+            self.warmup_completed = True
+        except Exception as e_warmup:
+            logger.error(f"Celery Task Worker: Lỗi trong quá trình warm-up: {e_warmup}", exc_info=True)
+        finally:
+            self.warmup_seconds = round(time.perf_counter() - warmup_started_at, 3)
+            self.tts_model.clear_gpu_cache()
+            metrics.set_gauge("tts_worker_warmup_seconds", self.warmup_seconds)
+            metrics.set_gauge("tts_worker_warmup_completed", 1 if self.warmup_completed else 0)
+            logger.info(f"Celery Task Worker: Warm-up kết thúc sau {self.warmup_seconds}s (hoàn tất: {self.warmup_completed}).")
+
+    def publish_resident_models(self) -> None:
+        if not self.hostname:
+            return
+        try:
+            get_worker_registry().set_resident_models(self.hostname, os.getpid(), self.model_registry.resident_model_ids())
+        except Exception as e_publish:
+            logger.warning(f"Celery Task Worker: Không ghi được danh sách model đang tải vào worker registry: {e_publish}")
+
+    def _on_model_loaded(self, model_id: str) -> None:
+        """Sau khi tải một checkpoint, nhận thêm task từ queue riêng của model đó."""
+        self.publish_resident_models()
+        if model_id == DEFAULT_MODEL_ID or not self.hostname:
+            return
+        celery_app.control.add_consumer(model_queue_name(model_id), destination=[self.hostname])
+        logger.info(f"Celery Task Worker: Bắt đầu nhận task từ queue '{model_queue_name(model_id)}'.")
+
+    def _on_model_evicted(self, model_id: str) -> None:
+        """Model bị giải phóng: ngừng nhận task từ queue của model nếu không còn process nào của worker giữ nó."""
+        self.publish_resident_models()
+        if model_id == DEFAULT_MODEL_ID or not self.hostname:
+            return
+        if model_id in get_worker_registry().get_resident_models(self.hostname):
+            return
+        celery_app.control.cancel_consumer(model_queue_name(model_id), destination=[self.hostname])
+        logger.info(f"Celery Task Worker: Ngừng nhận task từ queue '{model_queue_name(model_id)}'.")
+
+    def release_process_models(self) -> None:
+        """Gọi khi process kết thúc: giải phóng các model tải thêm và xóa process khỏi danh sách model của worker."""
+        for model_id in self.model_registry.resident_model_ids():
+            if model_id not in self.model_registry.pinned_model_ids:
+                self.model_registry.evict(model_id)
+        if self.hostname:
+            get_worker_registry().set_resident_models(self.hostname, os.getpid(), [])
+
+    def is_ready(self) -> bool:
+        return self.tts_model.is_loaded() and self.warmup_completed
+
+    def health_snapshot(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "model_loaded": self.tts_model.is_loaded(),
+            "warmup_completed": self.warmup_completed,
+            "warmup_seconds": self.warmup_seconds,
+            "ready": self.is_ready(),
+            "model_pool": self.model_registry.snapshot(),
+            "metrics": metrics.snapshot()
+        }
+
     def get_synthesis_service(self) -> SpeechSynthesisService:
         if not hasattr(self, 'synthesis_service') or not self.tts_model.is_loaded():
             logger.error("Celery Task Worker: Cố gắng lấy synthesis_service nhưng nó chưa được khởi tạo đúng hoặc model lỗi.")
@@ -55,77 +188,227 @@ class WorkerServices:
 
         return self.synthesis_service
 
-worker_services_instance = WorkerServices()
+worker_services_instance: WorkerServices | None = None
+
+def get_worker_services(warm_up: bool = True) -> WorkerServices:
+    """
+    Khởi tạo WorkerServices (tải model + warm-up) khi cần. Trong worker Celery, việc này được gọi
+    từ signal worker_init nên diễn ra trước khi worker bắt đầu nhận task; với pool prefork, warm-up
+    được bỏ qua ở process chính và chạy trong từng process con (worker_process_init).
+    """
+    global worker_services_instance
+    if worker_services_instance is None:
+        worker_services_instance = WorkerServices(warm_up=warm_up)
+    return worker_services_instance
+
+
+def _trace_header(request, name: str):
+    """Header tùy chỉnh của message (traceparent...), tùy phiên bản Celery nằm trực tiếp trên request hoặc trong request.headers."""
+    return request.get(name) or (request.get("headers") or {}).get(name)
 
 
 @celery_app.task(bind=True, name='app.tasks.generate_tts_task', acks_late=True, reject_on_worker_lost=True)
 def generate_tts_task(self, 
                       text_input: str,
                       language_code: str,
-                      speaker_audio_temp_path_or_flag: str,
+                      speaker_audio_key_or_flag: str | None = None,
+                      *,
                       apply_text_normalization: bool,
                       synthesis_model_params: dict,
-                      audio_postproc_params: dict) -> dict: 
+                      audio_postproc_params: dict,
+                      model_id: str | None = None,
+                      profile: bool = False,
+                      speaker_name: str | None = None,
+                      speaker_audio_temp_path_or_flag: str | None = None) -> dict: 
+    """
+    `speaker_audio_temp_path_or_flag` là tên tham số cũ (trước khi có storage): message còn trong broker khi triển khai
+    phiên bản mới mang đường dẫn tuyệt đối của file giọng mẫu tạm trên đĩa chung thay vì storage key.
+    """
     task_id = self.request.id or "unknown_task_id"
-    logger.info(f"CeleryTask [{task_id}]: Bắt đầu xử lý. Lang='{language_code}', Text='{text_input[:50]}...'")
+    logger.info("CeleryTask [%s]: Bắt đầu xử lý. Lang='%s', Model='%s', Text='%.50s...'", task_id, language_code, model_id or DEFAULT_MODEL_ID, text_input)
+
+    storage = get_storage()
+    uploaded_speaker_key_to_delete = None
+    legacy_speaker_path_to_delete = None
+    checkpoint = None
+    retrying = False
+    profiling_session = ProfilingSession(task_id) if profile else None
 
-    temp_speaker_file_to_delete_by_worker = None
+    trace_parent = tracer.extract_parent(_trace_header(self.request, TRACEPARENT_HEADER))
+    enqueued_at = _trace_header(self.request, ENQUEUED_AT_HEADER)
+    if enqueued_at and not self.request.retries:
+        tracer.record_span("celery.broker_wait", float(enqueued_at), time.time(), parent=trace_parent, task_id=task_id)
+    span_stack = ExitStack()
+    task_span = span_stack.enter_context(tracer.span(
+        "worker.generate_tts_task", parent=trace_parent, task_id=task_id, language=language_code,
+        model_id=model_id or DEFAULT_MODEL_ID, text_chars=len(text_input), retries=self.request.retries
+    ))
 
+    is_cancelled = get_task_cancellation().cancel_checker(task_id) if self.request.id else None
     try:
-        synthesis_service = worker_services_instance.get_synthesis_service()
+        if is_cancelled is not None and is_cancelled():
+            # bị hủy khi còn trong queue (worker chưa nhận được lệnh revoke, hoặc worker khởi động sau lệnh revoke)
+            raise SynthesisCancelledError(0, 0)
 
-        actual_speaker_audio_path = ""
-        if speaker_audio_temp_path_or_flag == "USE_DEFAULT_SPEAKER":
-            actual_speaker_audio_path = DEFAULT_SPEAKER_WAV_PATH
-            logger.info(f"CeleryTask [{task_id}]: Sử dụng giọng mẫu mặc định: {actual_speaker_audio_path}")
+        with tracer.span("worker.get_services"):
+            worker_services = get_worker_services()
+            if not worker_services.hostname and self.request.hostname:
+                worker_services.hostname = self.request.hostname
+            synthesis_service = worker_services.get_synthesis_service()
+
+        if speaker_name:
+            # latents của giọng có sẵn đã nằm trong model (speakers_xtts.pth), không cần file giọng mẫu
+            speaker_path_context = nullcontext(None)
+            logger.info("CeleryTask [%s]: Sử dụng giọng có sẵn: %s", task_id, speaker_name)
+        elif (speaker_audio_key_or_flag or speaker_audio_temp_path_or_flag) == "USE_DEFAULT_SPEAKER":
+            speaker_path_context = nullcontext(DEFAULT_SPEAKER_WAV_PATH)
+            logger.info("CeleryTask [%s]: Sử dụng giọng mẫu mặc định: %s", task_id, DEFAULT_SPEAKER_WAV_PATH)
+        elif speaker_audio_key_or_flag is None and speaker_audio_temp_path_or_flag:
+            speaker_path_context = nullcontext(speaker_audio_temp_path_or_flag)
+            legacy_speaker_path_to_delete = speaker_audio_temp_path_or_flag
+            speaker_audio_key_or_flag = speaker_audio_temp_path_or_flag  # cho fingerprint của checkpoint
+            logger.info("CeleryTask [%s]: Message cũ, sử dụng giọng mẫu tạm trên đĩa: %s", task_id, speaker_audio_temp_path_or_flag)
+        elif speaker_audio_key_or_flag is None:
+            raise ValueError("Thiếu speaker_audio_key_or_flag trong tham số của task.")
         else:
-            actual_speaker_audio_path = speaker_audio_temp_path_or_flag
-            temp_speaker_file_to_delete_by_worker = actual_speaker_audio_path
-            logger.info(f"CeleryTask [{task_id}]: Sử dụng giọng mẫu tải lên (đã lưu tạm): {actual_speaker_audio_path}")
-
-        if not os.path.exists(actual_speaker_audio_path):
-            logger.error(f"CeleryTask [{task_id}]: File giọng mẫu '{actual_speaker_audio_path}' không tồn tại.")
-            raise FileNotFoundError(f"File giọng mẫu không tồn tại trong worker: {actual_speaker_audio_path}")
-
-        audio_output_obj, error_msg = synthesis_service.synthesize(
-            full_text_input=text_input,
-            language_code=language_code,
-            speaker_audio_path=actual_speaker_audio_path,
-            apply_text_normalization=apply_text_normalization,
-            synthesis_model_params=synthesis_model_params,
-            audio_postproc_params=audio_postproc_params
-        )
+            speaker_path_context = storage.fetch_to_local_file(speaker_audio_key_or_flag)
+            uploaded_speaker_key_to_delete = speaker_audio_key_or_flag
+            logger.info("CeleryTask [%s]: Sử dụng giọng mẫu tải lên (storage key): %s", task_id, speaker_audio_key_or_flag)
+
+        if TTS_CHECKPOINTS_ENABLED and self.request.id:
+            checkpoint = SynthesisCheckpointStore(storage, task_id, synthesis_fingerprint(
+                text_input=text_input, language_code=language_code,
+                speaker=f"preset:{speaker_name}" if speaker_name else speaker_audio_key_or_flag,
+                apply_text_normalization=apply_text_normalization, synthesis_model_params=synthesis_model_params,
+                model_id=model_id or DEFAULT_MODEL_ID
+            ))
+            try:
+                with tracer.span("worker.checkpoint_prepare") as checkpoint_span:
+                    checkpoint_span.set_attribute("resumable_segments", checkpoint.prepare())
+            except Exception as e_checkpoint:
+                logger.warning(f"CeleryTask [{task_id}]: Không dùng được checkpoint, tổng hợp không checkpoint: {e_checkpoint}")
+                checkpoint = None
+
+        synthesis_started_at = time.perf_counter()
+
+        def publish_progress(progress: dict) -> None:
+            """Đẩy tiến độ lên result backend (state PROGRESS); thời gian còn lại ước lượng theo tốc độ ký tự của lần chạy này."""
+            if not self.request.id:
+                return
+            elapsed_seconds = time.perf_counter() - synthesis_started_at
+            remaining_chars = progress["chars_total"] - progress["chars_done"]
+            estimated_remaining_seconds = (
+                round(elapsed_seconds / progress["synthesized_chars"] * remaining_chars, 1)
+                if progress["synthesized_chars"] else None
+            )
+            self.update_state(state="PROGRESS", meta={
+                **progress,
+                "elapsed_seconds": round(elapsed_seconds, 1),
+                "estimated_remaining_seconds": estimated_remaining_seconds,
+                "partial_available": checkpoint is not None,
+            })
+
+        if profiling_session is not None:
+            logger.info(f"CeleryTask [{task_id}]: Bật profiling (cProfile + torch profiler) cho task này.")
+        with profiling_session or nullcontext(), speaker_path_context as actual_speaker_audio_path:
+            if actual_speaker_audio_path is not None and not os.path.exists(actual_speaker_audio_path):
+                logger.error(f"CeleryTask [{task_id}]: File giọng mẫu '{actual_speaker_audio_path}' không tồn tại.")
+                raise FileNotFoundError(f"File giọng mẫu không tồn tại trong worker: {actual_speaker_audio_path}")
+
+            with tracer.span("worker.synthesize"):
+                audio_output_obj, error_msg = synthesis_service.synthesize(
+                    full_text_input=text_input,
+                    language_code=language_code,
+                    speaker_audio_path=actual_speaker_audio_path,
+                    apply_text_normalization=apply_text_normalization,
+                    synthesis_model_params=synthesis_model_params,
+                    audio_postproc_params=audio_postproc_params,
+                    model_id=model_id,
+                    checkpoint=checkpoint,
+                    progress_callback=publish_progress,
+                    speaker_name=speaker_name,
+                    cancel_check=is_cancelled
+                )
 
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
-            logger.debug(f"CeleryTask [{task_id}]: GPU cache cleared.")
+            logger.debug("CeleryTask [%s]: GPU cache cleared.", task_id)
 
         if error_msg:
             logger.error(f"CeleryTask [{task_id}]: Lỗi từ SpeechSynthesisService: {error_msg}")
             raise Exception(error_msg) 
 
         if audio_output_obj and audio_output_obj.audio_data:
-            if not os.path.exists(OUTPUT_DIR):
-                os.makedirs(OUTPUT_DIR, exist_ok=True)
-            
-            saved_audio_path = os.path.join(OUTPUT_DIR, audio_output_obj.filename)
+            output_key = result_key(audio_output_obj.filename)
+            audio_output_obj.audio_data.seek(0)
+            with tracer.span("worker.save_result", storage_key=output_key):
+                storage.save_stream(output_key, audio_output_obj.audio_data, content_type=audio_output_obj.mimetype)
             
-            with open(saved_audio_path, "wb") as f_out:
-                f_out.write(audio_output_obj.audio_data.getbuffer())
-            
-            logger.info(f"CeleryTask [{task_id}]: Thành công! Âm thanh đã được lưu tại: {saved_audio_path}")
-            return {"status": "SUCCESS", "file_path": saved_audio_path, "filename": audio_output_obj.filename}
+            logger.info("CeleryTask [%s]: Thành công! Âm thanh đã được lưu vào storage với key: %s", task_id, output_key)
+            worker_seconds = time.perf_counter() - synthesis_started_at
+            metrics.observe("tts_task_worker_seconds", worker_seconds)
+            if self.request.hostname:
+                try:
+                    get_worker_registry().record_task_timing(self.request.hostname, worker_seconds, audio_output_obj.duration_seconds)
+                except Exception as e_record:
+                    logger.warning(f"CeleryTask [{task_id}]: Không ghi được thời gian xử lý vào worker registry: {e_record}")
+            return {
+                "status": "SUCCESS",
+                "storage_key": output_key,
+                "filename": audio_output_obj.filename,
+                "metrics": {
+                    "language": language_code,
+                    "model_id": model_id or DEFAULT_MODEL_ID,
+                    "text_chars": len(text_input),
+                    "sentence_count": audio_output_obj.sentence_count,
+                    "audio_seconds": round(audio_output_obj.duration_seconds, 3),
+                    "worker_seconds": round(worker_seconds, 3),
+                    "resumed_sentences": checkpoint.resumed_count if checkpoint is not None else 0
+                },
+                "profiled": profiling_session is not None
+            }
         else:
             logger.error(f"CeleryTask [{task_id}]: SpeechSynthesisService không trả về dữ liệu âm thanh.")
             raise Exception("Không tạo được dữ liệu âm thanh.")
 
+    except SynthesisCancelledError as e_cancelled:
+        stage = "running" if e_cancelled.sentences_total else "queued"
+        task_span.set_attributes(cancelled=True, cancel_stage=stage)
+        metrics.increment("tts_tasks_cancelled_total", stage=stage)
+        if e_cancelled.sentences_total:
+            metrics.observe("tts_cancelled_sentences_skipped", e_cancelled.sentences_total - e_cancelled.sentences_done)
+        logger.info(f"CeleryTask [{task_id}]: Task bị hủy theo yêu cầu ({stage}, {e_cancelled.sentences_done}/{e_cancelled.sentences_total} câu).")
+        self.backend.mark_as_revoked(task_id, reason="cancelled", request=self.request)
+        # trạng thái REVOKED đã được ghi; Ignore để Celery không ghi đè thành FAILURE
+        raise Ignore()
+    except SoftTimeLimitExceeded as e_soft_limit:
+        task_span.record_exception(e_soft_limit)
+        if checkpoint is not None and self.request.retries < TTS_SOFT_TIME_LIMIT_MAX_RETRIES:
+            retrying = True
+            metrics.increment("tts_task_soft_time_limit_retries_total")
+            logger.warning(f"CeleryTask [{task_id}]: Vượt soft time limit, retry lần {self.request.retries + 1} và tiếp tục từ checkpoint.")
+            raise self.retry(exc=e_soft_limit, countdown=0, max_retries=TTS_SOFT_TIME_LIMIT_MAX_RETRIES)
+        logger.critical(f"CeleryTask [{task_id}]: Vượt soft time limit, không retry thêm.")
+        raise
     except Exception as e: 
+        task_span.record_exception(e)
         logger.critical(f"CeleryTask [{task_id}]: Lỗi nghiêm trọng không xử lý được: {e}", exc_info=True)
         raise 
     finally:
-        if temp_speaker_file_to_delete_by_worker and os.path.exists(temp_speaker_file_to_delete_by_worker):
+        if profiling_session is not None and profiling_session.wall_seconds is not None:
+            profiling_session.save(storage)
+        if checkpoint is not None and not retrying:
+            checkpoint.clear()
+        if uploaded_speaker_key_to_delete and not retrying:
+            try:
+                storage.delete(uploaded_speaker_key_to_delete)
+                logger.info("CeleryTask [%s]: Đã dọn dẹp file giọng mẫu tạm: %s", task_id, uploaded_speaker_key_to_delete)
+            except Exception as e_remove:
+                logger.error(f"CeleryTask [{task_id}]: Lỗi khi dọn dẹp file giọng mẫu tạm '{uploaded_speaker_key_to_delete}': {e_remove}")
+        if legacy_speaker_path_to_delete and not retrying and os.path.exists(legacy_speaker_path_to_delete):
             try:
-                os.remove(temp_speaker_file_to_delete_by_worker)
-                logger.info(f"CeleryTask [{task_id}]: Đã dọn dẹp file giọng mẫu tạm: {temp_speaker_file_to_delete_by_worker}")
+                os.remove(legacy_speaker_path_to_delete)
+                logger.info("CeleryTask [%s]: Đã dọn dẹp file giọng mẫu tạm: %s", task_id, legacy_speaker_path_to_delete)
             except OSError as e_remove:
-                logger.error(f"CeleryTask [{task_id}]: Lỗi khi dọn dẹp file giọng mẫu tạm '{temp_speaker_file_to_delete_by_worker}': {e_remove}")
\ No newline at end of file
+                logger.error(f"CeleryTask [{task_id}]: Lỗi khi dọn dẹp file giọng mẫu tạm '{legacy_speaker_path_to_delete}': {e_remove}")
+        span_stack.close()
@@ -0,0 +1,332 @@
+import os
+import json
+import time
+import queue
+import atexit
+import socket
+import logging
+import secrets
+import threading
+import urllib.request
+from abc import ABC, abstractmethod
+from contextvars import ContextVar
+from typing import NamedTuple
+
+from app.config import (
+    TRACING_ENABLED, TRACING_EXPORTER, TRACING_SERVICE_NAME, TRACING_FILE_PATH,
+    TRACING_OTLP_ENDPOINT, TRACING_EXPORT_BATCH_SIZE, TRACING_EXPORT_INTERVAL_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT_HEADER = "traceparent"
+# Thời điểm API gửi task vào broker (epoch giây), để worker tính thời gian chờ trong hàng đợi
+ENQUEUED_AT_HEADER = "trace_enqueued_at"
+
+
+class SpanContext(NamedTuple):
+    trace_id: str
+    span_id: str
+
+
+_current_span: ContextVar["Span | None"] = ContextVar("current_span", default=None)
+
+
+def current_trace_id() -> str | None:
+    """trace_id của span hiện tại (nếu có), để gắn vào log."""
+    current = _current_span.get()
+    return current.context.trace_id if current is not None else None
+
+
+class Span:
+    """Một khoảng thời gian được đặt tên trong trace. Dùng như context manager: span trở thành span hiện tại trong `with`."""
+
+    __slots__ = ("tracer", "name", "context", "parent_span_id", "attributes",
+                 "start_time_ns", "end_time_ns", "error", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, parent: SpanContext | None, attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.context = SpanContext(parent.trace_id if parent else secrets.token_hex(16), secrets.token_hex(8))
+        self.parent_span_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns = None
+        self.error = None
+        self._token = None
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def record_exception(self, exception: BaseException) -> None:
+        self.error = f"{type(exception).__name__}: {exception}"
+
+    def end(self) -> None:
+        if self.end_time_ns is None:
+            self.end_time_ns = time.time_ns()
+            self.tracer._on_span_end(self)
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_value is not None and self.error is None:
+            self.record_exception(exc_value)
+        _current_span.reset(self._token)
+        self.end()
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.context.trace_id,
+            "span_id": self.context.span_id,
+            "parent_span_id": self.parent_span_id,
+            "start_time_unix_nano": self.start_time_ns,
+            "end_time_unix_nano": self.end_time_ns,
+            "duration_ms": round((self.end_time_ns - self.start_time_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """Span dùng khi tracing tắt: một instance dùng chung, mọi thao tác đều không làm gì."""
+
+    __slots__ = ()
+    context = None
+
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+    def set_attributes(self, **attributes) -> None:
+        pass
+
+    def record_exception(self, exception: BaseException) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class SpanExporter(ABC):
+    """Nơi gửi các span đã kết thúc, chọn bằng TRACING_EXPORTER. Được gọi từ thread export nền, theo lô."""
+
+    name: str = ""
+
+    @abstractmethod
+    def export(self, spans: list[dict], resource: dict) -> None:
+        ...
+
+
+class FileSpanExporter(SpanExporter):
+    """Ghi nối tiếp mỗi span một dòng JSON (có thể ghép trace của API và worker theo trace_id)."""
+
+    name = "file"
+
+    def __init__(self, file_path: str = TRACING_FILE_PATH):
+        self.file_path = file_path
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+
+    def export(self, spans: list[dict], resource: dict) -> None:
+        lines = "".join(json.dumps({**span, "resource": resource}, ensure_ascii=False, default=str) + "\n" for span in spans)
+        with open(self.file_path, "a", encoding="utf-8") as f_out:
+            f_out.write(lines)
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict) -> list[dict]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+class OtlpHttpSpanExporter(SpanExporter):
+    """Gửi span tới collector OTLP/HTTP (JSON, ví dụ OpenTelemetry Collector, Jaeger, Tempo) mà không cần SDK OpenTelemetry."""
+
+    name = "otlp"
+
+    def __init__(self, endpoint: str = TRACING_OTLP_ENDPOINT, timeout_seconds: float = 5.0):
+        self.endpoint = endpoint
+        self.timeout_seconds = timeout_seconds
+
+    def export(self, spans: list[dict], resource: dict) -> None:
+        otlp_spans = []
+        for span in spans:
+            otlp_span = {
+                "traceId": span["trace_id"],
+                "spanId": span["span_id"],
+                "name": span["name"],
+                "kind": 1,
+                "startTimeUnixNano": str(span["start_time_unix_nano"]),
+                "endTimeUnixNano": str(span["end_time_unix_nano"]),
+                "attributes": _otlp_attributes(span["attributes"]),
+                "status": {"code": 2, "message": span["error"]} if span["error"] else {"code": 1},
+            }
+            if span["parent_span_id"]:
+                otlp_span["parentSpanId"] = span["parent_span_id"]
+            otlp_spans.append(otlp_span)
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": _otlp_attributes(resource)},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": otlp_spans}],
+        }]}
+        request = urllib.request.Request(
+            self.endpoint, data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"}, method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout_seconds) as response:
+            response.read()
+
+
+_EXPORTER_CLASSES: dict[str, type[SpanExporter]] = {
+    FileSpanExporter.name: FileSpanExporter,
+    OtlpHttpSpanExporter.name: OtlpHttpSpanExporter,
+}
+
+
+class Tracer:
+    """
+    Tracer trong process. Khi tắt, `span()` trả về một span rỗng dùng chung nên chi phí chỉ là một lần gọi hàm.
+    Khi bật, span đã kết thúc được đưa vào hàng đợi và thread nền export theo lô, không chặn request/task.
+    Thread export được tạo lười theo pid, nên an toàn với các process con của Celery prefork.
+    """
+
+    def __init__(self,
+                 enabled: bool = TRACING_ENABLED,
+                 exporter_name: str = TRACING_EXPORTER,
+                 service_name: str = TRACING_SERVICE_NAME,
+                 batch_size: int = TRACING_EXPORT_BATCH_SIZE,
+                 export_interval_seconds: float = TRACING_EXPORT_INTERVAL_SECONDS):
+        self.enabled = enabled
+        self.exporter_name = exporter_name
+        self.service_name = service_name
+        self.batch_size = batch_size
+        self.export_interval_seconds = export_interval_seconds
+        self._exporter: SpanExporter | None = None
+        self._queue: queue.SimpleQueue | None = None
+        self._thread: threading.Thread | None = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if enabled and exporter_name not in _EXPORTER_CLASSES:
+            logger.warning(f"TRACING_EXPORTER không hợp lệ: '{exporter_name}'. Sử dụng 'file'.")
+            self.exporter_name = FileSpanExporter.name
+
+    def span(self, name: str, parent: SpanContext | None = None, **attributes):
+        """Span mới, con của `parent` hoặc của span hiện tại (nếu có)."""
+        if not self.enabled:
+            return _NOOP_SPAN
+        if parent is None:
+            current = _current_span.get()
+            parent = current.context if current is not None else None
+        return Span(self, name, parent, attributes)
+
+    def record_span(self, name: str, start_time: float, end_time: float, parent: SpanContext | None = None, **attributes) -> None:
+        """Ghi một span đã biết trước thời điểm bắt đầu/kết thúc (epoch giây), ví dụ thời gian task nằm trong broker."""
+        if not self.enabled:
+            return
+        recorded_span = self.span(name, parent=parent, **attributes)
+        recorded_span.start_time_ns = int(start_time * 1e9)
+        recorded_span.end_time_ns = int(max(end_time, start_time) * 1e9)
+        self._on_span_end(recorded_span)
+
+    def inject_headers(self) -> dict:
+        """Header để truyền trace hiện tại sang task Celery (W3C traceparent + thời điểm gửi)."""
+        if not self.enabled:
+            return {}
+        current = _current_span.get()
+        if current is None:
+            return {}
+        return {
+            TRACEPARENT_HEADER: f"00-{current.context.trace_id}-{current.context.span_id}-01",
+            ENQUEUED_AT_HEADER: time.time(),
+        }
+
+    @staticmethod
+    def extract_parent(traceparent: str | None) -> SpanContext | None:
+        if not traceparent:
+            return None
+        parts = traceparent.split("-")
+        if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+            logger.debug(f"Tracing: Header traceparent không hợp lệ: '{traceparent}'")
+            return None
+        return SpanContext(parts[1], parts[2])
+
+    def _resource(self) -> dict:
+        return {"service.name": self.service_name, "host.name": socket.gethostname(), "process.pid": os.getpid()}
+
+    def _ensure_export_thread(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._exporter = _EXPORTER_CLASSES[self.exporter_name]()
+            self._queue = queue.SimpleQueue()
+            self._thread = threading.Thread(target=self._export_loop, args=(self._queue,), name="tracing-exporter", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+            atexit.register(self.flush)
+
+    def _on_span_end(self, span: Span) -> None:
+        try:
+            self._ensure_export_thread()
+            self._queue.put(span.to_dict())
+        except Exception as e_enqueue:
+            logger.warning(f"Tracing: Không ghi nhận được span '{span.name}': {e_enqueue}")
+
+    def _drain(self, span_queue: queue.SimpleQueue, first_span: dict | None = None) -> list[dict]:
+        batch = [first_span] if first_span is not None else []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(span_queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _export(self, batch: list[dict]) -> None:
+        if not batch:
+            return
+        try:
+            self._exporter.export(batch, self._resource())
+        except Exception as e_export:
+            logger.warning(f"Tracing: Exporter '{self.exporter_name}' lỗi, bỏ {len(batch)} span: {e_export}")
+
+    def _export_loop(self, span_queue: queue.SimpleQueue) -> None:
+        while True:
+            try:
+                first_span = span_queue.get(timeout=self.export_interval_seconds)
+            except queue.Empty:
+                continue
+            self._export(self._drain(span_queue, first_span))
+
+    def flush(self) -> None:
+        """Export ngay các span còn trong hàng đợi (gọi khi process kết thúc)."""
+        if self._queue is None or self._pid != os.getpid():
+            return
+        while True:
+            batch = self._drain(self._queue)
+            if not batch:
+                return
+            self._export(batch)
+
+
+tracer = Tracer()
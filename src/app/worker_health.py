@@ -0,0 +1,210 @@
+import os
+import logging
+import threading
+from celery.signals import after_setup_logger, worker_init, worker_ready, worker_shutdown, worker_process_init, worker_process_shutdown, task_postrun
+from celery.worker.control import inspect_command
+
+from app.celery_app import celery_app
+from app.tasks import get_worker_services
+from app.infrastructure.worker_registry import get_worker_registry
+from app.metrics import metrics
+from app.tracing import tracer
+from app.logging_setup import configure_logging, flush_logging
+
+logger = logging.getLogger(__name__)
+
+_heartbeat_stop_event = threading.Event()
+# True khi task chạy trong process con (pool prefork): warm-up và kiểm tra sẵn sàng diễn ra ở từng process con
+_warm_up_in_child_processes = False
+
+
+def _uses_child_processes(worker) -> bool:
+    pool_cls = getattr(worker, "pool_cls", None)
+    return getattr(pool_cls, "__module__", "").endswith(".prefork")
+
+
+@after_setup_logger.connect
+def move_log_handlers_to_background_thread(logger=None, loglevel=None, **kwargs):
+    """Giữ handler Celery vừa tạo nhưng ghi log qua hàng đợi trên thread nền (và định dạng JSON nếu LOG_FORMAT=json)."""
+    configure_logging(level=loglevel or logging.INFO)
+
+
+@worker_init.connect
+def initialize_worker_services_before_consuming(sender=None, **kwargs):
+    """
+    Tải model trong process chính của worker, trước khi consumer được khởi động. Với pool solo/threads, warm-up
+    cũng chạy ở đây; với prefork, process con fork từ đây dùng chung model và tự warm-up (worker_process_init).
+    """
+    global _warm_up_in_child_processes
+    _warm_up_in_child_processes = _uses_child_processes(sender)
+    logger.info(f"Worker init: Bắt đầu khởi tạo WorkerServices (tải model{'' if _warm_up_in_child_processes else ' + warm-up'})...")
+    tracer.service_name = f"{tracer.service_name}-worker"
+    worker_services = get_worker_services(warm_up=not _warm_up_in_child_processes)
+    worker_services.hostname = getattr(sender, "hostname", None)
+
+
+@worker_ready.connect
+def gate_consuming_on_readiness(sender=None, **kwargs):
+    """Nếu model chưa tải được hoặc warm-up thất bại, ngừng nhận task từ mọi queue của worker này."""
+    worker_services = get_worker_services()
+    _start_heartbeat_thread(sender)
+    worker_services.publish_resident_models()
+    if _warm_up_in_child_processes and worker_services.tts_model.is_loaded():
+        logger.info("Worker ready: Model đã tải, mỗi process con sẽ warm-up trước khi nhận task.")
+        return
+    if worker_services.is_ready():
+        logger.info("Worker ready: Model đã tải và warm-up hoàn tất, bắt đầu nhận task.")
+        return
+
+    logger.critical("Worker ready: Worker CHƯA sẵn sàng (model lỗi hoặc warm-up thất bại). Ngừng nhận task từ các queue.")
+    consumer = sender
+    task_consumer = getattr(consumer, "task_consumer", None)
+    if consumer is None or task_consumer is None:
+        return
+    for queue in list(task_consumer.queues):
+        try:
+            consumer.cancel_task_queue(queue.name)
+            logger.warning(f"Worker ready: Đã hủy consumer cho queue '{queue.name}'.")
+        except Exception as e_cancel:
+            logger.error(f"Worker ready: Không thể hủy consumer cho queue '{queue.name}': {e_cancel}")
+
+
+@inspect_command()
+def tts_worker_health(state):
+    """Lệnh inspect: `celery -A app.celery_app inspect tts_worker_health`."""
+    return get_worker_services().health_snapshot()
+
+
+def _child_warmup_health(hostname: str, model_loaded: bool) -> dict:
+    """Với prefork, trạng thái warm-up là của các process con (process chính không warm-up)."""
+    warmups = list(get_worker_registry().get_process_warmups(hostname).values())
+    warmup_completed = bool(warmups) and all(warmup["completed"] for warmup in warmups)
+    warmup_seconds = [warmup["seconds"] for warmup in warmups if warmup.get("seconds") is not None]
+    return {
+        "warmup_completed": warmup_completed,
+        "warmup_seconds": max(warmup_seconds) if warmup_seconds else None,
+        "ready": model_loaded and warmup_completed,
+    }
+
+
+def _heartbeat_info(consumer) -> dict:
+    worker_services = get_worker_services()
+    health = worker_services.health_snapshot()
+    if _warm_up_in_child_processes and worker_services.hostname:
+        health.update(_child_warmup_health(worker_services.hostname, health["model_loaded"]))
+    controller = getattr(consumer, "controller", None)
+    task_consumer = getattr(consumer, "task_consumer", None)
+    return {
+        "model_loaded": health["model_loaded"],
+        "warmup_completed": health["warmup_completed"],
+        "warmup_seconds": health["warmup_seconds"],
+        "ready": health["ready"],
+        "concurrency": getattr(controller, "concurrency", 1) or 1,
+        "queues": [queue.name for queue in task_consumer.queues] if task_consumer is not None else [],
+        "available_models": worker_services.model_registry.known_model_ids(),
+    }
+
+
+def _heartbeat_loop(consumer, hostname: str) -> None:
+    registry = get_worker_registry()
+    while not _heartbeat_stop_event.is_set():
+        try:
+            registry.publish_heartbeat(hostname, _heartbeat_info(consumer))
+            registry.flush_counter_deltas(metrics.pop_counter_deltas())
+        except Exception as e_heartbeat:
+            logger.warning(f"Heartbeat: Không gửi được heartbeat của worker '{hostname}': {e_heartbeat}")
+        _heartbeat_stop_event.wait(registry.heartbeat_interval_seconds)
+
+
+def _start_heartbeat_thread(consumer) -> None:
+    hostname = getattr(consumer, "hostname", None)
+    if not hostname:
+        logger.warning("Heartbeat: Không xác định được hostname của worker, bỏ qua heartbeat.")
+        return
+    heartbeat_thread = threading.Thread(target=_heartbeat_loop, args=(consumer, hostname), name="tts-worker-heartbeat", daemon=True)
+    heartbeat_thread.start()
+    logger.info(f"Heartbeat: Bắt đầu gửi heartbeat cho worker '{hostname}'.")
+
+
+@worker_shutdown.connect
+def stop_heartbeat(sender=None, **kwargs):
+    _heartbeat_stop_event.set()
+
+
+@worker_process_init.connect
+def reset_counter_baseline_in_child(sender=None, **kwargs):
+    """Process con kế thừa counter của process cha khi fork; bỏ qua chúng để không cộng dồn hai lần."""
+    metrics.pop_counter_deltas()
+
+
+def _consumed_queue_names() -> list[str]:
+    return list(celery_app.amqp.queues.consume_from or {})
+
+
+@worker_process_init.connect
+def warm_up_child_before_consuming(sender=None, **kwargs):
+    """
+    Process con chạy task (prefork) tự warm-up trước khi nhận task đầu tiên. Nếu thất bại, worker ngừng nhận task
+    từ mọi queue như khi process chính không sẵn sàng.
+    """
+    if not _warm_up_in_child_processes:
+        return
+    worker_services = get_worker_services()
+    worker_services.warm_up_process()
+    hostname = worker_services.hostname
+    if hostname:
+        try:
+            get_worker_registry().set_process_warmup(hostname, os.getpid(), {
+                "completed": worker_services.warmup_completed, "seconds": worker_services.warmup_seconds
+            })
+        except Exception as e_publish:
+            logger.warning(f"Worker process init: Không ghi được trạng thái warm-up của process {os.getpid()}: {e_publish}")
+    if worker_services.is_ready():
+        logger.info(f"Worker process init: Process {os.getpid()} đã warm-up xong, sẵn sàng nhận task.")
+        return
+
+    logger.critical(f"Worker process init: Process {os.getpid()} CHƯA sẵn sàng (model lỗi hoặc warm-up thất bại). Ngừng nhận task từ các queue.")
+    if not hostname:
+        return
+    for queue_name in _consumed_queue_names():
+        try:
+            celery_app.control.cancel_consumer(queue_name, destination=[hostname])
+            logger.warning(f"Worker process init: Đã hủy consumer cho queue '{queue_name}'.")
+        except Exception as e_cancel:
+            logger.error(f"Worker process init: Không thể hủy consumer cho queue '{queue_name}': {e_cancel}")
+
+
+def _flush_process_counters() -> None:
+    try:
+        get_worker_registry().flush_counter_deltas(metrics.pop_counter_deltas())
+    except Exception as e_flush:
+        logger.warning(f"Không cộng được counter của process {os.getpid()} vào fleet counters: {e_flush}")
+
+
+@task_postrun.connect
+def flush_counters_after_task(sender=None, **kwargs):
+    """
+    Với pool prefork, task chạy trong process con còn heartbeat chỉ chạy ở process chính; process con tự cộng
+    counter của mình (task hủy, truncation...) vào fleet counters sau mỗi task.
+    """
+    _flush_process_counters()
+
+
+@worker_process_shutdown.connect
+def release_models_on_child_exit(sender=None, **kwargs):
+    """Process con bị thu hồi (max_tasks_per_child...): các model nó tải thêm mất theo, trả lại queue tương ứng."""
+    try:
+        worker_services = get_worker_services()
+        worker_services.release_process_models()
+        if _warm_up_in_child_processes and worker_services.hostname:
+            get_worker_registry().set_process_warmup(worker_services.hostname, os.getpid(), None)
+    except Exception as e_release:
+        logger.debug(f"Không trả lại được queue của các model khi process con kết thúc: {e_release}")
+
+
+@worker_process_shutdown.connect
+def flush_traces_on_child_exit(sender=None, **kwargs):
+    """Process con của prefork thoát bằng os._exit nên atexit không chạy; export nốt counter, span và log còn trong hàng đợi."""
+    _flush_process_counters()
+    tracer.flush()
+    flush_logging()